@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+
+"""
+admission.py -- Udacity conference server-side Python App Engine
+    admission control for the endpoints: per-user token buckets kept in
+    memcache, and load shedding of the most expensive calls first when
+    datastore latency rises
+
+"""
+
+import functools
+import math
+import os
+import time
+
+import endpoints
+from google.appengine.api import memcache
+
+from instrumentation import datastoreLatencyMs
+from models import ServiceUnavailableException
+from models import TooManyRequestsException
+from settings import RATE_LIMITS
+from settings import SHED_LATENCY_MS
+from utils import getUserId
+
+MEMCACHE_BUCKET_KEY = "BUCKET_%s_%s_%d"
+MEMCACHE_SHED_LEVEL_KEY = "LOAD_SHED_LEVEL"
+# buckets start over every period, so idle credit never outlives it
+BUCKET_PERIOD = 3600
+# how long an instance trusts its copy of the forced shed level
+SHED_POLL_SECONDS = 10
+
+# priorities; the highest are shed first and CRITICAL never
+CRITICAL = 0
+NORMAL = 1
+EXPENSIVE = 2
+
+# (burst, tokens per second) per endpoint method; '*' is the bucket each
+# user shares across all admission-controlled methods
+DEFAULT_RATE = (20, 2.0)
+RATES = {
+    '*': (60, 10.0),
+    'registerForConference': (5, 0.2),
+    'unregisterFromConference': (5, 0.2),
+    'addSessionToWishlist': (10, 0.5),
+    'deleteSessionFromWishlist': (10, 0.5),
+    'createConference': (5, 0.05),
+    'updateConference': (10, 0.2),
+    'createSession': (20, 0.2),
+    'saveProfile': (5, 0.1),
+    'queryConferences': (20, 1.0),
+    'getConferencesBatch': (10, 0.5),
+    'sync': (10, 0.2),
+}
+
+_forcedLevel = {'level': 0, 'checked': 0.0}
+
+
+def rateFor(name):
+    """Return the (burst, tokens per second) of a method's bucket."""
+    return RATE_LIMITS.get(name) or RATES.get(name, DEFAULT_RATE)
+
+
+def setShedLevel(level):
+    """Force every instance to shed at least level (0 to stop forcing);
+    instances pick it up within SHED_POLL_SECONDS."""
+    memcache.set(MEMCACHE_SHED_LEVEL_KEY, int(level))
+
+
+def forcedShedLevel():
+    """Return the level forced with setShedLevel, polled from memcache at
+    most once every SHED_POLL_SECONDS."""
+    now = time.time()
+    if now - _forcedLevel['checked'] > SHED_POLL_SECONDS:
+        _forcedLevel['level'] = memcache.get(MEMCACHE_SHED_LEVEL_KEY) or 0
+        _forcedLevel['checked'] = now
+    return _forcedLevel['level']
+
+
+def shedLevel():
+    """Number of SHED_LATENCY_MS thresholds this instance's datastore
+    latency is over, or the forced level if higher."""
+    latency = datastoreLatencyMs()
+    level = sum(1 for threshold in SHED_LATENCY_MS if latency > threshold)
+    return max(level, forcedShedLevel())
+
+
+def _caller():
+    """Identify the caller by user id, or by address when signed out."""
+    user = endpoints.get_current_user()
+    if user:
+        return getUserId(user)
+    return 'ip:%s' % os.environ.get('REMOTE_ADDR', '')
+
+
+def takeTokens(buckets, elapsed):
+    """Spend a token from each of buckets, a list of (key, burst, rate),
+    with one memcache offset_multi.  A bucket's key counts the tokens
+    spent since its period began elapsed seconds ago; it may have spent
+    burst plus what the rate has refilled since.  Idle credit beyond the
+    burst is spent on the spot, so a bucket never holds more than burst.
+    If memcache is down, calls are admitted.
+    Returns: seconds until every bucket has a token again, 0 if admitted"""
+    spent = memcache.offset_multi(
+        dict((key, 1) for key, _, _ in buckets), initial_value=0) or {}
+    wait = 0.0
+    offsets = {}
+    for key, burst, rate in buckets:
+        count = spent.get(key)
+        if count is None:
+            continue
+        allowance = burst + int(rate * elapsed)
+        if count > allowance:
+            wait = max(wait, (count - allowance) / float(rate))
+        elif allowance - count > burst:
+            offsets[key] = allowance - count - burst
+    if wait:
+        # rejected calls don't spend tokens
+        for key, _, _ in buckets:
+            offsets[key] = offsets.get(key, 0) - 1
+    if offsets:
+        memcache.offset_multi(offsets, initial_value=0)
+    return wait
+
+
+def admit(name, priority=NORMAL):
+    """Admit a call to method name or raise: 503 while its priority is
+    being shed, 429 when the caller's bucket for the method, or the one
+    the caller shares across methods, is empty."""
+    if priority > CRITICAL and priority > EXPENSIVE - shedLevel():
+        raise ServiceUnavailableException(
+            'Server busy, %s is temporarily unavailable' % name)
+    caller = _caller()
+    now = time.time()
+    period = int(now // BUCKET_PERIOD)
+    wait = takeTokens(
+        [(MEMCACHE_BUCKET_KEY % (bucket, caller, period),) + rateFor(bucket)
+         for bucket in (name, '*')],
+        now - period * BUCKET_PERIOD)
+    if wait:
+        raise TooManyRequestsException(
+            'Rate limit exceeded for %s, retry in %d seconds' %
+            (name, math.ceil(wait)))
+
+
+def admissionControl(priority=NORMAL):
+    """Decorator for endpoint methods, applied below @endpoints.method so
+    the current user is known: admit each call before running it."""
+    def decorator(method):
+        name = method.__name__
+
+        @functools.wraps(method)
+        def admitted(service, request):
+            admit(name, priority)
+            return method(service, request)
+        return admitted
+    return decorator
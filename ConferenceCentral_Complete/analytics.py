@@ -0,0 +1,335 @@
+#!/usr/bin/env python
+
+"""
+analytics.py -- Udacity conference server-side Python App Engine
+    attendance and capacity statistics computed with numpy from the
+    analytics export and published for getConferenceStats; each run folds
+    only the export runs newer than the last into running aggregates
+
+"""
+
+import csv
+import gzip
+import json
+from cStringIO import StringIO
+from datetime import datetime
+
+import numpy as np
+
+from google.appengine.api import memcache
+
+from conference import CONFERENCE_STATS_ID
+from conference import MEMCACHE_BURNDOWN_KEY
+from conference import MEMCACHE_CONFERENCE_STATS_KEY
+from export import EXPORT_PREFIX
+from export import deleteFile
+from export import listFiles
+from export import openFile
+from models import ConferenceStats
+
+PERCENTILES = (50, 90)
+MEMCACHE_BATCH = 1000
+# the running aggregates, named after the newest conferences and
+# registrations runs folded into them
+STATE_PATH = EXPORT_PREFIX + '/analytics/state-%s-%s.json.gz'
+
+
+def readTable(table, after=None):
+    """Read the exported runs of table newer than run after, oldest first.
+    Returns: (dict of column name to numpy string array, or None when no
+    run is newer; the newest run read, else after)"""
+    columns = None
+    rows = []
+    manifests = [path for path in listFiles('%s/%s/' % (EXPORT_PREFIX, table))
+                 if path.endswith('/manifest.json')]
+    for path in manifests:
+        run_dir = path.rsplit('/', 1)[0]
+        run = run_dir.rsplit('/', 1)[1]
+        # run ids are start times, and a table's runs finish in order
+        if after is not None and run <= after:
+            continue
+        with openFile(path) as f:
+            manifest = json.loads(f.read())
+        columns = manifest['columns']
+        after = run
+        for chunk in manifest['chunks']:
+            with openFile('%s/%s' % (run_dir, chunk)) as f:
+                reader = csv.reader(gzip.GzipFile(fileobj=StringIO(f.read())))
+                reader.next()
+                rows.extend(reader)
+    if columns is None:
+        return None, after
+    if not rows:
+        return dict((name, np.array([], dtype=str)) for name in columns), after
+    return dict((name, np.array(values)) for name, values
+                in zip(columns, zip(*rows))), after
+
+
+def _concat(old, new):
+    """Append the rows of table new to table old; either may be None."""
+    if old is None or new is None:
+        return new if old is None else old
+    return dict((name, np.concatenate([old[name], new[name]]))
+                for name in old)
+
+
+def loadState(path):
+    """Read the running aggregates saveState wrote to path."""
+    with openFile(path) as f:
+        state = json.loads(gzip.GzipFile(fileobj=StringIO(f.read())).read())
+    for name in ('conferences', 'registrations'):
+        if state[name] is not None:
+            # back to the UTF-8 byte strings the export CSVs hold
+            state[name] = dict(
+                (column, np.array([v.encode('utf-8') for v in values],
+                                  dtype=str))
+                for column, values in state[name].items())
+    return state
+
+
+def saveState(path, state):
+    """Write the running aggregates to path as gzipped JSON."""
+    data = dict(state)
+    for name in ('conferences', 'registrations'):
+        if data[name] is not None:
+            data[name] = dict((column, values.tolist())
+                              for column, values in data[name].items())
+    buf = StringIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb') as gz:
+        gz.write(json.dumps(data, separators=(',', ':')))
+    with openFile(path, 'w') as f:
+        f.write(buf.getvalue())
+
+
+def _ints(values):
+    return np.array([int(v) if v else 0 for v in values], dtype=np.int64)
+
+
+def _sortedRuns(keys, updated):
+    """Order rows by key then updated time and drop the duplicates that
+    overlapping export runs produce.
+    Returns: index array of the remaining rows"""
+    order = np.lexsort((updated, keys))
+    keys = keys[order]
+    updated = updated[order]
+    fresh = np.r_[True, (keys[1:] != keys[:-1]) |
+                        (updated[1:] != updated[:-1])]
+    return order[fresh]
+
+
+def _lastPerGroup(groups):
+    """Mask of the last row of each run of equal values in sorted groups."""
+    return np.r_[groups[1:] != groups[:-1], True]
+
+
+def latestConferences(table):
+    """The newest exported row of every conference.
+    Returns: dict of column name to array, one entry per conference"""
+    rows = _sortedRuns(table['key'], table['updated'])
+    rows = rows[_lastPerGroup(table['key'][rows])]
+    return dict((name, values[rows]) for name, values in table.items())
+
+
+def latestRegistrations(table):
+    """The rows of each profile's newest export snapshot, once each; those
+    are its current registrations, or one row with an empty conferenceKey
+    if it has none.
+    Returns: dict of column name to array"""
+    if table is None or not len(table['profileId']):
+        return table
+    order = np.lexsort((table['conferenceKey'], table['updated'],
+                        table['profileId']))
+    profiles = table['profileId'][order]
+    updated = table['updated'][order]
+    confs = table['conferenceKey'][order]
+
+    # broadcast each profile's newest snapshot time over its rows
+    group = np.cumsum(np.r_[True, profiles[1:] != profiles[:-1]]) - 1
+    newest = updated[_lastPerGroup(profiles)][group]
+    # the same registration can appear in two overlapping runs
+    fresh = np.r_[True, (profiles[1:] != profiles[:-1]) |
+                        (updated[1:] != updated[:-1]) |
+                        (confs[1:] != confs[:-1])]
+    rows = order[(updated == newest) & fresh]
+    return dict((name, values[rows]) for name, values in table.items())
+
+
+def registrationCounts(latest, conf_keys):
+    """Count current registrations per conference from the rows
+    latestRegistrations returns.
+    Returns: int array parallel to conf_keys"""
+    counts = np.zeros(len(conf_keys), dtype=np.int64)
+    if latest is None:
+        return counts
+    confs = latest['conferenceKey'][latest['conferenceKey'] != '']
+    conf_names, conf_ids = np.unique(confs, return_inverse=True)
+    if not len(conf_names):
+        return counts
+    per_conf = np.bincount(conf_ids, minlength=len(conf_names))
+
+    # map onto conf_keys; registrations of unknown conferences are dropped
+    sorter = np.argsort(conf_keys)
+    pos = np.searchsorted(conf_keys[sorter], conf_names)
+    pos = np.minimum(pos, len(conf_keys) - 1)
+    found = conf_keys[sorter[pos]] == conf_names
+    counts[sorter[pos[found]]] = per_conf[found]
+    return counts
+
+
+def groupStats(groups, capacity, registered):
+    """Aggregate conferences per group value: conference count, seats,
+    registrations, overall fill rate and percentiles of the per-conference
+    fill rate.
+    Returns: list of [group, conferences, seats, registered, fill rate,
+    fill rate percentiles...] rows"""
+    if not len(groups):
+        return []
+    names, idx = np.unique(groups, return_inverse=True)
+    n = len(names)
+    count = np.bincount(idx, minlength=n)
+    seats = np.bincount(idx, weights=capacity, minlength=n)
+    regs = np.bincount(idx, weights=registered, minlength=n)
+    fill = registered / capacity.astype(np.float64)
+
+    # sort fill rates within each group; group i then occupies
+    # [starts[i], starts[i] + count[i])
+    sorted_fill = fill[np.lexsort((fill, idx))]
+    starts = np.cumsum(count) - count
+    columns = [names.tolist(), count.tolist(), seats.astype(np.int64).tolist(),
+               regs.astype(np.int64).tolist(),
+               np.round(regs / seats, 4).tolist()]
+    for pct in PERCENTILES:
+        rank = np.round((count - 1) * pct / 100.0).astype(np.int64)
+        columns.append(np.round(sorted_fill[starts + rank], 4).tolist())
+    return [list(row) for row in zip(*columns)]
+
+
+def registrationsPerDay(table):
+    """Net registrations per day, from the change in booked seats
+    (maxAttendees - seatsAvailable) between consecutive exported snapshots
+    of each conference.
+    Returns: list of [date, registrations] rows"""
+    rows = _sortedRuns(table['key'], table['updated'])
+    keys = table['key'][rows]
+    if len(keys) < 2:
+        return []
+    booked = (_ints(table['maxAttendees'][rows]) -
+              _ints(table['seatsAvailable'][rows]))
+    days = np.array([u[:10] for u in table['updated'][rows]])
+    same = keys[1:] == keys[:-1]
+    delta = (booked[1:] - booked[:-1])[same]
+    if not len(delta):
+        return []
+    names, idx = np.unique(days[1:][same], return_inverse=True)
+    totals = np.bincount(idx, weights=delta, minlength=len(names))
+    return [[day, int(total)] for day, total in zip(names, totals)]
+
+
+def burnDowns(table):
+    """Seats left at the end of each day with an exported snapshot, per
+    conference.
+    Returns: dict of websafe conference key to [[date, seats], ...]"""
+    rows = _sortedRuns(table['key'], table['updated'])
+    keys = table['key'][rows]
+    seats = _ints(table['seatsAvailable'][rows])
+    days = np.array([u[:10] for u in table['updated'][rows]])
+    if not len(keys):
+        return {}
+    last = np.r_[(keys[1:] != keys[:-1]) | (days[1:] != days[:-1]), True]
+    curves = {}
+    for key, day, left in zip(keys[last], days[last], seats[last]):
+        curves.setdefault(key, []).append([day, int(left)])
+    return curves
+
+
+def mergeCurves(curves, points):
+    """Extend the stored burn-down curves with the points burnDowns found
+    in the rows folded since; a point for a curve's last day replaces it.
+    Returns: curves"""
+    for key, new in points.items():
+        curve = curves.setdefault(key, [])
+        for day, left in new:
+            if curve and curve[-1][0] == day:
+                curve[-1] = [day, left]
+            elif not curve or curve[-1][0] < day:
+                curve.append([day, left])
+    return curves
+
+
+def computeStats():
+    """Fold the export runs newer than the last ones folded into the
+    running aggregates: the newest row of every conference and the newest
+    registrations snapshot of every profile, registrations per day and
+    burn-down curves.  Compute the getConferenceStats tables from them and
+    publish them to memcache, with a datastore copy of the overall tables.
+    Returns: number of conferences covered"""
+    entity = ConferenceStats.get_by_id(CONFERENCE_STATS_ID)
+    if entity and entity.state:
+        state = loadState(entity.state)
+        folded = entity.folded
+    else:
+        state = {'conferences': None, 'registrations': None,
+                 'perDay': {}, 'burnDowns': {}}
+        folded = {}
+    conf_rows, conf_run = readTable('conferences', folded.get('conferences'))
+    reg_rows, reg_run = readTable('registrations',
+                                  folded.get('registrations'))
+
+    # the newest row of each conference stands in for its history: new
+    # rows are compared against it for registrations per day and burn-down
+    history = _concat(state['conferences'], conf_rows)
+    if history is None or not len(history['key']):
+        return 0
+    confs = latestConferences(history)
+    registrations = latestRegistrations(_concat(state['registrations'],
+                                                reg_rows))
+    per_day = state['perDay']
+    for day, count in registrationsPerDay(history):
+        per_day[day] = per_day.get(day, 0) + count
+    curves = mergeCurves(state['burnDowns'], burnDowns(history))
+
+    capacity = _ints(confs['maxAttendees'])
+    registered = registrationCounts(registrations, confs['key'])
+
+    # fill rates only mean something for conferences with a capacity
+    limited = capacity > 0
+    capacity = capacity[limited]
+    registered = registered[limited]
+    cities = confs['city'][limited]
+    months = _ints(confs['month'])[limited]
+    topic_lists = [t.split('|') if t else [] for t in confs['topics'][limited]]
+    per_conf = np.array([len(topics) for topics in topic_lists],
+                        dtype=np.int64)
+    topics = np.array([topic for topic_list in topic_lists
+                       for topic in topic_list])
+
+    stats = {
+        'computed': datetime.utcnow().isoformat(),
+        'byCity': groupStats(cities, capacity, registered),
+        'byTopic': groupStats(topics, np.repeat(capacity, per_conf),
+                              np.repeat(registered, per_conf)),
+        'byMonth': groupStats(months, capacity, registered),
+        'registrationsPerDay': [[day, count] for day, count
+                                in sorted(per_day.items())],
+    }
+    stored = ConferenceStats(id=CONFERENCE_STATS_ID, stats=stats)
+    if entity and (conf_rows is None and reg_rows is None):
+        stored.populate(state=entity.state, folded=entity.folded)
+    else:
+        # the entity put is what commits the new state; a run that fails
+        # before it leaves the old state and folds the same runs again
+        stored.state = STATE_PATH % (conf_run, reg_run)
+        stored.folded = {'conferences': conf_run, 'registrations': reg_run}
+        saveState(stored.state, {'conferences': confs,
+                                 'registrations': registrations,
+                                 'perDay': per_day, 'burnDowns': curves})
+    stored.put()
+    if entity and entity.state and entity.state != stored.state:
+        deleteFile(entity.state)
+    memcache.set(MEMCACHE_CONFERENCE_STATS_KEY, stats)
+
+    curves = curves.items()
+    for i in range(0, len(curves), MEMCACHE_BATCH):
+        memcache.set_multi(dict(curves[i:i + MEMCACHE_BATCH]),
+                           key_prefix=MEMCACHE_BURNDOWN_KEY)
+    return len(confs['key'])
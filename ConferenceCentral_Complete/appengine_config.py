@@ -0,0 +1,11 @@
+"""
+appengine_config.py -- Udacity conference server-side Python App Engine
+    puts the third party libraries vendored under lib/ on sys.path
+
+"""
+
+import os
+
+from google.appengine.ext import vendor
+
+vendor.add(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lib'))
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+
+"""
+archive.py -- Udacity conference server-side Python App Engine
+    moves finished conferences and their sessions out of the live kinds
+    into ConferenceArchive snapshots, and resolves their keys from there
+
+"""
+
+import operator
+from datetime import date
+
+from google.appengine.ext import ndb
+
+from entitycache import getMulti
+from models import Conference
+from models import ConferenceArchive
+from models import Session
+from models import VersionedModel
+
+BATCH_SIZE = 100
+ARCHIVE_URL = '/tasks/archive_conferences'
+# memcache version of an archived entity: matches no cached copy, and
+# add_multi of a version loaded before the archive can't replace it
+ARCHIVED_VERSION = -1
+# Conference fields copied to indexed ConferenceArchive properties
+ARCHIVE_FIELDS = ('city', 'topics', 'month', 'maxAttendees', 'startDate')
+
+# python equivalents of the query operators in conference.OPERATORS
+MATCHERS = {
+    '=': operator.eq,
+    '>': operator.gt,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '<=': operator.le,
+    '!=': operator.ne,
+}
+
+
+def archiveKey(conf_key):
+    """Return the ConferenceArchive key of a Conference key."""
+    return ndb.Key(ConferenceArchive, conf_key.id(), parent=conf_key.parent())
+
+
+def _restoreConference(archive):
+    conf = archive.conference
+    conf.key = ndb.Key(Conference, archive.key.id(),
+                       parent=archive.key.parent())
+    return conf
+
+
+def _restoreSessions(archive):
+    for sess, s_key in zip(archive.sessions, archive.sessionKeys):
+        sess.key = s_key
+    return archive.sessions
+
+
+def _archiveFields(conf):
+    return dict((name, getattr(conf, name)) for name in ARCHIVE_FIELDS)
+
+
+def _retireVersions(keys):
+    """Replace the memcache versions of deleted entities with
+    ARCHIVED_VERSION, so no instance keeps serving its cached copy."""
+    VersionedModel.publishVersions(dict((key, ARCHIVED_VERSION)
+                                        for key in keys))
+
+
+@ndb.transactional()
+def archiveConference(conf_key):
+    """Snapshot a conference and its sessions into a ConferenceArchive and
+    delete them; all share the organizer's entity group, so this is atomic.
+    Returns: True if the conference was archived"""
+    conf = conf_key.get()
+    if not conf:
+        return False
+    sessions = Session.query(ancestor=conf_key).fetch()
+    ConferenceArchive(
+        key=archiveKey(conf_key),
+        conference=conf,
+        sessions=sessions,
+        sessionKeys=[sess.key for sess in sessions],
+        **_archiveFields(conf)
+    ).put()
+    deleted = [conf_key] + [sess.key for sess in sessions]
+    ndb.delete_multi(deleted)
+    ndb.get_context().call_on_commit(lambda: _retireVersions(deleted))
+    return True
+
+
+def archiveFinishedConferences(before=None, cursor=None):
+    """Archive the next batch of conferences whose endDate is before the
+    date before (today by default).
+    Returns: (before, cursor of the next batch or None)"""
+    before = before or date.today()
+    keys, next_cursor, more = Conference.query(
+        Conference.endDate < before).fetch_page(
+        BATCH_SIZE, start_cursor=cursor, keys_only=True)
+    for conf_key in keys:
+        archiveConference(conf_key)
+    return before, (next_cursor if more and next_cursor else None)
+
+
+def fillArchiveFields(archive):
+    """Mapper over ConferenceArchive: copy the filterable fields of the
+    snapshot to the indexed properties queryArchived uses."""
+    fields = _archiveFields(archive.conference)
+    if any(getattr(archive, name) != value for name, value in fields.items()):
+        archive.populate(**fields)
+        return archive
+
+
+def getConferences(conf_keys):
+    """get_multi for Conference keys, through the instance cache; archived
+    conferences are restored from their snapshots with one more get_multi.
+    The live ones are shared with other requests and must not be modified.
+    Returns: list of Conference or None, in key order"""
+    confs = getMulti(conf_keys)
+    missing = [i for i, conf in enumerate(confs) if conf is None]
+    if missing:
+        archives = ndb.get_multi([archiveKey(conf_keys[i]) for i in missing])
+        for i, archive in zip(missing, archives):
+            if archive:
+                confs[i] = _restoreConference(archive)
+    return confs
+
+
+def getSessions(s_keys):
+    """get_multi for Session keys, through the instance cache; sessions of
+    archived conferences are restored from their conference's snapshot.
+    Returns: list of Session or None, in key order"""
+    sessns = getMulti(s_keys)
+    missing = [i for i, sess in enumerate(sessns) if sess is None]
+    if missing:
+        conf_keys = list(set(s_keys[i].parent() for i in missing))
+        restored = {}
+        for archive in ndb.get_multi([archiveKey(k) for k in conf_keys]):
+            if archive:
+                for sess in _restoreSessions(archive):
+                    restored[sess.key] = sess
+        for i in missing:
+            sessns[i] = restored.get(s_keys[i])
+    return sessns
+
+
+def getArchivedSessions(conf_key):
+    """Return the sessions of an archived conference, or []."""
+    archive = archiveKey(conf_key).get()
+    return _restoreSessions(archive) if archive else []
+
+
+def _matches(conf, filters):
+    """Apply formatted queryConferences filters in memory; like the
+    datastore, a repeated property matches if any of its values does."""
+    for filtr in filters:
+        values = getattr(conf, filtr['field'])
+        if not isinstance(values, list):
+            values = [values]
+        match = MATCHERS[filtr['operator']]
+        if not any(value is not None and match(value, filtr['value'])
+                   for value in values):
+            return False
+    return True
+
+
+def queryArchived(filters):
+    """Return the archived conferences matching formatted filters.  The
+    equality filters, or else the inequality ones, are queried on the
+    archive's indexed fields, so the built-in indexes serve every query;
+    the rest are applied to the snapshots in memory."""
+    equalities = [filtr for filtr in filters if filtr['operator'] == '=']
+    if equalities:
+        queried = equalities
+        rest = [filtr for filtr in filters if filtr['operator'] != '=']
+    else:
+        queried, rest = filters, []
+    q = ConferenceArchive.query()
+    for filtr in queried:
+        q = q.filter(ndb.FilterNode(filtr['field'], filtr['operator'],
+                                    filtr['value']))
+    return [conf for conf in
+            (_restoreConference(archive) for archive in
+             q.iter(batch_size=BATCH_SIZE))
+            if _matches(conf, rest)]
@@ -0,0 +1,432 @@
+#!/usr/bin/env python
+
+"""
+benchmark.py -- drives every ConferenceApi endpoint method against the
+    App Engine testbed stubs with synthetic fixtures and reports latency
+    percentiles, RPC counts and memory per endpoint as a JSON baseline
+
+usage: APPENGINE_SDK=/path/to/google_appengine \\
+    python benchmarks/benchmark.py --size small --calls 2000 \\
+    --output benchmarks/baseline.json [--compare old_baseline.json]
+
+"""
+
+import argparse
+import json
+import random
+import resource
+import sys
+import time
+
+import harness
+
+
+def percentile(values, pct):
+    """Return the pct percentile of values (nearest rank)."""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    rank = int(round(pct / 100.0 * (len(ordered) - 1)))
+    return ordered[rank]
+
+
+class Drivers(object):
+    """Drivers -- one method per endpoint building a realistic request
+    from the fixtures and calling it; WEIGHTS gives the request mix"""
+
+    WEIGHTS = {
+        'getConference': 20,
+        'getConferenceDetail': 10,
+        'getConferencesBatch': 4,
+        'sync': 4,
+        'queryConferences': 15,
+        'getConferenceSessions': 12,
+        'getProfile': 10,
+        'getConferencesToAttend': 8,
+        'getSessionsInWishlist': 8,
+        'getAnnouncement': 6,
+        'getFeaturedSpeaker': 4,
+        'getTrendingSessions': 4,
+        'getTrendingConferences': 2,
+        'getRecommendedSessions': 4,
+        'getConferenceStats': 2,
+        'getConferenceSessionsByType': 3,
+        'getSessionsBySpeaker': 3,
+        'getSessionsBeforeTime': 2,
+        'getSessionsAfterTime': 2,
+        'getConferencesCreated': 2,
+        'addSessionToWishlist': 3,
+        'deleteSessionFromWishlist': 2,
+        'registerForConference': 3,
+        'unregisterFromConference': 2,
+        'saveProfile': 1,
+        'createConference': 1,
+        'updateConference': 1,
+        'createSession': 1,
+        'filterPlayground': 1,
+        'task3Solution': 1,
+    }
+
+    def __init__(self, api, stubs, fixtures, rnd):
+        import conference
+        self.c = conference
+        self.api = api
+        self.stubs = stubs
+        self.fx = fixtures
+        self.rnd = rnd
+        # ETags from earlier responses, resent like a polling client
+        self.etags = {}
+        self.syncToken = None
+
+    def _user(self):
+        self.stubs.setUser(self.rnd.choice(self.fx['profiles']).id())
+
+    def _organizer(self, c_key):
+        self.stubs.setUser(c_key.parent().id())
+
+    def _wsck(self):
+        return self.rnd.choice(self.fx['conferences']).urlsafe()
+
+    def _wssk(self):
+        return self.rnd.choice(self.fx['sessions']).urlsafe()
+
+    def _conferenceKey(self, **fields):
+        return self.c.CONF_GET_REQUEST.combined_message_class(**fields)
+
+    def getConference(self):
+        self._user()
+        wsck = self._wsck()
+        form = self.api.getConference(
+            self.c.CONF_GET_COND_REQUEST.combined_message_class(
+                websafeConferenceKey=wsck, ifNoneMatch=self.etags.get(wsck)))
+        self.etags[wsck] = form.etag
+        return form
+
+    def getConferenceDetail(self):
+        self._user()
+        return self.api.getConferenceDetail(
+            self.c.CONF_DETAIL_REQUEST.combined_message_class(
+                websafeConferenceKey=self._wsck(),
+                summary=self.rnd.random() < 0.5))
+
+    def getConferencesBatch(self):
+        self._user()
+        return self.api.getConferencesBatch(
+            self.c.CONF_BATCH_REQUEST.combined_message_class(
+                websafeConferenceKeys=[self._wsck() for _ in range(20)]))
+
+    def sync(self):
+        # clients resume from the token the previous sync returned
+        self._user()
+        form = self.api.sync(self.c.SYNC_REQUEST.combined_message_class(
+            since=self.syncToken))
+        self.syncToken = form.nextToken
+        return form
+
+    def queryConferences(self):
+        from models import ConferenceQueryForm, ConferenceQueryForms
+        self._user()
+        filters = [ConferenceQueryForm(field='CITY', operator='EQ',
+                                       value=self.rnd.choice(harness.CITIES))]
+        if self.rnd.random() < 0.5:
+            filters.append(ConferenceQueryForm(
+                field='MONTH', operator='EQ', value=str(self.rnd.randint(1, 12))))
+        return self.api.queryConferences(ConferenceQueryForms(
+            filters=filters, fields=self._fields()))
+
+    def getConferenceSessions(self):
+        self._user()
+        return self.api.getConferenceSessions(
+            self.c.SESS_GET_REQ.combined_message_class(
+                websafeConferenceKey=self._wsck()))
+
+    def getProfile(self):
+        self._user()
+        return self.api.getProfile(
+            self.c.PROFILE_GET_REQUEST.combined_message_class())
+
+    def _fields(self):
+        # half the clients only show a ticker of names and free seats
+        if self.rnd.random() < 0.5:
+            return ['name', 'seatsAvailable']
+        return []
+
+    def getConferencesToAttend(self):
+        self._user()
+        return self.api.getConferencesToAttend(
+            self.c.FIELDS_GET_REQUEST.combined_message_class(
+                fields=self._fields()))
+
+    def getSessionsInWishlist(self):
+        self._user()
+        return self.api.getSessionsInWishlist(
+            self.c.FIELDS_GET_REQUEST.combined_message_class())
+
+    def getAnnouncement(self):
+        from protorpc import message_types
+        return self.api.getAnnouncement(message_types.VoidMessage())
+
+    def getFeaturedSpeaker(self):
+        from protorpc import message_types
+        return self.api.getFeaturedSpeaker(message_types.VoidMessage())
+
+    def getTrendingSessions(self):
+        wsck = self._wsck() if self.rnd.random() < 0.5 else None
+        return self.api.getTrendingSessions(
+            self.c.TRENDING_GET_REQ.combined_message_class(
+                websafeConferenceKey=wsck))
+
+    def getTrendingConferences(self):
+        return self.api.getTrendingConferences(
+            self.c.FIELDS_GET_REQUEST.combined_message_class(
+                fields=self._fields()))
+
+    def getConferenceStats(self):
+        wsck = self._wsck() if self.rnd.random() < 0.5 else None
+        return self.api.getConferenceStats(
+            self.c.STATS_GET_REQ.combined_message_class(
+                websafeConferenceKey=wsck))
+
+    def getRecommendedSessions(self):
+        return self.api.getRecommendedSessions(
+            self.c.SESS_GET_REQ_KEY.combined_message_class(
+                websafeSessionKey=self._wssk()))
+
+    def getConferenceSessionsByType(self):
+        self._user()
+        return self.api.getConferenceSessionsByType(
+            self.c.SESS_GET_REQ_TYPE.combined_message_class(
+                websafeConferenceKey=self._wsck(),
+                sessionType=self.rnd.choice(harness.SESSION_TYPES)))
+
+    def getSessionsBySpeaker(self):
+        self._user()
+        return self.api.getSessionsBySpeaker(
+            self.c.SESS_GET_REQ_SPEAK.combined_message_class(
+                speakers=[self.rnd.choice(self.fx['speakers'])]))
+
+    def getSessionsBeforeTime(self):
+        self._user()
+        return self.api.getSessionsBeforeTime(
+            self.c.SESS_GET_REQ_TIME.combined_message_class(
+                websafeConferenceKey=self._wsck(), searchTime='12:00'))
+
+    def getSessionsAfterTime(self):
+        self._user()
+        return self.api.getSessionsAfterTime(
+            self.c.SESS_GET_REQ_TIME.combined_message_class(
+                websafeConferenceKey=self._wsck(), searchTime='12:00'))
+
+    def getConferencesCreated(self):
+        self.stubs.setUser(self.rnd.choice(self.fx['organizers']).id())
+        return self.api.getConferencesCreated(
+            self.c.FIELDS_GET_REQUEST.combined_message_class(
+                fields=self._fields()))
+
+    def addSessionToWishlist(self):
+        self._user()
+        return self.api.addSessionToWishlist(
+            self.c.SESS_WISHLIST_REQ.combined_message_class(
+                websafeSessionKey=self._wssk()))
+
+    def deleteSessionFromWishlist(self):
+        self._user()
+        return self.api.deleteSessionFromWishlist(
+            self.c.SESS_WISHLIST_REQ.combined_message_class(
+                websafeSessionKey=self._wssk()))
+
+    def registerForConference(self):
+        self._user()
+        return self.api.registerForConference(
+            self._conferenceKey(websafeConferenceKey=self._wsck()))
+
+    def unregisterFromConference(self):
+        self._user()
+        return self.api.unregisterFromConference(
+            self._conferenceKey(websafeConferenceKey=self._wsck()))
+
+    def saveProfile(self):
+        from models import ProfileMiniForm
+        self._user()
+        return self.api.saveProfile(ProfileMiniForm(
+            displayName='Renamed %d' % self.rnd.randint(0, 1000)))
+
+    def createConference(self):
+        from models import ConferenceForm
+        self.stubs.setUser(self.rnd.choice(self.fx['organizers']).id())
+        return self.api.createConference(ConferenceForm(
+            name='Benchmark conference', city=self.rnd.choice(harness.CITIES),
+            topics=[self.rnd.choice(harness.TOPICS)],
+            startDate='2017-06-01', endDate='2017-06-03', maxAttendees=100))
+
+    def updateConference(self):
+        c_key = self.rnd.choice(self.fx['conferences'])
+        self._organizer(c_key)
+        return self.api.updateConference(
+            self.c.CONF_POST_REQUEST.combined_message_class(
+                websafeConferenceKey=c_key.urlsafe(),
+                description='Updated by benchmark'))
+
+    def createSession(self):
+        c_key = self.rnd.choice(self.fx['conferences'])
+        self._organizer(c_key)
+        return self.api.createSession(
+            self.c.SESS_CREATE_REQ.combined_message_class(
+                websafeConferenceKey=c_key.urlsafe(),
+                name='Benchmark session',
+                speakers=[self.rnd.choice(self.fx['speakers'])],
+                typeofSession=[self.rnd.choice(harness.SESSION_TYPES)],
+                startDate='2017-06-01', startTime='10:00',
+                endDate='2017-06-01', endTime='11:00', maxAttendees=50))
+
+    def filterPlayground(self):
+        from protorpc import message_types
+        return self.api.filterPlayground(message_types.VoidMessage())
+
+    def task3Solution(self):
+        self._user()
+        return self.api.task3Solution(
+            self.c.TASK3_SOLUTION_REQ.combined_message_class(
+                searchTime='19:00', sessionType=['workshop']))
+
+
+def maxRssKb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run(sizes, calls, seed):
+    """Load fixtures, drive a weighted request mix and return the report."""
+    import endpoints
+    from google.appengine.ext import ndb
+    from protorpc import protojson
+    from conference import ConferenceApi
+
+    stubs = harness.Stubs()
+    stubs.activate()
+    started = time.time()
+    fixtures = harness.loadFixtures(seed=seed, **sizes)
+    load_seconds = time.time() - started
+
+    counter = harness.RpcCounter()
+    counter.install()
+    rnd = random.Random(seed)
+    drivers = Drivers(ConferenceApi(), stubs, fixtures, rnd)
+
+    missing = set(ConferenceApi.all_remote_methods()) - set(Drivers.WEIGHTS)
+    if missing:
+        sys.stderr.write('no benchmark driver for: %s\n' %
+                         ', '.join(sorted(missing)))
+
+    names = sorted(Drivers.WEIGHTS)
+    weights = [Drivers.WEIGHTS[name] for name in names]
+    total = float(sum(weights))
+    samples = dict((name, {'ms': [], 'rpcs': [], 'bytes': [], 'errors': 0,
+                           'rss_kb': 0, 'rpc_methods': {}})
+                   for name in names)
+
+    for _ in range(calls):
+        pick = rnd.random() * total
+        for name, weight in zip(names, weights):
+            pick -= weight
+            if pick < 0:
+                break
+        sample = samples[name]
+
+        # every API request starts with an empty ndb context cache
+        ndb.get_context().clear_cache()
+        counter.reset()
+        rss = maxRssKb()
+        start = time.time()
+        try:
+            response = getattr(drivers, name)()
+        except endpoints.ServiceException:
+            # the API refused the request (e.g. no seats); anything else
+            # is a broken driver or endpoint and stops the run
+            sample['errors'] += 1
+            continue
+        sample['ms'].append((time.time() - start) * 1000.0)
+        sample['rss_kb'] += maxRssKb() - rss
+        rpcs = counter.reset()
+        sample['rpcs'].append(sum(rpcs.values()))
+        for method, count in rpcs.items():
+            sample['rpc_methods'][method] = \
+                sample['rpc_methods'].get(method, 0) + count
+        sample['bytes'].append(len(protojson.encode_message(response)))
+
+    stubs.deactivate()
+
+    report = {
+        'fixtures': sizes,
+        'calls': calls,
+        'seed': seed,
+        'fixture_load_seconds': round(load_seconds, 2),
+        'endpoints': {},
+    }
+    for name, sample in samples.items():
+        count = len(sample['ms'])
+        if not count and not sample['errors']:
+            continue
+        report['endpoints'][name] = {
+            'calls': count,
+            'errors': sample['errors'],
+            'p50_ms': round(percentile(sample['ms'], 50), 2),
+            'p95_ms': round(percentile(sample['ms'], 95), 2),
+            'p99_ms': round(percentile(sample['ms'], 99), 2),
+            'rpcs_per_call': round(sum(sample['rpcs']) / float(count or 1), 2),
+            'rpcs_max': max(sample['rpcs'] or [0]),
+            'rpc_methods_per_call': dict(
+                (method, round(n / float(count or 1), 2))
+                for method, n in sample['rpc_methods'].items()),
+            'response_bytes_p50': percentile(sample['bytes'], 50),
+            'rss_growth_kb': sample['rss_kb'],
+        }
+    return report
+
+
+def compare(old, new):
+    """Print p95 latency and RPC changes between two reports."""
+    for name in sorted(set(old['endpoints']) | set(new['endpoints'])):
+        before = old['endpoints'].get(name)
+        after = new['endpoints'].get(name)
+        if not before or not after:
+            print '%-28s %s' % (name, 'added' if after else 'removed')
+            continue
+        print '%-28s p95 %8.2f -> %8.2f ms   rpcs %6.2f -> %6.2f' % (
+            name, before['p95_ms'], after['p95_ms'],
+            before['rpcs_per_call'], after['rpcs_per_call'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--size', choices=sorted(harness.FIXTURE_SIZES),
+                        default='small')
+    parser.add_argument('--conferences', type=int)
+    parser.add_argument('--sessions', type=int)
+    parser.add_argument('--profiles', type=int)
+    parser.add_argument('--calls', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the JSON report here')
+    parser.add_argument('--compare', help='baseline JSON to compare against')
+    args = parser.parse_args()
+
+    sizes = dict(harness.FIXTURE_SIZES[args.size])
+    for field in ('conferences', 'sessions', 'profiles'):
+        if getattr(args, field):
+            sizes[field] = getattr(args, field)
+
+    harness.fixSysPath()
+    report = run(sizes, args.calls, args.seed)
+
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print text
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == '__main__':
+    main()
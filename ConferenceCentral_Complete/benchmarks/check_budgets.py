@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+
+"""
+check_budgets.py -- runs every ConferenceApi endpoint under its RPC
+    budget at two fixture sizes; fails when an endpoint goes over budget
+    or makes more RPCs on the larger fixtures (an N+1 pattern)
+
+usage: APPENGINE_SDK=/path/to/google_appengine \\
+    python benchmarks/check_budgets.py [--calls 5] [--scale 4]
+
+"""
+
+import argparse
+import random
+import sys
+
+import harness
+from benchmark import Drivers
+from rpc_budget import RpcBudget
+from rpc_budget import RpcBudgetExceeded
+
+# RPC cost of one batched ndb get (memcache get, lock, datastore get, cas),
+# one put (datastore put and memcache lock/delete), one query, and the
+# begin/commit pair of a transaction, and the memcache write publishing the
+# new versions put by one commit (or a session list's generation)
+GET = 5
+PUT = 3
+QUERY = 1
+TXN = 2
+VERSION = 1
+# admission control: the token offset_multi, the one clamping idle credit,
+# and the instance's periodic poll of the forced shed level
+ADMIT = 3
+# instance entity cache: the version get_multi revalidating stale entries,
+# and the version add_multi after fetching misses
+CACHE = 2
+
+BUDGETS = {
+    # version lookup, then on a miss the get and the version add
+    'getConference': GET + 2 + CACHE,
+    # the sessions query, the caller's profile and wishlist, and the
+    # conference through the instance cache, all in flight together; plus
+    # the archive get when the conference has no live sessions
+    'getConferenceDetail': ADMIT + QUERY + 3 * GET + CACHE,
+    'getConferencesBatch': ADMIT + GET + CACHE,
+    # one page each of changed conferences, sessions and archives, and
+    # the profile for the registrations
+    'sync': ADMIT + 3 * QUERY + GET,
+    'queryConferences': ADMIT + QUERY,
+    # plus the archive get when the conference has no live sessions
+    # plus up to three for the session list generation
+    'getConferenceSessions': ADMIT + QUERY + 2 * GET + 3,
+    'getProfile': 2 * GET,
+    'getConferencesToAttend': ADMIT + 2 * GET + CACHE,
+    'getSessionsInWishlist': ADMIT + 2 * GET + CACHE,
+    'getAnnouncement': 1,
+    'getFeaturedSpeaker': 1,
+    'getTrendingSessions': 2 * GET + 2 + CACHE,
+    'getTrendingConferences': 2 * GET + 2 + CACHE,
+    'getRecommendedSessions': 2 * GET + CACHE,
+    'getConferenceStats': 2 + GET,
+    # the IN filter on two types runs as two queries
+    'getConferenceSessionsByType': ADMIT + 2 * QUERY,
+    'getSessionsBySpeaker': ADMIT + QUERY + GET,
+    'getSessionsBeforeTime': ADMIT + QUERY + GET,
+    'getSessionsAfterTime': ADMIT + QUERY + GET,
+    'getConferencesCreated': ADMIT + QUERY,
+    'addSessionToWishlist': ADMIT + 2 * TXN + 3 * GET + 2 * PUT + VERSION,
+    'deleteSessionFromWishlist': ADMIT + 2 * TXN + 3 * GET + 2 * PUT + VERSION,
+    'registerForConference': ADMIT + 2 * TXN + 3 * GET + 3 * PUT + VERSION,
+    'unregisterFromConference': ADMIT + 2 * TXN + 3 * GET + 3 * PUT + VERSION,
+    'saveProfile': ADMIT + 2 * GET + PUT + VERSION,
+    'createConference': ADMIT + 1 + GET + PUT + VERSION,
+    'updateConference': ADMIT + TXN + GET + PUT + VERSION,
+    'createSession': ADMIT + 1 + PUT + 2 * VERSION,
+    'filterPlayground': ADMIT + QUERY,
+    'task3Solution': ADMIT + QUERY + GET,
+}
+
+
+def measure(sizes, calls, seed):
+    """Run every endpoint calls times on fixtures of sizes.
+    Returns: (dict of endpoint to max RPCs, list of budget failures)"""
+    import endpoints
+    from google.appengine.api import memcache
+    from google.appengine.ext import ndb
+    import admission
+    from conference import ConferenceApi
+
+    stubs = harness.Stubs()
+    stubs.activate()
+    fixtures = harness.loadFixtures(seed=seed, **sizes)
+    drivers = Drivers(ConferenceApi(), stubs, fixtures, random.Random(seed))
+
+    maxima = {}
+    failures = []
+    for name in sorted(Drivers.WEIGHTS):
+        for _ in range(calls):
+            # every call starts cold, so what it costs can't depend on
+            # which entities earlier calls happened to cache, or on when
+            # the instance last polled the forced shed level
+            ndb.get_context().clear_cache()
+            memcache.flush_all()
+            admission._forcedLevel['checked'] = 0.0
+            budget = RpcBudget(BUDGETS[name], label=name)
+            try:
+                with budget:
+                    getattr(drivers, name)()
+            except RpcBudgetExceeded as e:
+                failures.append(str(e))
+            except endpoints.ServiceException:
+                # the API refused the request (e.g. no seats); still counted
+                pass
+            maxima[name] = max(maxima.get(name, 0), budget.total)
+    stubs.deactivate()
+    return maxima, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--calls', type=int, default=5)
+    parser.add_argument('--scale', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    harness.fixSysPath()
+    missing = set(Drivers.WEIGHTS) - set(BUDGETS)
+    if missing:
+        sys.exit('no RPC budget declared for: %s' % ', '.join(sorted(missing)))
+
+    small = harness.FIXTURE_SIZES['small']
+    large = dict((k, v * args.scale) for k, v in small.items())
+    small_max, failures = measure(small, args.calls, args.seed)
+    large_max, large_failures = measure(large, args.calls, args.seed)
+    failures.extend(large_failures)
+
+    for name in sorted(small_max):
+        if large_max[name] > small_max[name]:
+            failures.append('%s RPCs grow with data size: %d -> %d' % (
+                name, small_max[name], large_max[name]))
+        print '%-28s %3d / %3d RPCs (budget %d)' % (
+            name, small_max[name], large_max[name], BUDGETS[name])
+
+    if failures:
+        print
+        print '\n'.join(failures)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+#!/usr/bin/env python
+
+"""
+harness.py -- App Engine testbed stubs, synthetic fixtures and RPC
+    counting shared by the ConferenceApi benchmarks
+
+"""
+
+import collections
+import datetime
+import glob
+import os
+import random
+import sys
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_SDK = '/usr/local/google_appengine'
+PUT_BATCH = 500
+
+CITIES = ['Chicago', 'London', 'Paris', 'San Francisco', 'Tokyo']
+TOPICS = ['Medical Innovations', 'Programming Languages', 'Web Technologies',
+          'Movie Making', 'Health and Nutrition']
+SESSION_TYPES = ['lecture', 'keynote', 'workshop', 'panel']
+
+FIXTURE_SIZES = {
+    'small':  {'conferences': 100, 'sessions': 1000, 'profiles': 500},
+    'medium': {'conferences': 1000, 'sessions': 20000, 'profiles': 5000},
+    'full':   {'conferences': 10000, 'sessions': 500000, 'profiles': 100000},
+}
+
+
+def fixSysPath():
+    """Put the App Engine SDK (from $APPENGINE_SDK) and the app on sys.path."""
+    sdk = os.environ.get('APPENGINE_SDK', DEFAULT_SDK)
+    sys.path.insert(0, sdk)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+    for lib in glob.glob(os.path.join(sdk, 'lib', 'endpoints-*')):
+        sys.path.append(lib)
+    sys.path.insert(0, APP_DIR)
+    # the vendored libraries, as on an instance
+    import appengine_config
+
+
+class Stubs(object):
+    """Stubs -- testbed with the datastore, memcache, taskqueue and mail
+    stubs the app uses, plus a current user for endpoints auth"""
+
+    def __init__(self):
+        from google.appengine.ext import testbed
+        self.testbed = testbed.Testbed()
+
+    def activate(self):
+        from google.appengine.datastore import datastore_stub_util
+        self.testbed.activate()
+        # queries see writes immediately, like a warmed up HR datastore
+        policy = datastore_stub_util.PseudoRandomHRConsistencyPolicy(
+            probability=1)
+        self.testbed.init_datastore_v3_stub(consistency_policy=policy)
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub(root_path=APP_DIR)
+        self.testbed.init_mail_stub()
+        self.testbed.init_app_identity_stub()
+        self.testbed.init_urlfetch_stub()
+        self.testbed.init_user_stub()
+        # entities cached by an earlier testbed's run are not in this one
+        import entitycache
+        entitycache.clear()
+
+    def deactivate(self):
+        self.testbed.deactivate()
+
+    def setUser(self, email):
+        """Make endpoints.get_current_user() return email."""
+        os.environ['ENDPOINTS_AUTH_EMAIL'] = email
+        os.environ['ENDPOINTS_AUTH_DOMAIN'] = ''
+        self.testbed.setup_env(USER_EMAIL=email, USER_ID=email,
+                               overwrite=True)
+
+
+class RpcCounter(object):
+    """RpcCounter -- counts API calls per 'service.method' through an
+    apiproxy pre-call hook, for sync and async calls alike"""
+
+    def __init__(self):
+        self.counts = collections.Counter()
+
+    def _hook(self, service, call, request, response):
+        self.counts['%s.%s' % (service, call)] += 1
+
+    def install(self):
+        from google.appengine.api import apiproxy_stub_map
+        apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+            'rpc_counter', self._hook)
+
+    def reset(self):
+        counts = self.counts
+        self.counts = collections.Counter()
+        return counts
+
+
+def profileEmail(i):
+    return 'user%d@example.com' % i
+
+
+def loadFixtures(conferences, sessions, profiles, seed=0):
+    """Write synthetic Profiles, Conferences, Sessions and WishLists.
+    Returns: dict of the keys benchmark requests are built from"""
+    from google.appengine.ext import ndb
+    from conference import WISHLIST_ID
+    from models import Conference, Profile, Session, WishList
+
+    rnd = random.Random(seed)
+    pending = []
+
+    def put(entity):
+        pending.append(entity)
+        if len(pending) >= PUT_BATCH:
+            ndb.put_multi(pending)
+            del pending[:]
+
+    # one in ten users organizes conferences
+    p_keys = [ndb.Key(Profile, profileEmail(i)) for i in range(profiles)]
+    organizers = p_keys[:max(1, profiles // 10)]
+
+    c_keys = []
+    start = datetime.date(2016, 1, 1)
+    for i in range(conferences):
+        organizer = rnd.randrange(len(organizers))
+        c_key = ndb.Key(Conference, i + 1, parent=organizers[organizer])
+        seats = rnd.choice([0, 10, 50, 200, 1000])
+        startDate = start + datetime.timedelta(days=rnd.randint(0, 720))
+        put(Conference(
+            key=c_key,
+            name='Conference %d' % i,
+            description='Synthetic conference %d' % i,
+            organizerUserId=c_key.parent().id(),
+            organizerDisplayName='User %d' % organizer,
+            topics=rnd.sample(TOPICS, 2),
+            city=rnd.choice(CITIES),
+            startDate=startDate,
+            month=startDate.month,
+            endDate=startDate + datetime.timedelta(days=2),
+            maxAttendees=seats,
+            seatsAvailable=rnd.randint(0, seats),
+        ))
+        c_keys.append(c_key)
+
+    s_keys = []
+    speakers = ['Speaker %d' % i for i in range(max(1, sessions // 5))]
+    for i in range(sessions):
+        c_key = c_keys[i % len(c_keys)]
+        s_key = ndb.Key(Session, i + 1, parent=c_key)
+        put(Session(
+            key=s_key,
+            name='Session %d' % i,
+            highlights='Synthetic session %d' % i,
+            location='Room %d' % rnd.randint(1, 20),
+            typeofSession=[rnd.choice(SESSION_TYPES)],
+            speakers=[rnd.choice(speakers)],
+            startDate=start,
+            startTime=datetime.time(rnd.randint(8, 20), 0),
+            endTime=datetime.time(21, 0),
+            endDate=start,
+            maxAttendees=100,
+            seatsAvailable=100,
+        ))
+        s_keys.append(s_key)
+
+    for i, p_key in enumerate(p_keys):
+        put(Profile(
+            key=p_key,
+            displayName='User %d' % i,
+            mainEmail=p_key.id(),
+            teeShirtSize='NOT_SPECIFIED',
+            conferenceKeysToAttend=[c.urlsafe() for c in
+                                    rnd.sample(c_keys, min(3, len(c_keys)))],
+        ))
+        put(WishList(
+            key=ndb.Key(WishList, WISHLIST_ID, parent=p_key),
+            sessions=rnd.sample(s_keys, min(5, len(s_keys))),
+        ))
+    ndb.put_multi(pending)
+
+    return {
+        'profiles': p_keys,
+        'organizers': organizers,
+        'conferences': c_keys,
+        'sessions': s_keys,
+        'speakers': speakers,
+    }
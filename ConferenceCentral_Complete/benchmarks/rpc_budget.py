@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+"""
+rpc_budget.py -- context manager and decorator that count datastore and
+    memcache RPCs through an apiproxy hook and fail when the code inside
+    goes over its declared budget
+
+usage:
+    with RpcBudget(8, label='getConference'):
+        api.getConference(request)
+
+    @rpcBudget(5)
+    def checkQuery(): ...
+
+"""
+
+import collections
+import functools
+
+SERVICES = ('datastore_v3', 'memcache')
+# continuation batches of one query are not extra round trips per item
+IGNORED = ('datastore_v3.Next',)
+
+_active = []
+_installed = []
+
+
+class RpcBudgetExceeded(AssertionError):
+    """RpcBudgetExceeded -- more RPCs were made than the budget allows"""
+    pass
+
+
+def _hook(service, call, request, response):
+    if not _active or service not in SERVICES:
+        return
+    name = '%s.%s' % (service, call)
+    for budget in _active:
+        if name not in budget.ignored:
+            budget.counts[name] += 1
+
+
+def _install():
+    """Add the counting hook to the current apiproxy once; testbed
+    activation replaces the apiproxy, so this is re-checked per use."""
+    from google.appengine.api import apiproxy_stub_map
+    apiproxy = apiproxy_stub_map.apiproxy
+    if apiproxy not in _installed:
+        apiproxy.GetPreCallHooks().Append('rpc_budget', _hook)
+        _installed.append(apiproxy)
+
+
+class RpcBudget(object):
+    """RpcBudget -- fails the enclosed block with RpcBudgetExceeded when it
+    makes more than budget datastore/memcache RPCs"""
+
+    def __init__(self, budget, label=None, ignored=IGNORED):
+        self.budget = budget
+        self.label = label
+        self.ignored = ignored
+        self.counts = collections.Counter()
+
+    @property
+    def total(self):
+        return sum(self.counts.values())
+
+    def __enter__(self):
+        _install()
+        self.counts = collections.Counter()
+        _active.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _active.remove(self)
+        if exc_type is None and self.total > self.budget:
+            raise RpcBudgetExceeded('%s made %d RPCs, budget is %d: %s' % (
+                self.label or 'block', self.total, self.budget,
+                ', '.join('%s=%d' % item for item in
+                          sorted(self.counts.items()))))
+        return False
+
+
+def rpcBudget(budget, label=None):
+    """Decorator running the function inside an RpcBudget."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with RpcBudget(budget, label or func.__name__):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+"""
+startup.py -- measures cold import time of the app modules, each in a
+    fresh interpreter, as a proxy for instance start-up cost
+
+usage: APPENGINE_SDK=/path/to/google_appengine \\
+    python benchmarks/startup.py [--runs 10] [--output startup.json]
+
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+import harness
+
+MODULES = ('models', 'conference', 'main')
+
+# runs in a fresh interpreter: set up paths, then time one import
+IMPORT_TPL = '''
+import sys, time
+sys.path.insert(0, %(bench_dir)r)
+import harness
+harness.fixSysPath()
+start = time.time()
+import %(module)s
+print (time.time() - start) * 1000.0
+'''
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[int(round(pct / 100.0 * (len(ordered) - 1)))]
+
+
+def timeImport(module):
+    """Return the milliseconds a fresh interpreter takes to import module."""
+    code = IMPORT_TPL % {'bench_dir': os.path.dirname(os.path.abspath(__file__)),
+                         'module': module}
+    out = subprocess.check_output([sys.executable, '-c', code],
+                                  cwd=harness.APP_DIR)
+    return float(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--output', help='write the JSON report here')
+    args = parser.parse_args()
+
+    report = {'runs': args.runs, 'imports': {}}
+    for module in MODULES:
+        times = [timeImport(module) for _ in range(args.runs)]
+        report['imports'][module] = {
+            'min_ms': round(min(times), 1),
+            'p50_ms': round(percentile(times, 50), 1),
+            'max_ms': round(max(times), 1),
+        }
+
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print text
+
+
+if __name__ == '__main__':
+    main()
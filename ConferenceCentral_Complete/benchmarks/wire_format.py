@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+"""
+wire_format.py -- compares the JSON and binary protocol buffer encodings
+    of getConferenceSessions responses for schedules of growing size:
+    payload bytes (raw and gzipped) and encode/decode time per response
+
+usage: APPENGINE_SDK=/path/to/google_appengine \\
+    python benchmarks/wire_format.py [--sessions 50 200 1000] \\
+    [--repeat 50] [--output wire_format.json]
+
+"""
+
+import argparse
+import gzip
+import json
+import time
+from cStringIO import StringIO
+
+import harness
+
+DEFAULT_SESSIONS = (50, 200, 1000)
+
+
+def gzipped(data):
+    buf = StringIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb') as gz:
+        gz.write(data)
+    return len(buf.getvalue())
+
+
+def bestMs(fn, repeat):
+    """Best of repeat timings of fn, in milliseconds; the best run is the
+    one least disturbed by the rest of the machine."""
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        fn()
+        elapsed = (time.time() - start) * 1000.0
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def schedule(sessions, seed):
+    """One conference with sessions sessions in fresh stubs, returned the
+    way getConferenceSessions serves it.
+    Returns: SessionForms"""
+    import conference
+    stubs = harness.Stubs()
+    stubs.activate()
+    try:
+        fx = harness.loadFixtures(1, sessions, 1, seed)
+        stubs.setUser(fx['profiles'][0].id())
+        return conference.ConferenceApi().getConferenceSessions(
+            conference.SESS_GET_REQ.combined_message_class(
+                websafeConferenceKey=fx['conferences'][0].urlsafe()))
+    finally:
+        stubs.deactivate()
+
+
+def compareFormats(forms, repeat):
+    """Size and timings of forms in both encodings."""
+    from protorpc import protobuf
+    from protorpc import protojson
+    from models import SessionForms
+
+    as_json = protojson.encode_message(forms)
+    as_proto = protobuf.encode_message(forms)
+    row = {
+        'sessions': len(forms.items),
+        'json_bytes': len(as_json),
+        'json_gzip_bytes': gzipped(as_json),
+        'protobuf_bytes': len(as_proto),
+        'protobuf_gzip_bytes': gzipped(as_proto),
+        'json_encode_ms': bestMs(
+            lambda: protojson.encode_message(forms), repeat),
+        'protobuf_encode_ms': bestMs(
+            lambda: protobuf.encode_message(forms), repeat),
+        # parsing alone, as a client's JSON library would, and into messages
+        'json_parse_ms': bestMs(lambda: json.loads(as_json), repeat),
+        'json_decode_ms': bestMs(
+            lambda: protojson.decode_message(SessionForms, as_json), repeat),
+        'protobuf_decode_ms': bestMs(
+            lambda: protobuf.decode_message(SessionForms, as_proto), repeat),
+    }
+    for key in row:
+        if key.endswith('_ms'):
+            row[key] = round(row[key], 3)
+    row['size_ratio'] = round(float(row['protobuf_bytes']) /
+                              row['json_bytes'], 3)
+    row['gzip_size_ratio'] = round(float(row['protobuf_gzip_bytes']) /
+                                   row['json_gzip_bytes'], 3)
+    row['decode_speedup'] = round(row['json_decode_ms'] /
+                                  max(row['protobuf_decode_ms'], 0.001), 2)
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sessions', type=int, nargs='+',
+                        default=list(DEFAULT_SESSIONS))
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the JSON report here')
+    args = parser.parse_args()
+
+    harness.fixSysPath()
+    report = {'repeat': args.repeat, 'schedules': []}
+    for sessions in args.sessions:
+        report['schedules'].append(
+            compareFormats(schedule(sessions, args.seed), args.repeat))
+
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print text
+
+
+if __name__ == '__main__':
+    main()
@@ -12,9 +12,12 @@ created by wesc on 2014 apr 21
 
 __author__ = 'wesc+api@google.com (Wesley Chun)'
 
+import base64
+import hashlib
+import json
 import logging
 
-from datetime import datetime
+from datetime import datetime, timedelta
 import time
 
 import endpoints
@@ -22,9 +25,11 @@ from protorpc import messages
 from protorpc import message_types
 from protorpc import remote
 
+from google.appengine.api import datastore_errors
 from google.appengine.api import memcache
 from google.appengine.api import taskqueue
 from google.appengine.ext import ndb
+from google.appengine.datastore.datastore_query import Cursor
 
 from models import ConflictException
 from models import Profile
@@ -35,6 +40,9 @@ from models import BooleanMessage
 from models import Conference
 from models import ConferenceForm
 from models import ConferenceForms
+from models import ConferenceResultForm
+from models import ConferenceResultForms
+from models import ConferenceDetailForm
 from models import ConferenceQueryForm
 from models import ConferenceQueryForms
 from models import TeeShirtSize
@@ -42,6 +50,16 @@ from models import Session
 from models import SessionForm
 from models import SessionForms
 from models import WishList
+from models import VersionedModel
+from models import MEMCACHE_SESSIONS_GENERATION_KEY
+from models import VERSION_TTL
+from models import SessionRecommendation
+from models import ConferenceStats
+from models import ConferenceArchive
+from models import SyncForm
+from models import ConferenceStatsForm
+from models import StatsGroupForm
+from models import StatsPointForm
 
 from settings import WEB_CLIENT_ID
 from settings import ANDROID_CLIENT_ID
@@ -50,12 +68,57 @@ from settings import ANDROID_AUDIENCE
 
 from utils import getUserId
 
+from dispatch import TaskBatch
+
+from instrumentation import instrument
+
+from admission import admissionControl
+from admission import CRITICAL
+from admission import EXPENSIVE
+from admission import NORMAL
+
+from mailer import confirmationTask
+from mailer import MAIL_QUEUE
+
+from entitycache import getMulti
+
+from archive import getConferences
+from archive import getSessions
+from archive import getArchivedSessions
+from archive import queryArchived
+
+from popularity import incrementCounter
+from popularity import getTrending
+from popularity import TRENDING_SESSIONS_ID
+from popularity import TRENDING_CONFERENCES_ID
+
 EMAIL_SCOPE = endpoints.EMAIL_SCOPE
 API_EXPLORER_CLIENT_ID = endpoints.API_EXPLORER_CLIENT_ID
 MEMCACHE_ANNOUNCEMENTS_KEY = "RECENT_ANNOUNCEMENTS"
 MEMCACHE_FEATURED_SPEAKERS_KEY = "FEATURED_SPEAKERS"
+MEMCACHE_CONFERENCE_STATS_KEY = "CONFERENCE_STATS"
+MEMCACHE_BURNDOWN_KEY = "BURNDOWN_"
+CONFERENCE_STATS_ID = 'all'
 ANNOUNCEMENT_TPL = ('Last chance to attend! The following conferences '
                     'are nearly sold out: %s')
+WISHLIST_ID = 'sessions'
+MIGRATION_BATCH_SIZE = 100
+MAX_BATCH_KEYS = 100
+SYNC_PAGE_SIZE = 100
+# a new sync round starts a little before the last one ended, since
+# global queries can lag writes; clients upsert, so repeats are harmless
+SYNC_OVERLAP = timedelta(seconds=60)
+SYNC_PHASES = ('conferences', 'sessions', 'removed')
+EPOCH = datetime(1970, 1, 1)
+# form fields a fields mask always keeps: the key identifies the item and
+# etag/notModified are response metadata, not entity data
+MASK_ALWAYS = ('websafeKey', 'etag', 'notModified')
+# (kind, shape, projection) of projections that needed a missing index;
+# those masks read whole entities for the life of the instance
+UNINDEXED_PROJECTIONS = set()
+# the session fields getConferenceDetail returns with summary set
+SCHEDULE_SUMMARY_FIELDS = ('name', 'typeofSession', 'location', 'startDate',
+                           'startTime', 'endTime')
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 
 DEFAULTS = {
@@ -100,6 +163,40 @@ CONF_GET_REQUEST = endpoints.ResourceContainer(
     websafeConferenceKey=messages.StringField(1),
 )
 
+CONF_GET_COND_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    ifNoneMatch=messages.StringField(2),
+    fields=messages.StringField(3, repeated=True),
+)
+
+CONF_DETAIL_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    summary=messages.BooleanField(2),
+)
+
+FIELDS_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    fields=messages.StringField(1, repeated=True),
+)
+
+SYNC_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    since=messages.StringField(1),
+)
+
+PROFILE_GET_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    ifNoneMatch=messages.StringField(1),
+)
+
+CONF_BATCH_REQUEST = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKeys=messages.StringField(1, repeated=True),
+    fields=messages.StringField(2, repeated=True),
+)
+
 CONF_POST_REQUEST = endpoints.ResourceContainer(
     ConferenceForm,
     websafeConferenceKey=messages.StringField(1),
@@ -108,15 +205,19 @@ CONF_POST_REQUEST = endpoints.ResourceContainer(
 SESS_GET_REQ = endpoints.ResourceContainer(
     message_types.VoidMessage,
     websafeConferenceKey=messages.StringField(1),
+    ifNoneMatch=messages.StringField(2),
+    fields=messages.StringField(3, repeated=True),
 )
 
 SESS_GET_REQ_TYPE = endpoints.ResourceContainer(
     websafeConferenceKey=messages.StringField(1),
-    sessionType = messages.StringField(2)
+    sessionType = messages.StringField(2),
+    fields = messages.StringField(3, repeated=True)
 )
 
 SESS_GET_REQ_SPEAK = endpoints.ResourceContainer(
-    speakers = messages.StringField(1, repeated=True)
+    speakers = messages.StringField(1, repeated=True),
+    fields = messages.StringField(2, repeated=True)
 )
 
 SESS_CREATE_REQ = endpoints.ResourceContainer(
@@ -139,16 +240,34 @@ SESS_WISHLIST_REQ = endpoints.ResourceContainer(
     websafeSessionKey = messages.StringField(1)
 )
 
+TRENDING_GET_REQ = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+    fields=messages.StringField(2, repeated=True),
+)
+
+STATS_GET_REQ = endpoints.ResourceContainer(
+    message_types.VoidMessage,
+    websafeConferenceKey=messages.StringField(1),
+)
+
+SESS_GET_REQ_KEY = endpoints.ResourceContainer(
+    websafeSessionKey = messages.StringField(1),
+    fields = messages.StringField(2, repeated=True)
+)
+
 SESS_GET_REQ_TIME = endpoints.ResourceContainer(
     searchTime             = messages.StringField(1),
-    websafeConferenceKey    = messages.StringField(2)
+    websafeConferenceKey    = messages.StringField(2),
+    fields                 = messages.StringField(3, repeated=True)
 
 )
 
 
 TASK3_SOLUTION_REQ= endpoints.ResourceContainer(
     searchTime             = messages.StringField(1),
-    sessionType    = messages.StringField(2, repeated=True)
+    sessionType    = messages.StringField(2, repeated=True),
+    fields         = messages.StringField(3, repeated=True)
 
 )
 
@@ -164,10 +283,13 @@ class ConferenceApi(remote.Service):
 
 # - - - Conference objects - - - - - - - - - - - - - - - - -
 
-    def _copyConferenceToForm(self, conf, displayName):
-        """Copy relevant fields from Conference to ConferenceForm."""
+    def _copyConferenceToForm(self, conf, displayName=None, mask=None):
+        """Copy relevant fields from Conference to ConferenceForm; only
+        those in mask, if given."""
         cf = ConferenceForm()
         for field in cf.all_fields():
+            if mask is not None and field.name not in mask:
+                continue
             if hasattr(conf, field.name):
                 # convert Date to date string; just copy others
                 if field.name.endswith('Date'):
@@ -176,12 +298,89 @@ class ConferenceApi(remote.Service):
                     setattr(cf, field.name, getattr(conf, field.name))
             elif field.name == "websafeKey":
                 setattr(cf, field.name, conf.key.urlsafe())
-        if displayName:
+        if displayName and (mask is None or 'organizerDisplayName' in mask):
             setattr(cf, 'organizerDisplayName', displayName)
         cf.check_initialized()
         return cf
 
 
+    def _copyConferencesToForms(self, confs, mask=None):
+        """Copy Conferences to ConferenceForms.  Organizer names are stored
+        on the Conference; profiles are only read for conferences written
+        before that, all in one get_multi, and only if mask wants them.
+        The conferences may be cached ones, so they are left unmodified."""
+        names = {}
+        if mask is None or 'organizerDisplayName' in mask:
+            missing = [conf for conf in confs
+                       if conf.organizerDisplayName is None]
+            profiles = getMulti([conf.key.parent() for conf in missing])
+            for conf, prof in zip(missing, profiles):
+                names[conf.key] = getattr(prof, 'displayName', None)
+        return ConferenceForms(
+            items=[self._copyConferenceToForm(conf, names.get(conf.key), mask)
+                   for conf in confs]
+        )
+
+
+    @staticmethod
+    def _fieldMask(form_class, fields):
+        """Return the set of form_class fields a request's fields mask
+        selects, or None for all of them.  Names may also be comma
+        separated; MASK_ALWAYS and required fields are always kept."""
+        names = set(name.strip() for entry in fields or ()
+                    for name in entry.split(',') if name.strip())
+        if not names:
+            return None
+        all_fields = list(form_class.all_fields())
+        unknown = names - set(field.name for field in all_fields)
+        if unknown:
+            raise endpoints.BadRequestException(
+                'Unknown fields: %s' % ', '.join(sorted(unknown)))
+        names.update(MASK_ALWAYS)
+        names.update(field.name for field in all_fields if field.required)
+        return names
+
+
+    @staticmethod
+    def _projection(model, mask, filtered=()):
+        """Return the property names to project a query of model on, when
+        every masked field is an indexed, single valued property that no
+        equality filter uses; () when the key alone will do; else None."""
+        if mask is None:
+            return None
+        props = []
+        for name in mask.difference(MASK_ALWAYS):
+            prop = model._properties.get(name)
+            if (prop is None or not prop._indexed or prop._repeated or
+                    name in filtered):
+                return None
+            props.append(name)
+        return tuple(sorted(props))
+
+
+    def _fetchMasked(self, q, model, mask, shape, filtered=()):
+        """Fetch q, as a projection (or keys only) query when mask allows
+        it.  A projection needs a composite index for its shape; when that
+        is missing the query is rerun for whole entities, and the shape is
+        not projected again by this instance."""
+        projection = self._projection(model, mask, filtered)
+        if projection is None:
+            return q.fetch()
+        if not projection:
+            return [model(key=key) for key in q.fetch(keys_only=True)]
+        shape_key = (model._get_kind(), shape, projection)
+        if shape_key in UNINDEXED_PROJECTIONS:
+            return q.fetch()
+        try:
+            return q.fetch(projection=projection)
+        except (datastore_errors.NeedIndexError,
+                datastore_errors.BadRequestError) as e:
+            logging.warning("No index for projection %s of %s %s: %s",
+                            projection, model._get_kind(), shape, e)
+            UNINDEXED_PROJECTIONS.add(shape_key)
+            return q.fetch()
+
+
     def _createConferenceObject(self, request):
         """Create or update Conference object, returning ConferenceForm/request."""
         # preload necessary data items
@@ -197,6 +396,8 @@ class ConferenceApi(remote.Service):
         data = {field.name: getattr(request, field.name) for field in request.all_fields()}
         del data['websafeKey']
         del data['organizerDisplayName']
+        del data['etag']
+        del data['notModified']
 
         # add default values for those missing (both data model & outbound Message)
         for df in DEFAULTS:
@@ -223,14 +424,18 @@ class ConferenceApi(remote.Service):
         c_key = ndb.Key(Conference, c_id, parent=p_key)
         data['key'] = c_key
         data['organizerUserId'] = request.organizerUserId = user_id
-
-        # create Conference, send email to organizer confirming
-        # creation of Conference & return (modified) ConferenceForm
+        prof = p_key.get()
+        data['organizerDisplayName'] = request.organizerDisplayName = \
+            prof.displayName if prof else user.nickname()
+
+        # queue email to organizer confirming creation of Conference while
+        # it is created (the digest skips it if the put fails), & return
+        # (modified) ConferenceForm
+        tasks = TaskBatch()
+        tasks.add(confirmationTask(user.email(), 'conference', c_key), MAIL_QUEUE)
+        tasks.flush()
         Conference(**data).put()
-        taskqueue.add(params={'email': user.email(),
-            'conferenceInfo': repr(request)},
-            url='/tasks/send_confirmation_email'
-        )
+        tasks.wait()
         return request
 
 
@@ -260,8 +465,10 @@ class ConferenceApi(remote.Service):
         # copy relevant fields from ConferenceForm to Conference object
         for field in request.all_fields():
             data = getattr(request, field.name)
-            # only copy fields where we get data
-            if data not in (None, []):
+            # only copy fields where we get data; the organizer name
+            # follows the Profile and is not client editable
+            if data not in (None, []) and field.name not in (
+                    'organizerDisplayName', 'etag', 'notModified'):
                 # special handling for dates (convert string to Date)
                 if field.name in ('startDate', 'endDate'):
                     data = datetime.strptime(data, "%Y-%m-%d").date()
@@ -270,12 +477,12 @@ class ConferenceApi(remote.Service):
                 # write to Conference object
                 setattr(conf, field.name, data)
         conf.put()
-        prof = ndb.Key(Profile, user_id).get()
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        return self._copyConferencesToForms([conf]).items[0]
 
 
     @endpoints.method(ConferenceForm, ConferenceForm, path='conference',
             http_method='POST', name='createConference')
+    @admissionControl(CRITICAL)
     def createConference(self, request):
         """Create new conference."""
         return self._createConferenceObject(request)
@@ -284,29 +491,315 @@ class ConferenceApi(remote.Service):
     @endpoints.method(CONF_POST_REQUEST, ConferenceForm,
             path='conference/{websafeConferenceKey}',
             http_method='PUT', name='updateConference')
+    @admissionControl(CRITICAL)
     def updateConference(self, request):
         """Update conference w/provided fields & return w/updated info."""
         return self._updateConferenceObject(request)
 
 
-    @endpoints.method(CONF_GET_REQUEST, ConferenceForm,
+    def _ifNoneMatch(self, request):
+        """Return the ETag the client already has, from the ifNoneMatch
+        field or an If-None-Match header, or None."""
+        if getattr(request, 'ifNoneMatch', None):
+            return request.ifNoneMatch
+        state = getattr(self, 'request_state', None)
+        if state is not None and state.headers:
+            return state.headers.get('If-None-Match')
+        return None
+
+
+    @staticmethod
+    def _etag(prefix, entities):
+        """ETag of a response built from entities: their versions, with
+        missing entities as version 0."""
+        return prefix + '.'.join(
+            str(getattr(entity, 'version', 0) or 0) for entity in entities)
+
+
+    @staticmethod
+    def _cachedEtag(prefix, keys):
+        """ETag from the memcache versions of keys, without loading them;
+        None if any version is not cached."""
+        version_keys = [VersionedModel.versionKey(key) for key in keys]
+        versions = memcache.get_multi(version_keys)
+        if len(versions) != len(keys):
+            return None
+        return prefix + '.'.join(str(versions[vk]) for vk in version_keys)
+
+
+    @staticmethod
+    def _maskTag(mask):
+        """ETag suffix telling apart responses of the same entities built
+        with different fields masks; '' for the full response."""
+        if mask is None:
+            return ''
+        return '~' + hashlib.sha1(','.join(sorted(mask))).hexdigest()[:8]
+
+
+    @staticmethod
+    def _cacheVersions(keys, entities):
+        """Publish loaded versions for later conditional reads; add, so a
+        concurrent write's newer version is never overwritten."""
+        memcache.add_multi(dict(
+            (VersionedModel.versionKey(key), getattr(entity, 'version', 0) or 0)
+            for key, entity in zip(keys, entities)), time=VERSION_TTL)
+
+
+    @endpoints.method(CONF_GET_COND_REQUEST, ConferenceForm,
             path='conference/{websafeConferenceKey}',
             http_method='GET', name='getConference')
     def getConference(self, request):
-        """Return requested conference (by websafeConferenceKey)."""
-        # get Conference object from request; bail if not found
-        conf = ndb.Key(urlsafe=request.websafeConferenceKey).get()
+        """Return requested conference (by websafeConferenceKey); only its
+        etag and notModified when ifNoneMatch is still current."""
+        c_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+        mask = self._fieldMask(ConferenceForm, request.fields)
+        etag = self._ifNoneMatch(request)
+        if etag:
+            current = self._cachedEtag('c', [c_key])
+            if current and etag == current + self._maskTag(mask):
+                return ConferenceForm(websafeKey=request.websafeConferenceKey,
+                                      etag=etag, notModified=True)
+
+        # get Conference object from request, falling back to the archive;
+        # bail if not found
+        conf = getConferences([c_key])[0]
         if not conf:
             raise endpoints.NotFoundException(
                 'No conference found with key: %s' % request.websafeConferenceKey)
-        prof = conf.key.parent().get()
+        if etag:
+            self._cacheVersions([c_key], [conf])
         # return ConferenceForm
-        return self._copyConferenceToForm(conf, getattr(prof, 'displayName'))
+        form = self._copyConferencesToForms([conf], mask).items[0]
+        form.etag = self._etag('c', [conf]) + self._maskTag(mask)
+        return form
+
+
+    @endpoints.method(CONF_DETAIL_REQUEST, ConferenceDetailForm,
+            path='conference/{websafeConferenceKey}/detail',
+            http_method='GET', name='getConferenceDetail')
+    @admissionControl(NORMAL)
+    def getConferenceDetail(self, request):
+        """Return everything the conference page shows in one call: the
+        conference with its organizer name, its sessions in schedule order
+        (only SCHEDULE_SUMMARY_FIELDS with summary) and, when signed in,
+        whether the caller is registered and which of the sessions they
+        wishlisted.  The reads run concurrently."""
+        c_key = ndb.Key(urlsafe=request.websafeConferenceKey)
+        # start the sessions query and the caller's profile and wishlist
+        # before the conference read, which is usually a cache hit
+        sessns_future = Session.query(ancestor=c_key).fetch_async()
+        user = endpoints.get_current_user()
+        caller_futures = None
+        if user:
+            p_key = ndb.Key(Profile, getUserId(user))
+            caller_futures = ndb.get_multi_async(
+                [p_key, self._wishlistKey(p_key)])
 
+        conf = getConferences([c_key])[0]
+        if not conf:
+            raise endpoints.NotFoundException(
+                'No conference found with key: %s' % request.websafeConferenceKey)
+        detail = ConferenceDetailForm(
+            conference=self._copyConferencesToForms([conf]).items[0],
+            signedIn=bool(user),
+        )
 
-    @endpoints.method(message_types.VoidMessage, ConferenceForms,
+        sessns = sessns_future.get_result()
+        if not sessns:
+            # finished conferences keep their sessions in the archive
+            sessns = getArchivedSessions(c_key)
+        sessns = sorted(sessns, key=lambda sess: (
+            sess.startDate is None, sess.startDate,
+            sess.startTime is None, sess.startTime, sess.name))
+        mask = None
+        if request.summary:
+            mask = self._fieldMask(SessionForm, SCHEDULE_SUMMARY_FIELDS)
+        detail.sessions = [self._copySessionToForm(sess, mask)
+                           for sess in sessns]
+
+        if caller_futures:
+            prof, wishlist = [f.get_result() for f in caller_futures]
+            if prof:
+                detail.registered = (request.websafeConferenceKey in
+                                     prof.conferenceKeysToAttend)
+            if wishlist:
+                s_keys = wishlist.sessions
+            elif prof:
+                s_keys = [ndb.Key(urlsafe=wssk)
+                          for wssk in prof.sessionWishlistKeys]
+            else:
+                s_keys = []
+            detail.wishlistSessionKeys = [s_key.urlsafe() for s_key in s_keys
+                                          if s_key.parent() == c_key]
+        return detail
+
+
+    @staticmethod
+    def _encodeSyncToken(state):
+        return base64.urlsafe_b64encode(json.dumps(state, separators=(',', ':')))
+
+
+    @staticmethod
+    def _decodeSyncToken(token):
+        """Return the sync state in token; an empty token starts a full
+        sync.  Times are microseconds since the epoch."""
+        if not token:
+            return {'since': None, 'until': None, 'phase': 0, 'cursor': None}
+        try:
+            state = json.loads(base64.urlsafe_b64decode(str(token)))
+        except (TypeError, ValueError):
+            raise endpoints.BadRequestException('Invalid sync token')
+
+        # the token comes from the client: check every value before use
+        isCount = lambda value: (isinstance(value, (int, long)) and
+                                 not isinstance(value, bool) and value >= 0)
+        # later times would overflow when turned back into datetimes
+        span = datetime.max - EPOCH
+        latest = (span.days * 86400 + span.seconds) * 10**6 + span.microseconds
+        isTime = lambda value: value is None or (isCount(value) and
+                                                 value <= latest)
+        valid = (isinstance(state, dict) and
+                 sorted(state) == ['cursor', 'phase', 'since', 'until'] and
+                 isTime(state['since']) and isTime(state['until']) and
+                 isCount(state['phase']) and
+                 state['phase'] < len(SYNC_PHASES) and
+                 (state['cursor'] is None or
+                  isinstance(state['cursor'], basestring)))
+        if valid and state['until'] is None:
+            # only a finished round leaves until open, before it starts
+            valid = state['phase'] == 0 and state['cursor'] is None
+        elif valid and state['since'] is not None:
+            valid = state['since'] <= state['until']
+        if valid and state['cursor'] is not None:
+            try:
+                Cursor(urlsafe=state['cursor'])
+            except (datastore_errors.BadValueError, TypeError, ValueError):
+                valid = False
+        if not valid:
+            raise endpoints.BadRequestException('Invalid sync token')
+        return state
+
+
+    @staticmethod
+    def _syncQuery(model, prop, since, until):
+        """Entities of model changed in [since, until), by prop; everything
+        on a full sync."""
+        if since is None:
+            return model.query()
+        return model.query(prop >= since, prop < until).order(prop)
+
+
+    @endpoints.method(SYNC_REQUEST, SyncForm,
+            path='sync', http_method='GET', name='sync')
+    @admissionControl(EXPENSIVE)
+    def sync(self, request):
+        """Return the conferences and sessions changed, the ones archived,
+        and the user's registrations if changed, since the token in since
+        (empty for everything).  Pages hold SYNC_PAGE_SIZE changes; call
+        again with nextToken while more is set, and keep the last
+        nextToken for the next sync."""
+        state = self._decodeSyncToken(request.since)
+        toTime = lambda us: EPOCH + timedelta(microseconds=us)
+        if state['until'] is None:
+            # a new round covers everything changed up to now
+            now = datetime.utcnow() - EPOCH
+            state['until'] = (now.days * 86400 + now.seconds) * 10**6 + \
+                now.microseconds
+        since = toTime(state['since']) if state['since'] is not None else None
+        until = toTime(state['until'])
+        form = SyncForm()
+
+        # registrations live on the profile, sent with the first page
+        user = endpoints.get_current_user()
+        if user and state['phase'] == 0 and not state['cursor']:
+            prof = ndb.Key(Profile, getUserId(user)).get()
+            if prof and (since is None or (prof.updated and
+                                           prof.updated >= since)):
+                form.registrationsChanged = True
+                form.registrations = prof.conferenceKeysToAttend
+
+        room = SYNC_PAGE_SIZE
+        while room > 0 and state['phase'] < len(SYNC_PHASES):
+            phase = SYNC_PHASES[state['phase']]
+            cursor = Cursor(urlsafe=state['cursor']) if state['cursor'] else None
+            if phase == 'removed' and since is None:
+                # a full sync only holds live entities
+                entities, next_cursor, more = [], None, False
+            elif phase == 'removed':
+                entities, next_cursor, more = self._syncQuery(
+                    ConferenceArchive, ConferenceArchive.archived, since,
+                    until).fetch_page(room, start_cursor=cursor)
+                for archive in entities:
+                    form.removedConferenceKeys.append(ndb.Key(
+                        Conference, archive.key.id(),
+                        parent=archive.key.parent()).urlsafe())
+                    form.removedSessionKeys.extend(
+                        s_key.urlsafe() for s_key in archive.sessionKeys)
+            elif phase == 'conferences':
+                entities, next_cursor, more = self._syncQuery(
+                    Conference, Conference.updated, since,
+                    until).fetch_page(room, start_cursor=cursor)
+                form.conferences.extend(
+                    self._copyConferencesToForms(entities).items)
+            else:
+                entities, next_cursor, more = self._syncQuery(
+                    Session, Session.updated, since,
+                    until).fetch_page(room, start_cursor=cursor)
+                form.sessions.extend(
+                    [self._copySessionToForm(sess) for sess in entities])
+            room -= len(entities)
+            if more and next_cursor:
+                state['cursor'] = next_cursor.urlsafe()
+            else:
+                state['phase'] += 1
+                state['cursor'] = None
+
+        form.more = state['phase'] < len(SYNC_PHASES)
+        if not form.more:
+            # the next round starts where this one ended
+            state = {'since': state['until'] - SYNC_OVERLAP.seconds * 10**6,
+                     'until': None, 'phase': 0, 'cursor': None}
+        form.nextToken = self._encodeSyncToken(state)
+        return form
+
+
+    @endpoints.method(CONF_BATCH_REQUEST, ConferenceResultForms,
+            path='conferences/batch',
+            http_method='POST', name='getConferencesBatch')
+    @admissionControl(EXPENSIVE)
+    def getConferencesBatch(self, request):
+        """Return up to MAX_BATCH_KEYS conferences by websafe key, in request
+        order; keys that are invalid or not found are marked found=False."""
+        wscks = request.websafeConferenceKeys
+        if len(wscks) > MAX_BATCH_KEYS:
+            raise endpoints.BadRequestException(
+                'At most %d conference keys per batch' % MAX_BATCH_KEYS)
+
+        keys = []
+        for wsck in wscks:
+            try:
+                key = ndb.Key(urlsafe=wsck)
+            except Exception:
+                key = None
+            keys.append(key if key and key.kind() == 'Conference' else None)
+
+        # one get_multi for all of them (plus the archive for misses);
+        # organizer names are stored on the conference
+        valid = list(set(key for key in keys if key))
+        confs = [conf for conf in getConferences(valid) if conf]
+        mask = self._fieldMask(ConferenceForm, request.fields)
+        forms = dict((conf.key, form) for conf, form in
+                     zip(confs, self._copyConferencesToForms(confs, mask).items))
+        return ConferenceResultForms(items=[
+            ConferenceResultForm(websafeKey=wsck, found=key in forms,
+                                 conference=forms.get(key))
+            for wsck, key in zip(wscks, keys)])
+
+
+    @endpoints.method(FIELDS_GET_REQUEST, ConferenceForms,
             path='getConferencesCreated',
             http_method='POST', name='getConferencesCreated')
+    @admissionControl(NORMAL)
     def getConferencesCreated(self, request):
         """Return conferences created by user."""
         # make sure user is authed
@@ -316,12 +809,12 @@ class ConferenceApi(remote.Service):
         user_id = getUserId(user)
 
         # create ancestor query for all key matches for this user
-        confs = Conference.query(ancestor=ndb.Key(Profile, user_id))
-        prof = ndb.Key(Profile, user_id).get()
+        mask = self._fieldMask(ConferenceForm, request.fields)
+        confs = self._fetchMasked(
+            Conference.query(ancestor=ndb.Key(Profile, user_id)),
+            Conference, mask, 'created')
         # return set of ConferenceForm objects per Conference
-        return ConferenceForms(
-            items=[self._copyConferenceToForm(conf, getattr(prof, 'displayName')) for conf in confs]
-        )
+        return self._copyConferencesToForms(confs, mask)
 
 
     def _getQuery(self, request):
@@ -337,8 +830,6 @@ class ConferenceApi(remote.Service):
             q = q.order(Conference.name)
 
         for filtr in filters:
-            if filtr["field"] in ["month", "maxAttendees"]:
-                filtr["value"] = int(filtr["value"])
             formatted_query = ndb.query.FilterNode(filtr["field"], filtr["operator"], filtr["value"])
             q = q.filter(formatted_query)
         return q
@@ -357,6 +848,8 @@ class ConferenceApi(remote.Service):
                 filtr["operator"] = OPERATORS[filtr["operator"]]
             except KeyError:
                 raise endpoints.BadRequestException("Filter contains invalid field or operator.")
+            if filtr["field"] in ["month", "maxAttendees"]:
+                filtr["value"] = int(filtr["value"])
 
             # Every operation except "=" is an inequality
             if filtr["operator"] != "=":
@@ -376,30 +869,41 @@ class ConferenceApi(remote.Service):
             path='queryConferences',
             http_method='POST',
             name='queryConferences')
+    @admissionControl(EXPENSIVE)
     def queryConferences(self, request):
-        """Query for conferences."""
-        conferences = self._getQuery(request)
-
-        # need to fetch organiser displayName from profiles
-        # get all keys and use get_multi for speed
-        organisers = [(ndb.Key(Profile, conf.organizerUserId)) for conf in conferences]
-        profiles = ndb.get_multi(organisers)
-
-        # put display names in a dict for easier fetching
-        names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
+        """Query for conferences; finished conferences are only searched
+        with includeArchived."""
+        mask = self._fieldMask(ConferenceForm, request.fields)
+        inequality_filter, filters = self._formatFilters(request.filters)
+        if request.includeArchived:
+            # merging with the archive sorts on whole entities
+            conferences = self._getQuery(request).fetch()
+        else:
+            equalities = set(filtr['field'] for filtr in filters
+                             if filtr['operator'] == '=')
+            conferences = self._fetchMasked(
+                self._getQuery(request), Conference, mask,
+                'query:%s:%s' % (','.join(sorted(equalities)),
+                                 inequality_filter or ''),
+                equalities)
+        if request.includeArchived:
+            conferences += queryArchived(filters)
+            # keep the live query's order: inequality field, then name
+            def sortKey(conf):
+                if not inequality_filter:
+                    return conf.name
+                value = getattr(conf, inequality_filter)
+                return (min(value) if isinstance(value, list) else value,
+                        conf.name)
+            conferences.sort(key=sortKey)
 
         # return individual ConferenceForm object per Conference
-        return ConferenceForms(
-                items=[self._copyConferenceToForm(conf, names[conf.organizerUserId]) for conf in \
-                conferences]
-        )
+        return self._copyConferencesToForms(conferences, mask)
 
 
 # - - - Profile objects - - - - - - - - - - - - - - - - - - -
 
-    def _copyProfileToForm(self, prof):
+    def _copyProfileToForm(self, prof, wishlist=None):
         """Copy relevant fields from Profile to ProfileForm."""
         # copy relevant fields from Profile to ProfileForm
         pf = ProfileForm()
@@ -410,6 +914,9 @@ class ConferenceApi(remote.Service):
                     setattr(pf, field.name, getattr(TeeShirtSize, getattr(prof, field.name)))
                 else:
                     setattr(pf, field.name, getattr(prof, field.name))
+        # wishlist lives in its own entity once migrated
+        if wishlist:
+            pf.sessionWishlistKeys = [s_key.urlsafe() for s_key in wishlist.sessions]
         pf.check_initialized()
         return pf
 
@@ -440,11 +947,14 @@ class ConferenceApi(remote.Service):
 
     def _doProfile(self, save_request=None):
         """Get user Profile and return to user, possibly updating it first."""
-        # get user Profile
+        # fetch the wishlist alongside the user Profile
+        wl_future = self._wishlistKey(self.authUserCheck()).get_async()
         prof = self._getProfileFromUser()
 
         # if saveProfile(), process user-modifyable fields
+        tasks = TaskBatch()
         if save_request:
+            oldName = prof.displayName
             for field in ('displayName', 'teeShirtSize'):
                 if hasattr(save_request, field):
                     val = getattr(save_request, field)
@@ -454,26 +964,83 @@ class ConferenceApi(remote.Service):
                         #    setattr(prof, field, str(val).upper())
                         #else:
                         #    setattr(prof, field, val)
-                        prof.put()
+            prof.put()
+
+            # conferences carry a copy of the organizer name; the task reads
+            # the new one, so it is enqueued once the put is done, while the
+            # form is built
+            if prof.displayName != oldName:
+                tasks.add(taskqueue.Task(params={'p_key': prof.key.urlsafe()},
+                    url='/tasks/update_organizer_name'))
+                tasks.flush()
 
         # return ProfileForm
-        return self._copyProfileToForm(prof)
+        wishlist = wl_future.get_result()
+        form = self._copyProfileToForm(prof, wishlist)
+        form.etag = self._etag('p', [prof, wishlist])
+        tasks.wait()
+        return form
 
 
-    @endpoints.method(message_types.VoidMessage, ProfileForm,
+    @endpoints.method(PROFILE_GET_REQUEST, ProfileForm,
             path='profile', http_method='GET', name='getProfile')
     def getProfile(self, request):
-        """Return user profile."""
-        return self._doProfile()
+        """Return user profile; only its etag and notModified when
+        ifNoneMatch is still current."""
+        etag = self._ifNoneMatch(request)
+        if not etag:
+            return self._doProfile()
+        p_key = self.authUserCheck()
+        keys = [p_key, self._wishlistKey(p_key)]
+        if etag == self._cachedEtag('p', keys):
+            return ProfileForm(etag=etag, notModified=True)
+        form = self._doProfile()
+        if form.etag != etag:
+            # versions were evicted or the client is behind; both entities
+            # were just loaded, so republish them
+            self._cacheVersions(keys, ndb.get_multi(keys))
+        return form
 
 
     @endpoints.method(ProfileMiniForm, ProfileForm,
             path='profile', http_method='POST', name='saveProfile')
+    @admissionControl(CRITICAL)
     def saveProfile(self, request):
         """Update & return user profile."""
         return self._doProfile(request)
 
 
+    @staticmethod
+    def _updateOrganizerName(websafeProfileKey, websafeCursor=None):
+        """Copy the organizer's current displayName onto one batch of their
+        conferences; used by the rename task after saveProfile().
+        Returns: websafe cursor for the next batch, or None when done"""
+        p_key = ndb.Key(urlsafe=websafeProfileKey)
+        cursor = Cursor(urlsafe=websafeCursor) if websafeCursor else None
+        c_keys, next_cursor, more = Conference.query(ancestor=p_key).fetch_page(
+            MIGRATION_BATCH_SIZE, start_cursor=cursor, keys_only=True)
+
+        # the profile and its conferences are one entity group, so the
+        # batch is rewritten in one transaction and a registration that
+        # commits meanwhile retries it rather than losing its seat count
+        def rename():
+            prof = p_key.get()
+            if not prof:
+                return False
+            changed = [conf for conf in ndb.get_multi(c_keys)
+                       if conf and conf.organizerDisplayName != prof.displayName]
+            for conf in changed:
+                conf.organizerDisplayName = prof.displayName
+            ndb.put_multi(changed)
+            return True
+        if not ndb.transaction(rename):
+            return None
+
+        if more and next_cursor:
+            return next_cursor.urlsafe()
+        return None
+
+
 # - - - Announcements - - - - - - - - - - - - - - - - - - - -
 
     @staticmethod
@@ -501,6 +1068,23 @@ class ConferenceApi(remote.Service):
         return announcement
 
 
+    @staticmethod
+    def _warmCaches():
+        """Prefill memcache and the ndb cache on a fresh instance; used by
+        the warmup handler.  The featured speaker is only ever set by the
+        session task, so there is nothing to rebuild for it here.
+        """
+        if memcache.get(MEMCACHE_ANNOUNCEMENTS_KEY) is None:
+            ConferenceApi._cacheAnnouncement()
+
+        # hot conferences and sessions are the trending ones; loading them
+        # fills memcache with the trending lists, and memcache and this
+        # instance's entity cache with the entities
+        hot_confs = getTrending(TRENDING_CONFERENCES_ID)
+        hot_sessns = getTrending(TRENDING_SESSIONS_ID)
+        getMulti(hot_confs + hot_sessns)
+
+
     @endpoints.method(message_types.VoidMessage, StringMessage,
             path='conference/announcement/get',
             http_method='GET', name='getAnnouncement')
@@ -560,49 +1144,116 @@ class ConferenceApi(remote.Service):
         return BooleanMessage(data=retval)
 
 
-    @endpoints.method(message_types.VoidMessage, ConferenceForms,
+    @endpoints.method(FIELDS_GET_REQUEST, ConferenceForms,
             path='conferences/attending',
             http_method='GET', name='getConferencesToAttend')
+    @admissionControl(NORMAL)
     def getConferencesToAttend(self, request):
         """Get list of conferences that user has registered for."""
         prof = self._getProfileFromUser() # get user Profile
         conf_keys = [ndb.Key(urlsafe=wsck) for wsck in prof.conferenceKeysToAttend]
-        conferences = ndb.get_multi(conf_keys)
-
-        # get organizers
-        organisers = [ndb.Key(Profile, conf.organizerUserId) for conf in conferences]
-        profiles = ndb.get_multi(organisers)
-
-        # put display names in a dict for easier fetching
-        names = {}
-        for profile in profiles:
-            names[profile.key.id()] = profile.displayName
+        conferences = [conf for conf in getConferences(conf_keys) if conf]
 
         # return set of ConferenceForm objects per Conference
-        return ConferenceForms(items=[self._copyConferenceToForm(conf, names[conf.organizerUserId])\
-         for conf in conferences]
-        )
+        return self._copyConferencesToForms(
+            conferences, self._fieldMask(ConferenceForm, request.fields))
 
 
     @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
             path='conference/{websafeConferenceKey}',
             http_method='POST', name='registerForConference')
+    @admissionControl(CRITICAL)
     def registerForConference(self, request):
         """Register user for selected conference."""
-        return self._conferenceRegistration(request)
+        result = self._conferenceRegistration(request)
+        if result.data:
+            self._countPopularity(ndb.Key(urlsafe=request.websafeConferenceKey),
+                'registrations', 1).wait()
+        return result
 
 
     @endpoints.method(CONF_GET_REQUEST, BooleanMessage,
             path='conference/{websafeConferenceKey}',
             http_method='DELETE', name='unregisterFromConference')
+    @admissionControl(CRITICAL)
     def unregisterFromConference(self, request):
         """Unregister user for selected conference."""
-        return self._conferenceRegistration(request, reg=False)
+        result = self._conferenceRegistration(request, reg=False)
+        if result.data:
+            self._countPopularity(ndb.Key(urlsafe=request.websafeConferenceKey),
+                'registrations', -1).wait()
+        return result
+
+
+    @staticmethod
+    def _countPopularity(key, field, delta):
+        """Start a popularity counter update outside of any user transaction;
+        counter failures are logged rather than failing the request.
+        Returns: future"""
+        def logFailure(future):
+            if future.get_exception():
+                logging.warning("Unable to count %s for %s: %s",
+                    field, key, future.get_exception())
+        future = incrementCounter(key, field, delta)
+        future.add_immediate_callback(logFailure, future)
+        return future
+
+
+    @endpoints.method(FIELDS_GET_REQUEST, ConferenceForms,
+            path='conferences/trending',
+            http_method='GET', name='getTrendingConferences')
+    def getTrendingConferences(self, request):
+        """Return the most registered-for conferences."""
+        confs = [conf for conf in getMulti(getTrending(TRENDING_CONFERENCES_ID))
+                 if conf]
+        return self._copyConferencesToForms(
+            confs, self._fieldMask(ConferenceForm, request.fields))
+
+
+    @endpoints.method(STATS_GET_REQ, ConferenceStatsForm,
+            path='conferences/stats',
+            http_method='GET', name='getConferenceStats')
+    def getConferenceStats(self, request):
+        """Return fill rates by city, topic and month and registrations per
+        day, plus the seat burn-down of websafeConferenceKey if given; all
+        precomputed from the analytics export."""
+        keys = [MEMCACHE_CONFERENCE_STATS_KEY]
+        if request.websafeConferenceKey:
+            keys.append(MEMCACHE_BURNDOWN_KEY + request.websafeConferenceKey)
+        cached = memcache.get_multi(keys)
+        stats = cached.get(MEMCACHE_CONFERENCE_STATS_KEY)
+        if stats is None:
+            entity = ndb.Key(ConferenceStats, CONFERENCE_STATS_ID).get()
+            stats = entity.stats if entity else {}
+            if entity:
+                memcache.set(MEMCACHE_CONFERENCE_STATS_KEY, stats)
+
+        def groups(rows):
+            return [StatsGroupForm(group=str(row[0]), conferences=row[1],
+                                   seats=row[2], registered=row[3],
+                                   fillRate=row[4], fillRateP50=row[5],
+                                   fillRateP90=row[6]) for row in rows]
+
+        def points(rows):
+            return [StatsPointForm(date=day, value=value)
+                    for day, value in rows]
+
+        return ConferenceStatsForm(
+            computed=stats.get('computed'),
+            byCity=groups(stats.get('byCity', [])),
+            byTopic=groups(stats.get('byTopic', [])),
+            byMonth=groups(stats.get('byMonth', [])),
+            registrationsPerDay=points(stats.get('registrationsPerDay', [])),
+            burnDown=points(cached.get(
+                MEMCACHE_BURNDOWN_KEY + (request.websafeConferenceKey or ''),
+                [])),
+        )
 
 
     @endpoints.method(message_types.VoidMessage, ConferenceForms,
             path='filterPlayground',
             http_method='GET', name='filterPlayground')
+    @admissionControl(EXPENSIVE)
     def filterPlayground(self, request):
         """Filter Playground"""
         q = Conference.query()
@@ -630,6 +1281,7 @@ class ConferenceApi(remote.Service):
         path='conference/{websafeConferenceKey}/session/create',
         name='createSession')
 
+    @admissionControl(CRITICAL)
     def createSession(self, request):
         """Create New Session for Session"""
         return self._createSessionObject(request)
@@ -703,43 +1355,34 @@ class ConferenceApi(remote.Service):
         del data['websafeConferenceKey']
    
         #Commit session to ndb
-        Session(**data).put()
+        sess = Session(**data)
+        sess.put()
 
-        #send email for notification of session creation
-        taskqueue.add(params={'email': user.email(),
-            'sessionInfo': repr(request)},
-            url='/tasks/send_confirmation_email_session'
-        )
+        #queue email for notification of session creation
+        tasks = TaskBatch()
+        tasks.add(confirmationTask(user.email(), 'session', s_key), MAIL_QUEUE)
 
         ################################################
         #Task 4 Call the getFeatured Speaker Task
         ################################################
 
-        ''' Build the parameters list to be passed to the Task queue which will then be 
-        passed to the helper method'''
-        parameters =[('websafeConferenceKey', wsck),
-                        ('sessionKey', s_key.urlsafe())]
-        for speak in data['speakers']:
-            parameters.append(('speaker', speak) )
-
-        '''taskqueue.add(
-            params= dict(parameters),
-                url = '/tasks/featured_speaker_check'
-                )'''
-
-        taskqueue.add(
-            params= dict( [('wsck', wsck), ('s_key', s_key.urlsafe()) ]),
-                url = '/tasks/featured_speaker_check'
-                )
+        '''The session key is all the task needs, its parent is the conference'''
+        tasks.add(taskqueue.Task(params={'s_key': s_key.urlsafe()},
+            url='/tasks/featured_speaker_check'))
 
-        sess = s_key.get()
-        return self._copySessionToForm(sess)
+        '''Enqueue both tasks while the response is built'''
+        tasks.flush()
+        form = self._copySessionToForm(sess)
+        tasks.wait()
+        return form
 
 
-    def _copySessionToForm(self, sess):
-        """Copy Session to SessionForm"""
+    def _copySessionToForm(self, sess, mask=None):
+        """Copy Session to SessionForm; only the fields in mask, if given"""
         s = SessionForm()
         for field in s.all_fields():
+            if mask is not None and field.name not in mask:
+                continue
             if hasattr(sess, field.name):
                 # convert Date to date string; just copy others
                 if field.name.endswith('Date'):
@@ -751,6 +1394,7 @@ class ConferenceApi(remote.Service):
 
                 else:
                     setattr(s, field.name, getattr(sess, field.name))
+        s.websafeKey = sess.key.urlsafe()
         s.check_initialized()
         return s
 
@@ -759,6 +1403,7 @@ class ConferenceApi(remote.Service):
         path='getConferenceSessions',
         http_method = 'POST', 
         name = 'getConferenceSessions')
+    @admissionControl(NORMAL)
     def getConferenceSessions(self, request):
         """Return all sessions from a given conference."""
         # make sure user is authed
@@ -771,26 +1416,54 @@ class ConferenceApi(remote.Service):
         """Get Parent Conference obj"""
         conf_key = ndb.Key(urlsafe = request.websafeConferenceKey)
 
-        sessns = Session.query(ancestor =conf_key)
+        mask = self._fieldMask(SessionForm, request.fields)
+        # read the list's generation before the sessions, so a concurrent
+        # write can only make the returned ETag stale, never wrong
+        etag = 's%d%s' % (self._sessionsGeneration(conf_key),
+                          self._maskTag(mask))
+        if etag == self._ifNoneMatch(request):
+            return SessionForms(etag=etag, notModified=True)
+
+        sessns = Session.query(ancestor =conf_key).fetch()
+        if not sessns:
+            # finished conferences keep their sessions in the archive
+            sessns = getArchivedSessions(conf_key)
         
         prof = ndb.Key(Profile, user_id).get()
 
         return SessionForms(
-            items=[self._copySessionToForm(sess) for sess in sessns]
+            items=[self._copySessionToForm(sess, mask) for sess in sessns],
+            etag=etag,
         )
 
+
+    @staticmethod
+    def _sessionsGeneration(conf_key):
+        """Return the memcache generation of a conference's session list;
+        every Session put increments it.  A missing generation restarts
+        from the clock, so it never repeats an ETag handed out before."""
+        gen_key = MEMCACHE_SESSIONS_GENERATION_KEY % conf_key.urlsafe()
+        generation = memcache.get(gen_key)
+        if generation is None:
+            generation = int(time.time() * 1000)
+            if not memcache.add(gen_key, generation):
+                generation = memcache.get(gen_key) or generation
+        return generation
+
     @endpoints.method(SESS_GET_REQ_TYPE, SessionForms,
         path='getConferenceSessionsByType',
         http_method = 'POST', 
         name = 'getConferenceSessionsByType')
+    @admissionControl(EXPENSIVE)
     def getConferenceSessionsByType(self, request):
         """Return all sessions from a given conference with a specified type."""
         # make sure user is authed
         """Pass request parameters to helper method"""
         sessns = self._getConferenceSessionsByType(request.websafeConferenceKey, request.sessionType)
+        mask = self._fieldMask(SessionForm, request.fields)
 
         return SessionForms(
-            items=[self._copySessionToForm(sess) for sess in sessns]
+            items=[self._copySessionToForm(sess, mask) for sess in sessns]
         )
 
     def _getConferenceSessionsByType(self, websafeConferenceKey, sessionType):
@@ -814,6 +1487,7 @@ class ConferenceApi(remote.Service):
         path='getSessionsBySpeaker',
         http_method = 'GET', 
         name = 'getSessionsBySpeaker')
+    @admissionControl(EXPENSIVE)
     def getSessionsBySpeaker(self, request):
         """Return all sessions from a given conference with a specified type."""
         # make sure user is authed
@@ -826,9 +1500,10 @@ class ConferenceApi(remote.Service):
         query_speakers = [s for s in request.speakers]
         sessns = Session.query(Session.speakers.IN(query_speakers))
         prof = ndb.Key(Profile, user_id).get()
+        mask = self._fieldMask(SessionForm, request.fields)
 
         return SessionForms(
-            items=[self._copySessionToForm(sess) for sess in sessns]
+            items=[self._copySessionToForm(sess, mask) for sess in sessns]
         )
 
 
@@ -842,13 +1517,13 @@ class ConferenceApi(remote.Service):
     @endpoints.method(SESS_WISHLIST_REQ, SessionForms,
         path='addSessionToWishlist',
         http_method='POST', name = 'addSessionToWishlist')
+    @admissionControl(CRITICAL)
     def addSessionToWishlist(self, request):
         """Adds a session to a user's wishlist"""
         return self._wishlistRegistration(request)
 
 
 
-    @ndb.transactional(xg=True)
     def _wishlistRegistration( self, request, save=True ):
         wssk = request.websafeSessionKey
 
@@ -861,52 +1536,102 @@ class ConferenceApi(remote.Service):
             prof_key = self.authUserCheck()
         except:
             raise endpoints.UnauthorizedException('User not authorized in CreateSession')
-        prof = prof_key.get()
 
         '''Check for valid session'''
         try:
-            ndb.Key(urlsafe = wssk)
+            s_key = ndb.Key(urlsafe = wssk)
         except:
             raise endpoints.BadRequestException("Session Key isn't valid")
+        if s_key.kind() != 'Session':
+            raise endpoints.BadRequestException("Session Key isn't valid")
+
+        '''Only the wishlist entity is written, sessions are read afterwards'''
+        s_keys, changed = self._updateWishlist(prof_key, s_key, save)
+        counted = None
+        if changed:
+            counted = self._countPopularity(s_key, 'wishlists', 1 if save else -1)
+        sessns = ndb.get_multi(s_keys)
+        if counted:
+            counted.wait()
+
+        return SessionForms(
+            items=[self._copySessionToForm(sess) for sess in sessns if sess]
+        )
 
-        '''Pull list of session keys from profile'''
-        sessns = prof.sessionWishlistKeys
 
-        """Check if wishlist  already contains the session"""
-        if  wssk in prof.sessionWishlistKeys:
-            '''Complete additon or removal based on Save flag'''
-            if not save:
-                '''If requestd session is in profile list remove it'''
-                save_index = sessns.index(wssk) 
-                sessns.pop(save_index)
+    @ndb.transactional()
+    def _updateWishlist(self, prof_key, s_key, save):
+        """Add or remove a session key in the user's WishList; the WishList
+        is a child of the Profile so no cross-group transaction is needed.
+        Returns: (list of session keys in the wishlist, changed flag)"""
+        wishlist = self._loadWishlist(prof_key)
+        if save and s_key not in wishlist.sessions:
+            wishlist.sessions.append(s_key)
+        elif not save and s_key in wishlist.sessions:
+            wishlist.sessions.remove(s_key)
         else:
-            if save:
-                sessns.append(wssk)
+            return wishlist.sessions, False
+        wishlist.put()
+        return wishlist.sessions, True
 
-        '''Write saves back to profile'''
-        prof.put()
-            
 
-        sessns = [ndb.Key(urlsafe = s_key).get() for s_key in prof.sessionWishlistKeys]
+    @staticmethod
+    def _wishlistKey(prof_key):
+        """Return the key of the WishList entity for a Profile key."""
+        return ndb.Key(WishList, WISHLIST_ID, parent=prof_key)
 
 
-        return SessionForms(
-            items=[self._copySessionToForm(sess) for sess in sessns]
-        )
+    @staticmethod
+    def _loadWishlist(prof_key):
+        """Return the user's WishList, moving a legacy
+        Profile.sessionWishlistKeys list into it if there is one.
+        Must run inside a transaction on the Profile entity group."""
+        wl_key = ConferenceApi._wishlistKey(prof_key)
+        wishlist = wl_key.get()
+        if wishlist:
+            return wishlist
+
+        wishlist = WishList(key=wl_key)
+        prof = prof_key.get()
+        if prof and prof.sessionWishlistKeys:
+            wishlist.sessions = [ndb.Key(urlsafe=wssk) for wssk in prof.sessionWishlistKeys]
+            prof.sessionWishlistKeys = []
+            ndb.put_multi([prof, wishlist])
+        return wishlist
+
+
+    @staticmethod
+    def _migrateWishlists(websafeCursor=None):
+        """Move one batch of legacy profile wishlists into WishList entities.
+        Returns: websafe cursor for the next batch, or None when done"""
+        cursor = Cursor(urlsafe=websafeCursor) if websafeCursor else None
+        profs, next_cursor, more = Profile.query().fetch_page(
+            MIGRATION_BATCH_SIZE, start_cursor=cursor)
+
+        for prof in profs:
+            if prof.sessionWishlistKeys:
+                ndb.transaction(
+                    lambda: ConferenceApi._loadWishlist(prof.key))
+
+        if more and next_cursor:
+            return next_cursor.urlsafe()
+        return None
 
 
     @endpoints.method(SESS_WISHLIST_REQ, SessionForms,
         path='deleteSessionFromWishlist',
         http_method='POST', name = 'deleteSessionFromWishlist')
+    @admissionControl(CRITICAL)
     def deleteSessionFromWishlist(self, request):
         """Deletes a session from a user's wishlist"""
 
         return self._wishlistRegistration(request, save=False)
 
 
-    @endpoints.method(message_types.VoidMessage, SessionForms,
+    @endpoints.method(FIELDS_GET_REQUEST, SessionForms,
         path = 'getSessionsInWishlist',
         http_method='GET', name = 'getSessionsInWishlist')
+    @admissionControl(NORMAL)
     def getSessionsInWishlist(self, request):
         """Gets a session to a user's wishlist"""
         """pull wishlist for user, if fails then create one and link to to the acncestor of the user"""
@@ -917,14 +1642,61 @@ class ConferenceApi(remote.Service):
         user_id = getUserId(user)
         
         prof_key = ndb.Key(Profile, user_id)
-        prof = prof_key.get()
-        
-        
-        """Attempt to pull the wishlist"""
-        sessns = [ndb.Key(urlsafe = s_key).get() for s_key in prof.sessionWishlistKeys]
-        
+        prof, wishlist = ndb.get_multi([prof_key, self._wishlistKey(prof_key)])
+
+        """Attempt to pull the wishlist, falling back to the legacy list"""
+        if wishlist:
+            s_keys = wishlist.sessions
+        elif prof:
+            s_keys = [ndb.Key(urlsafe = wssk) for wssk in prof.sessionWishlistKeys]
+        else:
+            s_keys = []
+        sessns = getSessions(s_keys)
+        mask = self._fieldMask(SessionForm, request.fields)
+
         return SessionForms(
-            items=[self._copySessionToForm(sess) for sess in sessns]
+            items=[self._copySessionToForm(sess, mask) for sess in sessns if sess]
+        )
+
+
+    @endpoints.method(SESS_GET_REQ_KEY, SessionForms,
+        path='getRecommendedSessions',
+        http_method='GET', name = 'getRecommendedSessions')
+    def getRecommendedSessions(self, request):
+        """Returns sessions most often wishlisted together with the given one"""
+        try:
+            wssk = ndb.Key(urlsafe = request.websafeSessionKey).urlsafe()
+        except:
+            raise endpoints.BadRequestException("Session Key isn't valid")
+
+        """Recommendations are precomputed by the recommendations cron job"""
+        rec = ndb.Key(SessionRecommendation, wssk).get()
+        if not rec:
+            return SessionForms(items=[])
+        sessns = getMulti(rec.sessions)
+        mask = self._fieldMask(SessionForm, request.fields)
+
+        return SessionForms(
+            items=[self._copySessionToForm(sess, mask) for sess in sessns if sess]
+        )
+
+
+    @endpoints.method(TRENDING_GET_REQ, SessionForms,
+        path='getTrendingSessions',
+        http_method='GET', name = 'getTrendingSessions')
+    def getTrendingSessions(self, request):
+        """Returns the most wishlisted sessions, overall or for one conference"""
+        trending_id = TRENDING_SESSIONS_ID
+        if request.websafeConferenceKey:
+            try:
+                trending_id = ndb.Key(urlsafe = request.websafeConferenceKey).urlsafe()
+            except:
+                raise endpoints.BadRequestException("Conference Key isn't valid")
+
+        sessns = getMulti(getTrending(trending_id))
+        mask = self._fieldMask(SessionForm, request.fields)
+        return SessionForms(
+            items=[self._copySessionToForm(sess, mask) for sess in sessns if sess]
         )
 
 #########################################
@@ -935,6 +1707,7 @@ class ConferenceApi(remote.Service):
     @endpoints.method(SESS_GET_REQ_TIME, SessionForms,
         path='getSessionsBeforeTime',
         http_method='GET', name = 'getSessionsBeforeTime' )
+    @admissionControl(EXPENSIVE)
     def getSessionsBeforeTime(self, request):
         """Returns all sesions before the time specified for a given confernce """
         user = endpoints.get_current_user()
@@ -959,14 +1732,16 @@ class ConferenceApi(remote.Service):
 
         """Find all sesions after a certain time in the day"""
         sessns = sessns_base.filter(Session.startTime <= start_time)
+        mask = self._fieldMask(SessionForm, request.fields)
         return SessionForms(
-            items=[self._copySessionToForm(sess) for sess in sessns]
+            items=[self._copySessionToForm(sess, mask) for sess in sessns]
         ) 
 
 
     @endpoints.method(SESS_GET_REQ_TIME, SessionForms,
         path='getSessionsAfterTime',
         http_method='GET', name = 'getSessionsAfterTime' )
+    @admissionControl(EXPENSIVE)
     def getSessionsAfterTime(self, request):
         """Returns all sesions after the time specified for a given confernce """
         user = endpoints.get_current_user()
@@ -991,8 +1766,9 @@ class ConferenceApi(remote.Service):
 
         """Find all sesions after a certain time in the day"""
         sessns = sessns_base.filter(Session.startTime >= start_time)
+        mask = self._fieldMask(SessionForm, request.fields)
         return SessionForms(
-            items=[self._copySessionToForm(sess) for sess in sessns]
+            items=[self._copySessionToForm(sess, mask) for sess in sessns]
         ) 
 
     
@@ -1004,6 +1780,7 @@ class ConferenceApi(remote.Service):
     @endpoints.method(TASK3_SOLUTION_REQ, SessionForms,
         path='task3Solution',
         http_method='POST', name = 'task3Solution' )
+    @admissionControl(EXPENSIVE)
     def task3Solution(self, request):
         """Returns all sesions afer after a certiain time and match the session type"""
 
@@ -1028,22 +1805,20 @@ class ConferenceApi(remote.Service):
         start_time = datetime.strptime(request.searchTime, "%H:%M").time()
 
 
-        """Fetch all sesion that match the sessiontype"""
-        """Cast request as a tuple to use in the IN() filter """
-        query_sessionTypes = [request.sessionType, '']
-        
-        #All queries that aren't  whatever was provided
-        sessn_type_query = Session.query(Session.typeofSession != request.sessionType)
+        """Datastore allows only one inequality filter per query, and
+        sessionType is a list, so the types are excluded in memory"""
         logging.info('Session type: %s', request.sessionType)
+        excluded = set(request.sessionType)
 
         #All sessions before the start time provided
         sessn_time_query = Session.query(Session.startTime <= start_time)
 
-
-        #Find all sesions after a certain time in the day
-        sessns = set(sessn_type_query).intersection( set(sessn_time_query) )
+        #Drop the ones of any of the types provided
+        sessns = [sess for sess in sessn_time_query
+                  if not excluded.intersection(sess.typeofSession)]
+        mask = self._fieldMask(SessionForm, request.fields)
         return SessionForms(
-            items=[self._copySessionToForm(sess) for sess in sessns]
+            items=[self._copySessionToForm(sess, mask) for sess in sessns]
         ) 
 
 
@@ -1084,10 +1859,8 @@ class ConferenceApi(remote.Service):
         return StringMessage(data=memcache.get(MEMCACHE_FEATURED_SPEAKERS_KEY) or "")
     
     @staticmethod
-    def _cacheFeaturedSpeakers(websafeConferenceKey, s_key):
-        '''fetch all sessions for conference'''
-        wsck = ndb.Key(urlsafe = websafeConferenceKey)
-        sessns = Session.query(ancestor = wsck).get()
+    def _cacheFeaturedSpeakers(s_key):
+        '''fetch the new session'''
         new_sessn = ndb.Key(urlsafe=s_key).get()
         new_speakers = new_sessn.speakers
         for speaker in new_speakers:
@@ -1104,4 +1877,4 @@ class ConferenceApi(remote.Service):
 
 
 
-api = endpoints.api_server([ConferenceApi]) # register API
+api = instrument(endpoints.api_server([ConferenceApi])) # register API
@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+
+"""
+dispatch.py -- Udacity conference server-side Python App Engine
+    collects the task queue tasks a request produces and enqueues them
+    with one asynchronous add per queue
+
+"""
+
+from google.appengine.api import taskqueue
+
+DEFAULT_QUEUE = 'default'
+
+
+class TaskBatch(object):
+    """TaskBatch -- tasks produced by one request, grouped by queue"""
+
+    def __init__(self):
+        self._tasks = {}
+        self._rpcs = []
+
+    def add(self, task, queue_name=DEFAULT_QUEUE):
+        """Collect a taskqueue.Task to be enqueued on flush()."""
+        self._tasks.setdefault(queue_name, []).append(task)
+
+    def flush(self):
+        """Start enqueueing all collected tasks, one add_async call per
+        queue; the caller can keep working until wait()."""
+        for queue_name, tasks in self._tasks.iteritems():
+            self._rpcs.append(taskqueue.Queue(queue_name).add_async(tasks))
+        self._tasks = {}
+
+    def wait(self):
+        """Flush anything left and block until every add has completed."""
+        self.flush()
+        rpcs, self._rpcs = self._rpcs, []
+        for rpc in rpcs:
+            rpc.get_result()
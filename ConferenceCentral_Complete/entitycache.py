@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+
+"""
+entitycache.py -- Udacity conference server-side Python App Engine
+    bounded in-process LRU of read-mostly entities (conferences, sessions,
+    organizer profiles), shared by the instance's request threads, with
+    singleflight fetches and revalidation against the memcache versions
+    VersionedModel publishes
+
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from models import VERSION_LISTENERS
+from models import VERSION_TTL
+from models import VersionedModel
+
+MAX_ENTRIES = 2000
+# entries are served without any RPC for FRESH_SECONDS, then revalidated
+# against their memcache version until TTL_SECONDS after they were loaded
+FRESH_SECONDS = 5
+TTL_SECONDS = 300
+# followers give up on a stuck leader's fetch and fetch for themselves
+FLIGHT_TIMEOUT = 10
+
+_lock = threading.Lock()
+# key -> [entity, loaded time, checked time], least recently used first
+_entries = OrderedDict()
+# key -> _Flight of the thread fetching it
+_flights = {}
+
+
+class _Flight(object):
+    """One thread's fetch of a key, which other threads wait for."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.entity = None
+        self.failed = False
+
+
+def _store(key, entity, now):
+    """Cache entity under key, evicting the least recently used entries."""
+    with _lock:
+        _entries.pop(key, None)
+        _entries[key] = [entity, now, now]
+        while len(_entries) > MAX_ENTRIES:
+            _entries.popitem(last=False)
+
+
+def evict(key):
+    """Drop key from this instance's cache; called on commit of every
+    VersionedModel put made here."""
+    with _lock:
+        _entries.pop(key, None)
+
+VERSION_LISTENERS.append(evict)
+
+
+def clear():
+    with _lock:
+        _entries.clear()
+
+
+def _lookup(keys, now):
+    """Split keys into cached entities, stale entries worth revalidating,
+    and misses.
+    Returns: (dict key -> entity, dict key -> entity, list of keys)"""
+    hits, stale, misses = {}, {}, []
+    with _lock:
+        for key in keys:
+            entry = _entries.get(key)
+            if entry is None or now - entry[1] > TTL_SECONDS:
+                misses.append(key)
+                continue
+            # move to the most recently used end
+            del _entries[key]
+            _entries[key] = entry
+            if now - entry[2] <= FRESH_SECONDS:
+                hits[key] = entry[0]
+            else:
+                stale[key] = entry[0]
+    return hits, stale, misses
+
+
+def _revalidate(stale, now):
+    """Keep the stale entries whose memcache version still matches, with
+    one get_multi.
+    Returns: (dict key -> entity still current, list of changed keys)"""
+    version_keys = dict((VersionedModel.versionKey(key), key) for key in stale)
+    versions = memcache.get_multi(version_keys.keys())
+    current = {}
+    for version_key, key in version_keys.items():
+        if versions.get(version_key) == (stale[key].version or 0):
+            current[key] = stale[key]
+    with _lock:
+        for key in current:
+            entry = _entries.get(key)
+            if entry is not None:
+                entry[2] = now
+    return current, [key for key in stale if key not in current]
+
+
+def _fetch(keys, now):
+    """Fetch keys no other thread is fetching in one get_multi, wait for
+    the rest, and publish the loaded versions for later revalidation.
+    Returns: dict key -> entity or None"""
+    led, followed = [], {}
+    with _lock:
+        for key in keys:
+            flight = _flights.get(key)
+            if flight is None:
+                _flights[key] = _Flight()
+                led.append(key)
+            else:
+                followed[key] = flight
+
+    found = {}
+    if led:
+        try:
+            entities = ndb.get_multi(led)
+        except Exception:
+            with _lock:
+                for key in led:
+                    flight = _flights.pop(key)
+                    flight.failed = True
+                    flight.done.set()
+            raise
+        for key, entity in zip(led, entities):
+            if entity is not None:
+                _store(key, entity, now)
+            found[key] = entity
+        with _lock:
+            for key, entity in zip(led, entities):
+                flight = _flights.pop(key)
+                flight.entity = entity
+                flight.done.set()
+        # add, so a concurrent write's newer version is never overwritten
+        memcache.add_multi(dict(
+            (VersionedModel.versionKey(key), entity.version or 0)
+            for key, entity in found.items() if entity is not None),
+            time=VERSION_TTL)
+
+    retry = []
+    for key, flight in followed.items():
+        if flight.done.wait(FLIGHT_TIMEOUT) and not flight.failed:
+            found[key] = flight.entity
+        else:
+            retry.append(key)
+    if retry:
+        found.update(zip(retry, ndb.get_multi(retry)))
+    return found
+
+
+def getMulti(keys):
+    """ndb.get_multi for read-only use of VersionedModel entities: served
+    from this instance's cache while current, concurrent misses of a key
+    share one fetch.  The entities are shared between requests and must
+    not be modified.  In a transaction this is plain ndb.get_multi.
+    Returns: list of entities or None, in key order"""
+    if ndb.in_transaction():
+        return ndb.get_multi(keys)
+    now = time.time()
+    found, stale, misses = _lookup(keys, now)
+    if stale:
+        current, changed = _revalidate(stale, now)
+        found.update(current)
+        misses.extend(changed)
+    if misses:
+        found.update(_fetch(list(set(misses)), now))
+    return [found.get(key) for key in keys]
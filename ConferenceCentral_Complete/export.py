@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+
+"""
+export.py -- Udacity conference server-side Python App Engine
+    incremental export of conferences, sessions and registrations to
+    gzipped CSV chunks in Cloud Storage (or a local directory), so
+    analytics never pages through the serving endpoints
+
+"""
+
+import csv
+import gzip
+import json
+import os
+from cStringIO import StringIO
+from datetime import datetime, timedelta
+
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+from models import Conference
+from models import ExportWatermark
+from models import Profile
+from models import Session
+
+from settings import EXPORT_BUCKET
+from settings import EXPORT_LOCAL_DIR
+
+EXPORT_URL = '/tasks/export'
+EXPORT_BATCH_SIZE = 500
+EXPORT_PREFIX = 'exports'
+# re-export entities updated shortly before the last run started, to cover
+# clock skew and index lag; consumers keep the last row per key
+WATERMARK_OVERLAP = timedelta(minutes=5)
+# a run that has not finished by then is treated as dead and restarted
+STALE_RUN = timedelta(hours=6)
+
+
+def _conferenceRows(conf):
+    yield (conf.key.urlsafe(), conf.key.parent().id(), conf.name, conf.city,
+           conf.topics, conf.month, conf.startDate, conf.endDate,
+           conf.maxAttendees, conf.seatsAvailable, conf.updated)
+
+
+def _sessionRows(sess):
+    yield (sess.key.urlsafe(), sess.key.parent().urlsafe(), sess.name,
+           sess.typeofSession, sess.speakers, sess.startDate, sess.startTime,
+           sess.endTime, sess.maxAttendees, sess.seatsAvailable, sess.updated)
+
+
+def _registrationRows(prof):
+    # one row per registration; a profile without any still gets a row with
+    # an empty conferenceKey, so unregistering from everything is exported
+    for wsck in prof.conferenceKeysToAttend or [None]:
+        yield (prof.key.id(), wsck, prof.updated)
+
+
+# table name -> (model, columns, function yielding row tuples per entity)
+TABLES = {
+    'conferences': (Conference,
+                    ('key', 'organizerId', 'name', 'city', 'topics', 'month',
+                     'startDate', 'endDate', 'maxAttendees', 'seatsAvailable',
+                     'updated'),
+                    _conferenceRows),
+    'sessions': (Session,
+                 ('key', 'conferenceKey', 'name', 'typeofSession', 'speakers',
+                  'startDate', 'startTime', 'endTime', 'maxAttendees',
+                  'seatsAvailable', 'updated'),
+                 _sessionRows),
+    'registrations': (Profile,
+                      ('profileId', 'conferenceKey', 'updated'),
+                      _registrationRows),
+}
+
+
+def _bucket():
+    if EXPORT_BUCKET:
+        return EXPORT_BUCKET
+    from google.appengine.api import app_identity
+    return app_identity.get_default_gcs_bucket_name()
+
+
+def openFile(path, mode='r'):
+    """Open an export file, under EXPORT_LOCAL_DIR if set, else in the
+    Cloud Storage bucket (the cloudstorage client library is only
+    imported then)."""
+    if EXPORT_LOCAL_DIR:
+        full_path = os.path.join(EXPORT_LOCAL_DIR, path)
+        directory = os.path.dirname(full_path)
+        if mode.startswith('w') and not os.path.isdir(directory):
+            os.makedirs(directory)
+        return open(full_path, mode + 'b')
+    import cloudstorage
+    return cloudstorage.open('/%s/%s' % (_bucket(), path), mode)
+
+
+def listFiles(prefix):
+    """Return the export file paths starting with prefix, sorted."""
+    if EXPORT_LOCAL_DIR:
+        paths = []
+        for root, _, files in os.walk(os.path.join(EXPORT_LOCAL_DIR, prefix)):
+            paths.extend(os.path.relpath(os.path.join(root, name),
+                                         EXPORT_LOCAL_DIR) for name in files)
+        return sorted(paths)
+    import cloudstorage
+    bucket = '/%s/' % _bucket()
+    return sorted(stat.filename[len(bucket):] for stat in
+                  cloudstorage.listbucket(bucket + prefix))
+
+
+def deleteFile(path):
+    """Delete an export file, wherever openFile would open it."""
+    if EXPORT_LOCAL_DIR:
+        os.remove(os.path.join(EXPORT_LOCAL_DIR, path))
+        return
+    import cloudstorage
+    cloudstorage.delete('/%s/%s' % (_bucket(), path))
+
+
+def _runPath(table, run):
+    return '%s/%s/%s' % (EXPORT_PREFIX, table, run)
+
+
+def _formatValue(value):
+    """Render one cell: lists are '|' joined, dates ISO formatted."""
+    if value is None:
+        return ''
+    if isinstance(value, list):
+        return '|'.join(_formatValue(v) for v in value)
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+
+def _writeChunk(path, columns, rows):
+    """Gather rows into one array per column, then write them as a gzipped
+    CSV chunk with a header line."""
+    arrays = [[] for _ in columns]
+    for row in rows:
+        for array, value in zip(arrays, row):
+            array.append(_formatValue(value))
+    buf = StringIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb') as gz:
+        writer = csv.writer(gz)
+        writer.writerow(columns)
+        writer.writerows(zip(*arrays))
+    with openFile(path, 'w') as f:
+        f.write(buf.getvalue())
+    return len(arrays[0])
+
+
+def _tableQuery(model, since):
+    """Everything on the first run, then entities updated since the
+    watermark, oldest first."""
+    if since is None:
+        return model.query()
+    return model.query(model.updated >= since).order(model.updated)
+
+
+def startExport():
+    """Start an export run for every table that has none in progress.
+    Returns: list of (table, run id) started"""
+    now = datetime.utcnow()
+    run = now.strftime('%Y%m%dT%H%M%S')
+    started = []
+    for table in sorted(TABLES):
+        @ndb.transactional()
+        def claim():
+            wm = ExportWatermark.get_or_insert(table)
+            if wm.run and now - wm.runStarted < STALE_RUN:
+                return False
+            wm.run = run
+            wm.runStarted = now
+            wm.put()
+            return True
+        if claim():
+            started.append((table, run))
+    return started
+
+
+def exportBatch(table, run, websafeCursor=None, chunk=0):
+    """Export one batch of a table's run as chunk number chunk; the last
+    batch writes the run's manifest and moves the watermark.
+    Returns: websafe cursor for the next batch, or None when done"""
+    wm = ExportWatermark.get_by_id(table)
+    if not wm or wm.run != run:
+        # superseded by a newer run
+        return None
+    model, columns, rowsFor = TABLES[table]
+    cursor = Cursor(urlsafe=websafeCursor) if websafeCursor else None
+    entities, next_cursor, more = _tableQuery(model, wm.watermark).fetch_page(
+        EXPORT_BATCH_SIZE, start_cursor=cursor)
+    if entities:
+        _writeChunk('%s/part-%05d.csv.gz' % (_runPath(table, run), chunk),
+                    columns, (row for entity in entities
+                              for row in rowsFor(entity)))
+    if more and next_cursor:
+        return next_cursor.urlsafe()
+
+    manifest = {
+        'table': table,
+        'run': run,
+        'columns': columns,
+        'since': wm.watermark.isoformat() if wm.watermark else None,
+        'until': wm.runStarted.isoformat(),
+        'chunks': ['part-%05d.csv.gz' % i
+                   for i in range(chunk + 1 if entities else chunk)],
+    }
+    with openFile('%s/manifest.json' % _runPath(table, run), 'w') as f:
+        f.write(json.dumps(manifest, indent=2, sort_keys=True))
+
+    @ndb.transactional()
+    def finish():
+        current = ExportWatermark.get_by_id(table)
+        if current.run == run:
+            current.watermark = current.runStarted - WATERMARK_OVERLAP
+            current.run = None
+            current.put()
+    finish()
+    return None
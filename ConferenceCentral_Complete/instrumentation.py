@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+
+"""
+instrumentation.py -- Udacity conference server-side Python App Engine
+    per-endpoint wall time, datastore, memcache and taskqueue counters,
+    aggregated in instance memory and flushed to EndpointStats entities
+
+"""
+
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.ext import ndb
+
+from models import EndpointStats
+
+FLUSH_SECONDS = 60
+SPI_PREFIX = '/_ah/spi/'
+# weight of each datastore RPC in the instance's moving average latency
+LATENCY_ALPHA = 0.05
+MAX_PENDING_RPCS = 1000
+
+COUNTERS = ('calls', 'errors', 'wall_ms', 'wall_ms_max', 'rpcs',
+            'ds_reads', 'ds_writes', 'ds_queries',
+            'entities_read', 'entities_written',
+            'memcache_hits', 'memcache_misses', 'taskqueue_adds')
+
+_local = threading.local()
+_lock = threading.Lock()
+_stats = {}
+_started = datetime.utcnow()
+_lastFlush = time.time()
+_rpcStarts = {}
+_datastoreLatencyMs = 0.0
+
+
+def _current():
+    """Return the counters of the call running on this thread, or None."""
+    return getattr(_local, 'record', None)
+
+
+def datastoreLatencyMs():
+    """Moving average of this instance's datastore RPC latency, from
+    starting a call to collecting its result."""
+    return _datastoreLatencyMs
+
+
+def _preCall(service, call, request, response):
+    if service == 'datastore_v3':
+        if len(_rpcStarts) > MAX_PENDING_RPCS:
+            # RPCs whose results were never collected
+            _rpcStarts.clear()
+        _rpcStarts[id(request)] = time.time()
+    record = _current()
+    if record is None:
+        return
+    record['rpcs'] += 1
+    try:
+        if service == 'datastore_v3':
+            if call == 'Get':
+                record['ds_reads'] += 1
+            elif call in ('Put', 'Delete'):
+                record['ds_writes'] += 1
+            elif call in ('RunQuery', 'Next'):
+                record['ds_queries'] += 1
+        elif service == 'taskqueue' and call == 'BulkAdd':
+            record['taskqueue_adds'] += request.add_request_size()
+    except Exception:
+        logging.debug("instrumentation pre-call hook failed", exc_info=True)
+
+
+def _postCall(service, call, request, response):
+    global _datastoreLatencyMs
+    if service == 'datastore_v3':
+        started = _rpcStarts.pop(id(request), None)
+        if started is not None:
+            _datastoreLatencyMs += LATENCY_ALPHA * (
+                (time.time() - started) * 1000.0 - _datastoreLatencyMs)
+    record = _current()
+    if record is None:
+        return
+    try:
+        if service == 'datastore_v3':
+            if call == 'Get':
+                record['entities_read'] += sum(
+                    1 for e in response.entity_list() if e.has_entity())
+            elif call in ('RunQuery', 'Next'):
+                record['entities_read'] += response.result_size()
+            elif call == 'Put':
+                record['entities_written'] += response.key_size()
+            elif call == 'Delete':
+                record['entities_written'] += request.key_size()
+        elif service == 'memcache' and call == 'Get':
+            hits = response.item_size()
+            record['memcache_hits'] += hits
+            record['memcache_misses'] += request.key_size() - hits
+    except Exception:
+        logging.debug("instrumentation post-call hook failed", exc_info=True)
+
+
+apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+    'instrumentation', _preCall)
+apiproxy_stub_map.apiproxy.GetPostCallHooks().Append(
+    'instrumentation', _postCall)
+
+
+def _methodName(environ):
+    """Name a request by endpoint method, e.g. 'ConferenceApi.getConference',
+    or by handler path."""
+    path = environ.get('PATH_INFO', '')
+    if path.startswith(SPI_PREFIX):
+        return path[len(SPI_PREFIX):]
+    return path
+
+
+def _record(name, record):
+    """Fold one call's counters into the instance aggregates."""
+    with _lock:
+        stats = _stats.setdefault(name, dict.fromkeys(COUNTERS, 0))
+        for counter in COUNTERS:
+            if counter == 'wall_ms_max':
+                stats[counter] = max(stats[counter], record['wall_ms'])
+            else:
+                stats[counter] += record[counter]
+
+
+def snapshot():
+    """Return a copy of this instance's not yet flushed aggregates."""
+    with _lock:
+        return dict((name, dict(stats)) for name, stats in _stats.items())
+
+
+def flush():
+    """Write this instance's aggregates to an EndpointStats entity and
+    start a new interval."""
+    global _stats, _started, _lastFlush
+    with _lock:
+        stats, _stats = _stats, {}
+        started, _started = _started, datetime.utcnow()
+        _lastFlush = time.time()
+    if stats:
+        EndpointStats(
+            instance=os.environ.get('INSTANCE_ID', 'local'),
+            started=started,
+            stats=stats,
+        ).put()
+
+
+def recentStats(minutes):
+    """Sum the stats flushed over the last minutes plus this instance's
+    unflushed aggregates, with per-call averages.
+    Returns: dict of method name to counters"""
+    since = datetime.utcnow() - timedelta(minutes=minutes)
+    totals = {}
+    entries = [entity.stats for entity in
+               EndpointStats.query(EndpointStats.flushed >= since)]
+    for stats in entries + [snapshot()]:
+        for name, counters in stats.items():
+            total = totals.setdefault(name, dict.fromkeys(COUNTERS, 0))
+            for counter in COUNTERS:
+                if counter == 'wall_ms_max':
+                    total[counter] = max(total[counter], counters[counter])
+                else:
+                    total[counter] += counters[counter]
+
+    for total in totals.values():
+        calls = float(total['calls'] or 1)
+        for counter in COUNTERS:
+            if counter not in ('calls', 'errors', 'wall_ms_max'):
+                total[counter + '_per_call'] = round(total[counter] / calls, 2)
+    return totals
+
+
+def instrument(app):
+    """Wrap a WSGI app so every request is timed and its RPCs counted."""
+    def instrumented(environ, start_response):
+        record = dict.fromkeys(COUNTERS, 0)
+        record['calls'] = 1
+
+        def recordingStartResponse(status, headers, exc_info=None):
+            if not status.startswith(('2', '3')):
+                record['errors'] = 1
+            return start_response(status, headers, exc_info)
+
+        _local.record = record
+        start = time.time()
+        try:
+            return app(environ, recordingStartResponse)
+        except Exception:
+            record['errors'] = 1
+            raise
+        finally:
+            record['wall_ms'] = (time.time() - start) * 1000.0
+            _local.record = None
+            _record(_methodName(environ), record)
+            if time.time() - _lastFlush > FLUSH_SECONDS:
+                try:
+                    flush()
+                except Exception:
+                    logging.warning("Unable to flush endpoint stats",
+                                    exc_info=True)
+    return instrumented
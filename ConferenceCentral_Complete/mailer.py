@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+
+"""
+mailer.py -- Udacity conference server-side Python App Engine
+    confirmation emails, queued on a pull queue and sent as one digest
+    per recipient
+
+"""
+
+import json
+import logging
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+
+from settings import MAIL_SMTP_HOST
+from settings import MAIL_SMTP_PORT
+
+MAIL_QUEUE = 'mail-digest'
+LEASE_SECONDS = 300
+LEASE_BATCH = 1000
+MAX_BATCHES = 10
+# a confirmation whose digest failed to send this many times is dropped;
+# queue.yaml's task_retry_limit is only the backstop
+MAX_LEASES = 5
+
+DIGEST_SUBJECT = 'Your Conference Central updates'
+DIGEST_TPL = ('Hi, here is what you have created on Conference Central '
+              'recently:\r\n\r\n%s\r\n')
+CONFERENCE_TPL = '- Conference "%s" in %s, starting %s'
+SESSION_TPL = '- Session "%s" on %s at %s'
+
+
+def confirmationTask(email, kind, key):
+    """Return the MAIL_QUEUE pull task confirming a created 'conference' or
+    'session' entity; it is sent later as part of the recipient's digest."""
+    payload = json.dumps({'email': email, 'type': kind, 'key': key.urlsafe()},
+                         separators=(',', ':'))
+    return taskqueue.Task(payload=payload, method='PULL')
+
+
+def _formatLine(kind, entity):
+    """Return the digest line for one created Conference or Session."""
+    if kind == 'conference':
+        return CONFERENCE_TPL % (entity.name, entity.city, entity.startDate)
+    return SESSION_TPL % (entity.name, entity.startDate, entity.startTime)
+
+
+def _send(to, subject, body):
+    """Send one email, through the local SMTP stand-in if one is set."""
+    # only the digest cron sends mail, keep these off the request path
+    from google.appengine.api import app_identity
+    from google.appengine.api import mail
+
+    sender = 'noreply@%s.appspotmail.com' % app_identity.get_application_id()
+    if not MAIL_SMTP_HOST:
+        mail.send_mail(sender, to, subject, body)
+        return
+
+    import smtplib
+    from email.mime.text import MIMEText
+    msg = MIMEText(body)
+    msg['Subject'] = subject
+    msg['From'] = sender
+    msg['To'] = to
+    smtp = smtplib.SMTP(MAIL_SMTP_HOST, MAIL_SMTP_PORT)
+    try:
+        smtp.sendmail(sender, [to], msg.as_string())
+    finally:
+        smtp.quit()
+
+
+def sendDigests():
+    """Lease queued confirmations in batches, group them per recipient and
+    send one digest email each.  Tasks for failed sends are left leased so
+    they are retried once the lease runs out, up to MAX_LEASES times.
+    Returns: number of digests sent"""
+    queue = taskqueue.Queue(MAIL_QUEUE)
+    sent = 0
+    for _ in range(MAX_BATCHES):
+        tasks = queue.lease_tasks(LEASE_SECONDS, LEASE_BATCH)
+        if not tasks:
+            break
+
+        # retry_count counts the leases, this one included
+        expired = [task for task in tasks if task.retry_count > MAX_LEASES]
+        if expired:
+            for task in expired:
+                logging.error("Dropping confirmation after %d failed sends: %s",
+                              task.retry_count - 1, task.payload)
+            queue.delete_tasks(expired)
+            tasks = [task for task in tasks if task.retry_count <= MAX_LEASES]
+            if not tasks:
+                continue
+
+        notes = [json.loads(task.payload) for task in tasks]
+        entities = ndb.get_multi([ndb.Key(urlsafe=note['key']) for note in notes])
+
+        # group tasks and digest lines per recipient, in queue order
+        digests = {}
+        for task, note, entity in zip(tasks, notes, entities):
+            tasks_lines = digests.setdefault(note['email'], ([], []))
+            tasks_lines[0].append(task)
+            if entity:
+                tasks_lines[1].append(_formatLine(note['type'], entity))
+
+        done = []
+        for email, (email_tasks, lines) in digests.iteritems():
+            if lines:
+                try:
+                    _send(email, DIGEST_SUBJECT, DIGEST_TPL % '\r\n'.join(lines))
+                except Exception:
+                    logging.exception("Unable to send digest to %s", email)
+                    continue
+                sent += 1
+            done.extend(email_tasks)
+        queue.delete_tasks(done)
+    return sent
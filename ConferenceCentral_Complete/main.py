@@ -12,13 +12,26 @@ created by wesc on 2014 may 24
 
 __author__ = 'wesc+api@google.com (Wesley Chun)'
 
+import json
 import webapp2
 import logging
-from google.appengine.api import app_identity
-from google.appengine.api import mail
+from datetime import datetime
 from conference import ConferenceApi
-from models import Session
+from popularity import materializeTrending
+from instrumentation import instrument
+from instrumentation import recentStats
 from google.appengine.api import taskqueue
+# mailer (mail, app_identity), recommendations and analytics (numpy), export
+# and the mapper jobs are only needed by their own handlers, so they are
+# imported there
+
+class WarmupHandler(webapp2.RequestHandler):
+    def get(self):
+        """Prefill caches before the instance takes traffic; importing
+        conference above already built the endpoints API config."""
+        ConferenceApi._warmCaches()
+        self.response.set_status(200)
+
 
 class SetAnnouncementHandler(webapp2.RequestHandler):
     def get(self):
@@ -27,53 +40,216 @@ class SetAnnouncementHandler(webapp2.RequestHandler):
         self.response.set_status(204)
 
 
-class SendConfirmationEmailHandlerConference(webapp2.RequestHandler):
+class BuildRecommendationsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Rebuild session recommendations from all wishlists."""
+        from recommendations import buildRecommendations
+        written = buildRecommendations()
+        logging.info("Stored recommendations for %d sessions", written)
+        self.response.set_status(204)
+
+
+class MaterializeTrendingHandler(webapp2.RequestHandler):
+    def get(self):
+        """Recompute trending sessions and conferences from the counters."""
+        written = materializeTrending()
+        logging.info("Stored %d trending lists", written)
+        self.response.set_status(204)
+
+
+class SendMailDigestsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Send queued confirmation emails as one digest per recipient."""
+        from mailer import sendDigests
+        sent = sendDigests()
+        logging.info("Sent %d mail digests", sent)
+        self.response.set_status(204)
+
+class ArchiveConferencesHandler(webapp2.RequestHandler):
+    def get(self):
+        """Archive the first batch of conferences that have ended."""
+        self._archive(None, None)
+
     def post(self):
-        """Send email confirming Conference creation."""
-        mail.send_mail(
-            'noreply@%s.appspotmail.com' % (
-                app_identity.get_application_id()),     # from
-            self.request.get('email'),                  # to
-            'You created a new Conference!',            # subj
-            'Hi, you have created a following '         # body
-            'conference:\r\n\r\n%s' % self.request.get(
-                'conferenceInfo')
-        )
-
-class SendConfirmationEmailHandlerSession(webapp2.RequestHandler):
+        """Archive the next batch, then chain the one after it."""
+        from google.appengine.datastore.datastore_query import Cursor
+        before = datetime.strptime(self.request.get('before'),
+                                   '%Y-%m-%d').date()
+        self._archive(before, Cursor(urlsafe=self.request.get('cursor')))
+
+    def _archive(self, before, cursor):
+        from archive import archiveFinishedConferences
+        from archive import ARCHIVE_URL
+        before, cursor = archiveFinishedConferences(before, cursor)
+        if cursor:
+            taskqueue.add(params={'before': before.isoformat(),
+                                  'cursor': cursor.urlsafe()},
+                url=ARCHIVE_URL)
+        self.response.set_status(204)
+
+class StartExportHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start an incremental analytics export of every table."""
+        from export import startExport
+        from export import EXPORT_URL
+        for table, run in startExport():
+            taskqueue.add(params={'table': table, 'run': run},
+                url=EXPORT_URL)
+        self.response.set_status(204)
+
     def post(self):
-        """Send email confirming Session creation."""
-        mail.send_mail(
-            'noreply@%s.appspotmail.com' % (
-                app_identity.get_application_id()),     # from
-            self.request.get('email'),                  # to
-            'You created a new Session!',            # subj
-            'Hi, you have created a following '         # body
-            'session:\r\n\r\n%s' % self.request.get(
-                'sessionInfo')
-        )
+        """Export one batch of a table, then chain the next batch."""
+        from export import exportBatch
+        from export import EXPORT_URL
+        table = self.request.get('table')
+        run = self.request.get('run')
+        chunk = int(self.request.get('chunk') or 0)
+        cursor = exportBatch(table, run, self.request.get('cursor'), chunk)
+        if cursor:
+            taskqueue.add(params={'table': table, 'run': run,
+                                  'cursor': cursor, 'chunk': chunk + 1},
+                url=EXPORT_URL)
+        self.response.set_status(204)
+
+class ComputeConferenceStatsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Recompute getConferenceStats from the analytics export."""
+        from analytics import computeStats
+        covered = computeStats()
+        logging.info("Computed stats over %d conferences", covered)
+        self.response.set_status(204)
 
 class SetFeaturedSpeakerHandler(webapp2.RequestHandler):
     def post(self):
         """Set featured speaker list in Memcache"""
         logging.info("Hit features speaker handler")
-        wsck = self.request.get('wsck')
         s_key = self.request.get('s_key')
         #speakers = self.request.get('speakers')
 
-        logging.info("wsck : %s", wsck)
+        logging.info("s_key : %s", s_key)
         #logging.info("speakers : %s", speakers)
 
         
-        ConferenceApi._cacheFeaturedSpeakers(wsck, s_key)
+        ConferenceApi._cacheFeaturedSpeakers(s_key)
         """"Return Response"""
         logging.info('exitied handler')
         self.response.set_status(204)
 
+class UpdateOrganizerNameHandler(webapp2.RequestHandler):
+    def post(self):
+        """Update one batch of an organizer's conferences, then chain."""
+        p_key = self.request.get('p_key')
+        cursor = ConferenceApi._updateOrganizerName(
+            p_key, self.request.get('cursor'))
+        if cursor:
+            taskqueue.add(params={'p_key': p_key, 'cursor': cursor},
+                url='/tasks/update_organizer_name')
+        self.response.set_status(204)
+
+
+class MigrateWishlistsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Start moving legacy profile wishlists into WishList entities."""
+        taskqueue.add(url='/tasks/migrate_wishlists')
+        self.response.set_status(202)
+
+    def post(self):
+        """Migrate one batch of wishlists, then chain the next batch."""
+        cursor = ConferenceApi._migrateWishlists(self.request.get('cursor'))
+        if cursor:
+            taskqueue.add(params={'cursor': cursor},
+                url='/tasks/migrate_wishlists')
+        self.response.set_status(204)
+
+class MapperHandler(webapp2.RequestHandler):
+    def get(self):
+        """Return mapper job status as JSON, for ?job=<id> or recent jobs."""
+        import mapper
+        job_id = self.request.get('job')
+        status = mapper.jobStatus(job_id) if job_id else mapper.recentJobs()
+        if status is None:
+            self.abort(404)
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(status, sort_keys=True))
+
+    def post(self):
+        """Start a registered mapper (?mapper=<name>&shards=&batch_size=&ops=)
+        or stop a running job (?abort=<job id>)."""
+        import migrations  # registers the mappers
+        import mapper
+        if self.request.get('abort'):
+            if not mapper.abortJob(self.request.get('abort')):
+                self.abort(404)
+            self.response.set_status(204)
+            return
+        name = self.request.get('mapper')
+        if name not in mapper.MAPPERS:
+            self.abort(400, detail='Unknown mapper: %s' % name)
+        job_id = mapper.startJob(
+            name,
+            shards=int(self.request.get('shards') or mapper.DEFAULT_SHARDS),
+            batch_size=int(self.request.get('batch_size') or
+                           mapper.DEFAULT_BATCH_SIZE),
+            ops_per_second=int(self.request.get('ops') or
+                               mapper.DEFAULT_OPS_PER_SECOND))
+        self.response.set_status(202)
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps({'job': job_id}))
+
+
+class MapperBatchHandler(webapp2.RequestHandler):
+    def post(self):
+        """Run one batch of a mapper shard; it chains the next batch."""
+        import migrations  # registers the mappers
+        from mapper import runBatch
+        runBatch(self.request.get('job'), int(self.request.get('shard')),
+                 int(self.request.get('batch')))
+        self.response.set_status(204)
+
+class EndpointStatsHandler(webapp2.RequestHandler):
+    def get(self):
+        """Return per-endpoint call stats as JSON, optionally ?minutes=N."""
+        minutes = int(self.request.get('minutes') or 60)
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps(recentStats(minutes), sort_keys=True))
+
+
+class LoadSheddingHandler(webapp2.RequestHandler):
+    def get(self):
+        """Return this instance's shed level and datastore latency as JSON."""
+        import admission
+        from instrumentation import datastoreLatencyMs
+        self.response.headers['Content-Type'] = 'application/json'
+        self.response.write(json.dumps({
+            'level': admission.shedLevel(),
+            'forced': admission.forcedShedLevel(),
+            'datastoreLatencyMs': round(datastoreLatencyMs(), 1),
+        }, sort_keys=True))
+
+    def post(self):
+        """Force a shed level on every instance (?level=N, 0 to stop)."""
+        import admission
+        admission.setShedLevel(int(self.request.get('level') or 0))
+        self.response.set_status(204)
+
 
 app = webapp2.WSGIApplication([
+    ('/_ah/warmup', WarmupHandler),
     ('/crons/set_announcement', SetAnnouncementHandler),
-    ('/tasks/send_confirmation_email_conference', SendConfirmationEmailHandlerConference),
-    ('/tasks/send_confirmation_email_session', SendConfirmationEmailHandlerSession),
-    ('/tasks/featured_speaker_check',SetFeaturedSpeakerHandler )
+    ('/crons/build_recommendations', BuildRecommendationsHandler),
+    ('/crons/materialize_trending', MaterializeTrendingHandler),
+    ('/crons/send_mail_digests', SendMailDigestsHandler),
+    ('/crons/archive_conferences', ArchiveConferencesHandler),
+    ('/crons/export', StartExportHandler),
+    ('/crons/conference_stats', ComputeConferenceStatsHandler),
+    ('/tasks/export', StartExportHandler),
+    ('/tasks/archive_conferences', ArchiveConferencesHandler),
+    ('/tasks/featured_speaker_check',SetFeaturedSpeakerHandler ),
+    ('/tasks/migrate_wishlists', MigrateWishlistsHandler),
+    ('/tasks/update_organizer_name', UpdateOrganizerNameHandler),
+    ('/tasks/mapper', MapperBatchHandler),
+    ('/admin/stats', EndpointStatsHandler),
+    ('/admin/mapper', MapperHandler),
+    ('/admin/load_shedding', LoadSheddingHandler),
 ], debug=True)
+app = instrument(app)
@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+
+"""
+mapper.py -- Udacity conference server-side Python App Engine
+    sharded, resumable mapper for backfills and recounts: splits a kind
+    into key ranges, walks each range in throttled task chains with
+    cursors, rewrites each entity group of a batch in a transaction, and
+    checkpoints every batch
+
+"""
+
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+from models import MapperJob
+from models import MapperShard
+
+MAPPER_QUEUE = 'mapper'
+MAPPER_URL = '/tasks/mapper'
+DEFAULT_SHARDS = 8
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_OPS_PER_SECOND = 200
+# __scatter__ keys sampled per shard when picking split points
+OVERSAMPLE = 32
+
+RUNNING = 'running'
+DONE = 'done'
+ABORTED = 'aborted'
+
+# mapper name -> (kind, function)
+MAPPERS = {}
+
+
+def registerMapper(kind, name=None):
+    """Decorator registering fn(entity) as a mapper over kind.  fn returns
+    None to leave the entity alone, or an entity (or list of entities) to
+    put.  fn runs in a transaction over the entity's group, with the
+    entity as it is now, and may run more than once: on transaction
+    retries, and if its task is retried before the checkpoint.  Mappers
+    must therefore be idempotent."""
+    def decorator(fn):
+        MAPPERS[name or fn.__name__] = (kind, fn)
+        return fn
+    return decorator
+
+
+def _shardKey(job_id, number):
+    return ndb.Key(MapperShard, '%s|%d' % (job_id, number))
+
+
+def _batchTask(job_id, number, batch, countdown=0):
+    """Task running batch number batch of one shard; named, so a retried
+    chaining step can't fork the chain."""
+    return taskqueue.Task(
+        url=MAPPER_URL, countdown=countdown,
+        name='%s-%d-%d' % (job_id, number, batch),
+        params={'job': job_id, 'shard': number, 'batch': batch})
+
+
+def splitKeyRange(kind, shards):
+    """Pick up to shards - 1 split keys for kind from the datastore's
+    __scatter__ sample of its keys.
+    Returns: list of (start key or None, end key or None) ranges"""
+    splits = []
+    if shards > 1:
+        sample = ndb.Query(kind=kind).order(
+            ndb.GenericProperty('__scatter__')).fetch(
+            shards * OVERSAMPLE, keys_only=True)
+        sample.sort(key=lambda key: key.pairs())
+        for i in range(1, shards):
+            if sample:
+                split = sample[len(sample) * i // shards]
+                if split not in splits:
+                    splits.append(split)
+    bounds = [None] + splits + [None]
+    return zip(bounds[:-1], bounds[1:])
+
+
+def startJob(name, shards=DEFAULT_SHARDS, batch_size=DEFAULT_BATCH_SIZE,
+             ops_per_second=DEFAULT_OPS_PER_SECOND):
+    """Create a job for the registered mapper name and start one task
+    chain per key range.
+    Returns: the job id"""
+    kind, _ = MAPPERS[name]
+    ranges = splitKeyRange(kind, shards)
+    job_id = '%s-%s' % (name, datetime.utcnow().strftime('%Y%m%d%H%M%S'))
+    job = MapperJob(id=job_id, mapper=name, kind=kind, shards=len(ranges),
+                    batchSize=batch_size, opsPerSecond=ops_per_second,
+                    status=RUNNING)
+    shard_entities = [MapperShard(key=_shardKey(job_id, number),
+                                  start=start, end=end)
+                      for number, (start, end) in enumerate(ranges, 1)]
+    ndb.put_multi([job] + shard_entities)
+    taskqueue.Queue(MAPPER_QUEUE).add(
+        [_batchTask(job_id, number, 0) for number in
+         range(1, len(ranges) + 1)])
+    logging.info("Started mapper job %s over %d key ranges",
+                 job_id, len(ranges))
+    return job_id
+
+
+def _shardQuery(job, shard):
+    """Query the shard's key range of the job's kind in key order."""
+    model = ndb.Model._kind_map[job.kind]
+    q = model.query()
+    if shard.start:
+        q = q.filter(model._key >= shard.start)
+    if shard.end:
+        q = q.filter(model._key < shard.end)
+    return q.order(model._key)
+
+
+def _mapGroup(fn, keys):
+    """Map the entities of keys, which share an entity group, and put what
+    fn returns in one transaction, so a write committed since the batch
+    query is mapped too instead of being overwritten.
+    Returns: number of entities put"""
+    def txn():
+        puts = []
+        for entity in ndb.get_multi(keys):
+            if entity is None:
+                # deleted since the query
+                continue
+            result = fn(entity)
+            if isinstance(result, list):
+                puts.extend(result)
+            elif result is not None:
+                puts.append(result)
+        if puts:
+            ndb.put_multi(puts)
+        return len(puts)
+    # xg, for mappers that also write entities outside the group
+    return ndb.transaction(txn, xg=True)
+
+
+def runBatch(job_id, number, batch):
+    """Map and put the next batch of one shard, checkpoint it, and chain
+    the next batch so the shard stays under its share of opsPerSecond.
+    Returns: True if another batch was chained"""
+    job, shard = ndb.get_multi([ndb.Key(MapperJob, job_id),
+                                _shardKey(job_id, number)])
+    if not job or job.status != RUNNING or not shard or shard.done:
+        return False
+    if shard.batches != batch:
+        # duplicate delivery of a batch that was already checkpointed
+        logging.info("Skipping stale batch %d of %s shard %d",
+                     batch, job_id, number)
+        return False
+
+    started = time.time()
+    _, fn = MAPPERS[job.mapper]
+    cursor = Cursor(urlsafe=shard.cursor) if shard.cursor else None
+    keys, next_cursor, more = _shardQuery(job, shard).fetch_page(
+        job.batchSize, start_cursor=cursor, keys_only=True)
+    groups = OrderedDict()
+    for key in keys:
+        groups.setdefault(key.pairs()[0], []).append(key)
+    written = sum(_mapGroup(fn, group_keys) for group_keys in groups.values())
+    done = not (more and next_cursor)
+
+    @ndb.transactional()
+    def checkpoint():
+        current = shard.key.get()
+        if current.batches != batch:
+            return False
+        current.cursor = next_cursor.urlsafe() if next_cursor else None
+        current.batches += 1
+        current.processed += len(keys)
+        current.written += written
+        current.done = done
+        current.put()
+        return True
+
+    if not checkpoint():
+        return False
+    if done:
+        _finishJob(job)
+        return False
+
+    # each shard gets an equal share of the job's ops/sec budget
+    ops = len(keys) + written
+    rate = float(job.opsPerSecond) / job.shards
+    countdown = max(0.0, ops / rate - (time.time() - started))
+    try:
+        taskqueue.Queue(MAPPER_QUEUE).add(
+            _batchTask(job_id, number, batch + 1, countdown))
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        pass
+    return True
+
+
+def _finishJob(job):
+    """Mark the job done once every shard has checkpointed its last batch."""
+    shards = ndb.get_multi([_shardKey(job.key.id(), number)
+                            for number in range(1, job.shards + 1)])
+    if not all(shard.done for shard in shards):
+        return
+
+    @ndb.transactional()
+    def txn():
+        current = job.key.get()
+        if current.status == RUNNING:
+            current.status = DONE
+            current.finished = datetime.utcnow()
+            current.put()
+    txn()
+    logging.info("Mapper job %s finished", job.key.id())
+
+
+def abortJob(job_id):
+    """Stop a running job; its shards stop at their next batch."""
+    @ndb.transactional()
+    def txn():
+        job = ndb.Key(MapperJob, job_id).get()
+        if job and job.status == RUNNING:
+            job.status = ABORTED
+            job.finished = datetime.utcnow()
+            job.put()
+        return job
+    return txn() is not None
+
+
+def jobStatus(job_id):
+    """Return the progress of a job and its shards as a dict, or None."""
+    job = ndb.Key(MapperJob, job_id).get()
+    if not job:
+        return None
+    shards = ndb.get_multi([_shardKey(job_id, number)
+                            for number in range(1, job.shards + 1)])
+    processed = sum(shard.processed for shard in shards)
+    written = sum(shard.written for shard in shards)
+    elapsed = ((job.finished or datetime.utcnow()) -
+               job.started).total_seconds()
+    return {
+        'job': job_id,
+        'mapper': job.mapper,
+        'kind': job.kind,
+        'status': job.status,
+        'started': job.started.isoformat(),
+        'finished': job.finished.isoformat() if job.finished else None,
+        'processed': processed,
+        'written': written,
+        'opsPerSecond': round((processed + written) / max(elapsed, 1.0), 1),
+        'opsPerSecondLimit': job.opsPerSecond,
+        'shards': [{'shard': number, 'batches': shard.batches,
+                    'processed': shard.processed, 'written': shard.written,
+                    'done': shard.done}
+                   for number, shard in enumerate(shards, 1)],
+    }
+
+
+def recentJobs(limit=20):
+    """Return the status of the most recently started jobs."""
+    keys = MapperJob.query().order(-MapperJob.started).fetch(
+        limit, keys_only=True)
+    return [jobStatus(key.id()) for key in keys]
@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+
+"""
+migrations.py -- Udacity conference server-side Python App Engine
+    data migrations, recounts and archival, run with the mapper from
+    /admin/mapper
+
+"""
+
+from archive import fillArchiveFields
+from mapper import registerMapper
+
+
+@registerMapper('Conference')
+def fixConferenceMonth(conf):
+    """Recompute month from startDate, as createConference does."""
+    month = conf.startDate.month if conf.startDate else 0
+    if conf.month != month:
+        conf.month = month
+        return conf
+
+
+def _rewrite(entity):
+    """Put the entity unchanged so its index rows follow the model's
+    current indexed/unindexed properties."""
+    return entity
+
+registerMapper('Conference', 'reindexConferences')(_rewrite)
+registerMapper('Session', 'reindexSessions')(_rewrite)
+registerMapper('Profile', 'reindexProfiles')(_rewrite)
+
+
+@registerMapper('PopularityShard')
+def markPopularityDirty(shard):
+    """Flag a counter shard for the trending job to sum; run once so the
+    shards counted before PopularityTotals were kept get one."""
+    if not shard.dirty:
+        shard.dirty = True
+        return shard
+
+# run once so the archives made before the filterable fields were copied
+# out are found by queryArchived
+registerMapper('ConferenceArchive', 'fillArchiveFields')(fillArchiveFields)
@@ -15,19 +15,79 @@ __author__ = 'wesc+api@google.com (Wesley Chun)'
 import httplib
 import endpoints
 from protorpc import messages, message_types
+from google.appengine.api import memcache
 from google.appengine.ext import ndb
 
+MEMCACHE_VERSION_KEY = "VERSION_%s"
+MEMCACHE_SESSIONS_GENERATION_KEY = "SESSIONS_GEN_%s"
+VERSION_TTL = 24 * 60 * 60
+# called with the key of each committed VersionedModel put, e.g. to drop
+# this instance's cached copy of the entity
+VERSION_LISTENERS = []
+
 class ConflictException(endpoints.ServiceException):
     """ConflictException -- exception mapped to HTTP 409 response"""
     http_status = httplib.CONFLICT
 
-class Profile(ndb.Model):
+# Python 2.7's httplib has no reason phrase for 429, and ServiceException
+# looks its http_status up there
+httplib.responses.setdefault(429, 'Too Many Requests')
+
+class TooManyRequestsException(endpoints.ServiceException):
+    """TooManyRequestsException -- exception mapped to HTTP 429 response"""
+    http_status = 429
+
+class ServiceUnavailableException(endpoints.ServiceException):
+    """ServiceUnavailableException -- exception mapped to HTTP 503 response"""
+    http_status = httplib.SERVICE_UNAVAILABLE
+
+class VersionedModel(ndb.Model):
+    """VersionedModel -- counts its puts in version and publishes each new
+    version to memcache once committed, so a conditional read can check a
+    client's ETag without loading the entity"""
+    version = ndb.IntegerProperty(default=0, indexed=False)
+
+    @staticmethod
+    def versionKey(key):
+        return MEMCACHE_VERSION_KEY % key.urlsafe()
+
+    def _pre_put_hook(self):
+        self.version = (self.version or 0) + 1
+
+    @classmethod
+    def publishVersions(cls, versions):
+        """Publish {key: version} to memcache with one set_multi and tell
+        the VERSION_LISTENERS."""
+        memcache.set_multi(dict((cls.versionKey(key), version)
+                                for key, version in versions.items()),
+                           time=VERSION_TTL)
+        for key in versions:
+            for listener in VERSION_LISTENERS:
+                listener(key)
+
+    def _post_put_hook(self, future):
+        if future.get_exception():
+            return
+        if not ndb.in_transaction():
+            self.publishVersions({self.key: self.version})
+            return
+        # the puts of one transaction are published together on commit
+        ctx = ndb.get_context()
+        pending = getattr(ctx, '_pendingVersions', None)
+        if pending is None:
+            pending = ctx._pendingVersions = {}
+            ctx.call_on_commit(lambda: self.publishVersions(pending))
+        pending[self.key] = self.version
+
+class Profile(VersionedModel):
     """Profile -- User profile object"""
-    displayName = ndb.StringProperty()
-    mainEmail = ndb.StringProperty()
-    teeShirtSize = ndb.StringProperty(default='NOT_SPECIFIED')
-    conferenceKeysToAttend = ndb.StringProperty(repeated=True)
-    sessionWishlistKeys = ndb.StringProperty(repeated=True)
+    displayName = ndb.StringProperty(indexed=False)
+    mainEmail = ndb.StringProperty(indexed=False)
+    teeShirtSize = ndb.StringProperty(default='NOT_SPECIFIED', indexed=False)
+    conferenceKeysToAttend = ndb.StringProperty(repeated=True, indexed=False)
+    # legacy wishlist storage, moved into the WishList child entity
+    sessionWishlistKeys = ndb.StringProperty(repeated=True, indexed=False)
+    updated = ndb.DateTimeProperty(auto_now=True)
 
 class ProfileMiniForm(messages.Message):
     """ProfileMiniForm -- update Profile form message"""
@@ -41,6 +101,8 @@ class ProfileForm(messages.Message):
     teeShirtSize = messages.EnumField('TeeShirtSize', 3)
     conferenceKeysToAttend = messages.StringField(4, repeated=True)
     sessionWishlistKeys =messages.StringField(5,repeated=True)
+    etag = messages.StringField(6)
+    notModified = messages.BooleanField(7)
 
 
 class StringMessage(messages.Message):
@@ -51,18 +113,21 @@ class BooleanMessage(messages.Message):
     """BooleanMessage-- outbound Boolean value message"""
     data = messages.BooleanField(1)
 
-class Conference(ndb.Model):
+class Conference(VersionedModel):
     """Conference -- Conference object"""
     name            = ndb.StringProperty(required=True)
-    description     = ndb.StringProperty()
-    organizerUserId = ndb.StringProperty()
+    description     = ndb.StringProperty(indexed=False)
+    organizerUserId = ndb.StringProperty(indexed=False)
     topics          = ndb.StringProperty(repeated=True)
     city            = ndb.StringProperty()
-    startDate       = ndb.DateProperty()
+    startDate       = ndb.DateProperty(indexed=False)
     month           = ndb.IntegerProperty() # TODO: do we need for indexing like Java?
     endDate         = ndb.DateProperty()
     maxAttendees    = ndb.IntegerProperty()
     seatsAvailable  = ndb.IntegerProperty()
+    # copy of the organizer Profile.displayName, kept current on rename
+    organizerDisplayName = ndb.StringProperty(indexed=False)
+    updated         = ndb.DateTimeProperty(auto_now=True)
 
 class ConferenceForm(messages.Message):
     """ConferenceForm -- Conference outbound form message"""
@@ -78,11 +143,62 @@ class ConferenceForm(messages.Message):
     endDate         = messages.StringField(10) #DateTimeField()
     websafeKey      = messages.StringField(11)
     organizerDisplayName = messages.StringField(12)
+    etag            = messages.StringField(13)
+    notModified     = messages.BooleanField(14)
 
 class ConferenceForms(messages.Message):
     """ConferenceForms -- multiple Conference outbound form message"""
     items = messages.MessageField(ConferenceForm, 1, repeated=True)
 
+class ConferenceResultForm(messages.Message):
+    """ConferenceResultForm -- one requested key of a batch get; conference
+    is only set when found"""
+    websafeKey      = messages.StringField(1)
+    found           = messages.BooleanField(2)
+    conference      = messages.MessageField(ConferenceForm, 3)
+
+class ConferenceResultForms(messages.Message):
+    """ConferenceResultForms -- batch get results, in request order"""
+    items = messages.MessageField(ConferenceResultForm, 1, repeated=True)
+
+class StatsGroupForm(messages.Message):
+    """StatsGroupForm -- attendance of the conferences in one city, topic or
+    month"""
+    group           = messages.StringField(1)
+    conferences     = messages.IntegerField(2)
+    seats           = messages.IntegerField(3)
+    registered      = messages.IntegerField(4)
+    fillRate        = messages.FloatField(5)
+    fillRateP50     = messages.FloatField(6)
+    fillRateP90     = messages.FloatField(7)
+
+class StatsPointForm(messages.Message):
+    """StatsPointForm -- one day of a daily series"""
+    date            = messages.StringField(1)
+    value           = messages.IntegerField(2)
+
+class ConferenceStatsForm(messages.Message):
+    """ConferenceStatsForm -- fill rates, registrations per day and, for one
+    conference, its seat burn-down"""
+    computed        = messages.StringField(1)
+    byCity          = messages.MessageField(StatsGroupForm, 2, repeated=True)
+    byTopic         = messages.MessageField(StatsGroupForm, 3, repeated=True)
+    byMonth         = messages.MessageField(StatsGroupForm, 4, repeated=True)
+    registrationsPerDay = messages.MessageField(StatsPointForm, 5, repeated=True)
+    burnDown        = messages.MessageField(StatsPointForm, 6, repeated=True)
+
+class SyncForm(messages.Message):
+    """SyncForm -- conferences, sessions and registrations changed since a
+    sync token; call again with nextToken while more is set"""
+    conferences     = messages.MessageField(ConferenceForm, 1, repeated=True)
+    sessions        = messages.MessageField('SessionForm', 2, repeated=True)
+    removedConferenceKeys = messages.StringField(3, repeated=True)
+    removedSessionKeys = messages.StringField(4, repeated=True)
+    registrationsChanged = messages.BooleanField(5)
+    registrations   = messages.StringField(6, repeated=True)
+    nextToken       = messages.StringField(7)
+    more            = messages.BooleanField(8)
+
 class TeeShirtSize(messages.Enum):
     """TeeShirtSize -- t-shirt size enumeration value"""
     NOT_SPECIFIED = 1
@@ -110,6 +226,8 @@ class ConferenceQueryForm(messages.Message):
 class ConferenceQueryForms(messages.Message):
     """ConferenceQueryForms -- multiple ConferenceQueryForm inbound form message"""
     filters = messages.MessageField(ConferenceQueryForm, 1, repeated=True)
+    includeArchived = messages.BooleanField(2)
+    fields = messages.StringField(3, repeated=True)
 
 
 ###################
@@ -117,19 +235,30 @@ class ConferenceQueryForms(messages.Message):
 ###################
 
 
-class Session(ndb.Model):
+class Session(VersionedModel):
     """Session -- Session object"""
-    name            = ndb.StringProperty(required=True)
-    highlights     = ndb.StringProperty()
-    location        = ndb.StringProperty()
+    name            = ndb.StringProperty(required=True, indexed=False)
+    highlights     = ndb.StringProperty(indexed=False)
+    location        = ndb.StringProperty(indexed=False)
     typeofSession   = ndb.StringProperty(repeated=True)
     speakers         = ndb.StringProperty(repeated=True)
-    startDate       = ndb.DateProperty()
+    startDate       = ndb.DateProperty(indexed=False)
     startTime       = ndb.TimeProperty()
-    endTime         = ndb.TimeProperty()
-    endDate         = ndb.DateProperty()
-    maxAttendees    = ndb.IntegerProperty()
-    seatsAvailable  = ndb.IntegerProperty()
+    endTime         = ndb.TimeProperty(indexed=False)
+    endDate         = ndb.DateProperty(indexed=False)
+    maxAttendees    = ndb.IntegerProperty(indexed=False)
+    seatsAvailable  = ndb.IntegerProperty(indexed=False)
+    updated         = ndb.DateTimeProperty(auto_now=True)
+
+    def _post_put_hook(self, future):
+        super(Session, self)._post_put_hook(future)
+        if future.get_exception():
+            return
+        # invalidates the ETag of the conference's session list
+        conf_key = self.key.parent()
+        ndb.get_context().call_on_commit(
+            lambda: memcache.incr(
+                MEMCACHE_SESSIONS_GENERATION_KEY % conf_key.urlsafe()))
 
 
 
@@ -146,6 +275,7 @@ class SessionForm(messages.Message):
     endDate         = messages.StringField(9)
     maxAttendees    = messages.IntegerField(10)
     seatsAvailable  = messages.IntegerField(11)
+    websafeKey      = messages.StringField(12)
 
  
 
@@ -154,16 +284,127 @@ class SessionForm(messages.Message):
 class SessionForms(messages.Message):
     """ SessionForms - Session query for multiple sessions """
     items = messages.MessageField(SessionForm, 1, repeated=True)
-
-
-
-
-class WishList(ndb.Model):
-    """Wishlist - Wislist object stores conferences and sessions a user wants to attend"""
-    conferences     = ndb.KeyProperty(repeated=True, kind = Conference)
-    sessions        = ndb.KeyProperty(repeated=True, kind=Session)
-    
-
-
-
-
+    etag = messages.StringField(2)
+    notModified = messages.BooleanField(3)
+
+class ConferenceDetailForm(messages.Message):
+    """ConferenceDetailForm -- a conference with its session schedule and,
+    when signed in, the caller's registration and wishlisted sessions"""
+    conference      = messages.MessageField(ConferenceForm, 1)
+    sessions        = messages.MessageField(SessionForm, 2, repeated=True)
+    signedIn        = messages.BooleanField(3)
+    registered      = messages.BooleanField(4)
+    wishlistSessionKeys = messages.StringField(5, repeated=True)
+
+
+
+
+class WishList(VersionedModel):
+    """WishList -- sessions a user wants to attend; a single unindexed child
+    entity of the user's Profile so each change is one small write"""
+    sessions        = ndb.KeyProperty(repeated=True, kind=Session, indexed=False)
+
+
+class SessionRecommendation(ndb.Model):
+    """SessionRecommendation -- sessions most often wishlisted together with
+    the session whose websafe key is this entity's id; rebuilt in batch"""
+    sessions        = ndb.KeyProperty(repeated=True, kind=Session, indexed=False)
+    counts          = ndb.IntegerProperty(repeated=True, indexed=False)
+    updated         = ndb.DateTimeProperty(auto_now=True)
+
+
+class PopularityShard(ndb.Model):
+    """PopularityShard -- one shard of the wishlist/registration counters
+    of a Session or Conference; dirty until the trending cron job has
+    summed it into the target's PopularityTotal"""
+    target          = ndb.KeyProperty(indexed=False)
+    wishlists       = ndb.IntegerProperty(default=0, indexed=False)
+    registrations   = ndb.IntegerProperty(default=0, indexed=False)
+    dirty           = ndb.BooleanProperty(default=False)
+
+
+class PopularityTotal(ndb.Model):
+    """PopularityTotal -- the summed counter shards of a Session or
+    Conference, kept by the trending cron job; id is the target's websafe
+    key and conference the session's parent"""
+    target          = ndb.KeyProperty(indexed=False)
+    conference      = ndb.KeyProperty()
+    wishlists       = ndb.IntegerProperty(default=0)
+    registrations   = ndb.IntegerProperty(default=0)
+
+
+class EndpointStats(ndb.Model):
+    """EndpointStats -- per-method call counters one instance aggregated
+    over one flush interval"""
+    instance        = ndb.StringProperty(indexed=False)
+    started         = ndb.DateTimeProperty(indexed=False)
+    flushed         = ndb.DateTimeProperty(auto_now_add=True)
+    stats           = ndb.JsonProperty(compressed=True)
+
+
+class Trending(ndb.Model):
+    """Trending -- materialized top sessions or conferences; id is 'sessions',
+    'conferences' or the websafe key of a conference"""
+    items           = ndb.KeyProperty(repeated=True, indexed=False)
+    counts          = ndb.IntegerProperty(repeated=True, indexed=False)
+
+
+class MapperJob(ndb.Model):
+    """MapperJob -- one run of a registered mapper over every entity of a
+    kind; id is the mapper name plus the start time"""
+    mapper          = ndb.StringProperty(indexed=False)
+    kind            = ndb.StringProperty(indexed=False)
+    shards          = ndb.IntegerProperty(indexed=False)
+    batchSize       = ndb.IntegerProperty(indexed=False)
+    opsPerSecond    = ndb.IntegerProperty(indexed=False)
+    status          = ndb.StringProperty(indexed=False)
+    started         = ndb.DateTimeProperty(auto_now_add=True)
+    finished        = ndb.DateTimeProperty(indexed=False)
+
+
+class MapperShard(ndb.Model):
+    """MapperShard -- key range and checkpoint of one shard of a MapperJob;
+    a root entity (id 'job id|shard number') so shards never contend"""
+    start           = ndb.KeyProperty(indexed=False)
+    end             = ndb.KeyProperty(indexed=False)
+    cursor          = ndb.StringProperty(indexed=False)
+    batches         = ndb.IntegerProperty(default=0, indexed=False)
+    processed       = ndb.IntegerProperty(default=0, indexed=False)
+    written         = ndb.IntegerProperty(default=0, indexed=False)
+    done            = ndb.BooleanProperty(default=False, indexed=False)
+    updated         = ndb.DateTimeProperty(auto_now=True, indexed=False)
+
+
+class ConferenceArchive(ndb.Model):
+    """ConferenceArchive -- compressed, unindexed snapshot of a finished
+    Conference and its sessions; same parent and id as the conference key.
+    The conference's filterable fields are copied out to be queried"""
+    conference      = ndb.LocalStructuredProperty(Conference, compressed=True)
+    sessions        = ndb.LocalStructuredProperty(Session, repeated=True,
+                                                  compressed=True)
+    sessionKeys     = ndb.KeyProperty(repeated=True, kind=Session, indexed=False)
+    city            = ndb.StringProperty()
+    topics          = ndb.StringProperty(repeated=True)
+    month           = ndb.IntegerProperty()
+    maxAttendees    = ndb.IntegerProperty()
+    startDate       = ndb.DateProperty()
+    archived        = ndb.DateTimeProperty(auto_now_add=True)
+
+
+class ExportWatermark(ndb.Model):
+    """ExportWatermark -- incremental export state of one table; id is the
+    table name"""
+    watermark       = ndb.DateTimeProperty(indexed=False)
+    run             = ndb.StringProperty(indexed=False)
+    runStarted      = ndb.DateTimeProperty(indexed=False)
+
+
+class ConferenceStats(ndb.Model):
+    """ConferenceStats -- attendance tables computed from the analytics
+    export; memcache holds the same, plus per-conference burn-down curves.
+    state is the export file of the running aggregates the tables come
+    from, and folded the newest export run of each table in it"""
+    stats           = ndb.JsonProperty(compressed=True)
+    state           = ndb.StringProperty(indexed=False)
+    folded          = ndb.JsonProperty()
+    computed        = ndb.DateTimeProperty(auto_now=True, indexed=False)
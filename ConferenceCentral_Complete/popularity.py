@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+
+"""
+popularity.py -- Udacity conference server-side Python App Engine
+    sharded wishlist/registration counters, their totals, and the
+    trending lists materialized from them
+
+"""
+
+import heapq
+import random
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from models import PopularityShard
+from models import PopularityTotal
+from models import Trending
+
+NUM_SHARDS = 20
+TRENDING_SIZE = 10
+BATCH_SIZE = 500
+TRENDING_SESSIONS_ID = 'sessions'
+TRENDING_CONFERENCES_ID = 'conferences'
+MEMCACHE_TRENDING_KEY = "TRENDING_%s"
+
+
+def incrementCounter(target, field, delta=1):
+    """Add delta to the 'wishlists' or 'registrations' count of a Session or
+    Conference key, on one randomly chosen shard.  The shard is its own
+    entity group, so call this after the user's transaction has committed.
+    Returns: future for the shard transaction"""
+    shard_key = random.choice(_shardKeys(target))
+
+    @ndb.tasklet
+    def txn():
+        shard = yield shard_key.get_async()
+        if not shard:
+            shard = PopularityShard(key=shard_key, target=target)
+        setattr(shard, field, getattr(shard, field) + delta)
+        # the trending job re-sums only the targets of dirty shards
+        shard.dirty = True
+        yield shard.put_async()
+
+    return ndb.transaction_async(txn)
+
+
+def _shardKeys(target):
+    """Return the keys of every counter shard of target."""
+    return [ndb.Key(PopularityShard, '%s|%d' % (target.urlsafe(), number))
+            for number in range(NUM_SHARDS)]
+
+
+def _clearDirty(shard):
+    """Clear the dirty flag of shard, as read when it was summed, unless it
+    has been counted again since.
+    Returns: future for the transaction"""
+    @ndb.tasklet
+    def txn():
+        current = yield shard.key.get_async()
+        if (current and current.dirty and
+                current.wishlists == shard.wishlists and
+                current.registrations == shard.registrations):
+            current.dirty = False
+            yield current.put_async()
+
+    return ndb.transaction_async(txn)
+
+
+def getTrending(trending_id):
+    """Return the materialized trending keys for trending_id from memcache,
+    falling back to the stored Trending entity."""
+    memcache_key = MEMCACHE_TRENDING_KEY % trending_id
+    keys = memcache.get(memcache_key)
+    if keys is None:
+        trending = ndb.Key(Trending, trending_id).get()
+        keys = trending.items if trending else []
+        memcache.set(memcache_key, keys)
+    return keys
+
+
+def sumDirtyCounters():
+    """Re-sum the shards of every target with a dirty shard into its
+    PopularityTotal, then clear the flags of the shards summed.
+    Returns: the PopularityTotals written"""
+    targets = set()
+    for shard in PopularityShard.query(PopularityShard.dirty == True).iter(
+            batch_size=BATCH_SIZE):
+        targets.add(shard.target)
+
+    totals = []
+    targets = list(targets)
+    for start in range(0, len(targets), BATCH_SIZE // NUM_SHARDS):
+        batch = targets[start:start + BATCH_SIZE // NUM_SHARDS]
+        shards = ndb.get_multi([key for target in batch
+                                for key in _shardKeys(target)])
+        batch_totals = []
+        for number, target in enumerate(batch):
+            mine = [shard for shard in
+                    shards[number * NUM_SHARDS:(number + 1) * NUM_SHARDS]
+                    if shard]
+            total = PopularityTotal(
+                id=target.urlsafe(),
+                target=target,
+                wishlists=sum(shard.wishlists for shard in mine),
+                registrations=sum(shard.registrations for shard in mine),
+            )
+            if target.kind() == 'Session':
+                total.conference = target.parent()
+            batch_totals.append(total)
+        # shards whose flag isn't cleared, because the run fails after the
+        # put or a new count collides with the clearing transaction, are
+        # simply summed again on the next run
+        ndb.put_multi(batch_totals)
+        ndb.Future.wait_all([_clearDirty(shard) for shard in shards
+                             if shard and shard.dirty])
+        totals.extend(batch_totals)
+    return totals
+
+
+def _topCounts(stored, fresh, field):
+    """Return the top TRENDING_SIZE (count, key) pairs of field among the
+    stored PopularityTotals, which a query may return stale, and the fresh
+    ones just written, which take precedence."""
+    counts = dict((total.target, getattr(total, field)) for total in stored)
+    counts.update((total.target, getattr(total, field)) for total in fresh)
+    return heapq.nlargest(TRENDING_SIZE, [
+        (count, key) for key, count in counts.iteritems() if count > 0])
+
+
+def materializeTrending():
+    """Sum the counters changed since the last run and store the top
+    TRENDING_SIZE sessions per conference and overall, plus the most
+    registered conferences, in the datastore and memcache.  Only the
+    lists a changed counter belongs to are rebuilt.
+    Returns: number of trending lists written"""
+    fresh = sumDirtyCounters()
+    sessions = [total for total in fresh if total.conference]
+    conferences = [total for total in fresh if not total.conference]
+
+    lists = {}
+    if sessions:
+        # enough of the top to fill the list if every fresh one fell out
+        stored = PopularityTotal.query(PopularityTotal.wishlists > 0).order(
+            -PopularityTotal.wishlists).fetch(TRENDING_SIZE + len(sessions))
+        lists[TRENDING_SESSIONS_ID] = _topCounts(stored, sessions,
+                                                 'wishlists')
+    if conferences:
+        stored = PopularityTotal.query(
+            PopularityTotal.registrations > 0).order(
+            -PopularityTotal.registrations).fetch(
+            TRENDING_SIZE + len(conferences))
+        lists[TRENDING_CONFERENCES_ID] = _topCounts(stored, conferences,
+                                                    'registrations')
+    per_conference = {}
+    for total in sessions:
+        per_conference.setdefault(total.conference, []).append(total)
+    for c_key, changed in per_conference.iteritems():
+        stored = PopularityTotal.query(
+            PopularityTotal.conference == c_key).fetch()
+        lists[c_key.urlsafe()] = _topCounts(stored, changed, 'wishlists')
+
+    entities = []
+    cached = {}
+    for trending_id, top in lists.iteritems():
+        entities.append(Trending(
+            id=trending_id,
+            items=[key for count, key in top],
+            counts=[count for count, key in top],
+        ))
+        cached[MEMCACHE_TRENDING_KEY % trending_id] = entities[-1].items
+        if len(entities) >= BATCH_SIZE:
+            ndb.put_multi(entities)
+            entities = []
+    ndb.put_multi(entities)
+    memcache.set_multi(cached)
+    return len(lists)
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+
+"""
+recommendations.py -- Udacity conference server-side Python App Engine
+    batch job computing "people who saved this also saved" session
+    recommendations from user wishlists
+
+"""
+
+from array import array
+from datetime import datetime
+
+import numpy as np
+
+from google.appengine.ext import ndb
+
+from models import SessionRecommendation
+from models import WishList
+
+RECOMMENDATIONS_PER_SESSION = 10
+MAX_WISHLIST_ITEMS = 200
+BATCH_SIZE = 500
+
+
+def topCooccurrences(users, items, k):
+    """Return (item, other, count) arrays with the top k co-occurring items
+    for every item, given parallel arrays of (user, item) pairs.
+
+    This is the sparse product A'A of the user-by-item matrix A, computed by
+    expanding every user's items into pairs and counting identical pairs.
+    Rows are ordered by item, then by descending count.
+    """
+    users = np.asarray(users, dtype=np.int64)
+    items = np.asarray(items, dtype=np.int64)
+    empty = np.zeros(0, dtype=np.int64)
+    if not len(items):
+        return empty, empty, empty
+
+    # group entries by user
+    order = np.argsort(users, kind='mergesort')
+    users = users[order]
+    items = items[order]
+    n = len(items)
+    starts = np.flatnonzero(np.r_[True, users[1:] != users[:-1]])
+    sizes = np.diff(np.r_[starts, n])
+
+    # pair every entry with every entry of the same user
+    entry_size = np.repeat(sizes, sizes)
+    entry_start = np.repeat(starts, sizes)
+    left = np.repeat(np.arange(n), entry_size)
+    block_start = np.repeat(np.cumsum(entry_size) - entry_size, entry_size)
+    right = (np.repeat(entry_start, entry_size) +
+             np.arange(len(left)) - block_start)
+    a = items[left]
+    b = items[right]
+    keep = a != b
+    a = a[keep]
+    b = b[keep]
+    if not len(a):
+        return empty, empty, empty
+
+    # count identical (a, b) pairs
+    n_items = items.max() + 1
+    codes = np.sort(a * n_items + b)
+    edges = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+    counts = np.diff(np.r_[edges, len(codes)])
+    codes = codes[edges]
+    a = codes // n_items
+    b = codes % n_items
+
+    # rank each item's partners by count and keep the first k
+    order = np.lexsort((b, -counts, a))
+    a = a[order]
+    b = b[order]
+    counts = counts[order]
+    first = np.flatnonzero(np.r_[True, a[1:] != a[:-1]])
+    rank = np.arange(len(a)) - np.repeat(first, np.diff(np.r_[first, len(a)]))
+    keep = rank < k
+    return a[keep], b[keep], counts[keep]
+
+
+def buildRecommendations():
+    """Stream all wishlists, compute session co-occurrences and store the
+    top RECOMMENDATIONS_PER_SESSION partners of every session.
+    Returns: number of SessionRecommendation entities written"""
+    started = datetime.utcnow()
+
+    # number sessions as they are seen; (user, session) pairs go into
+    # compact arrays rather than python lists of ints
+    index = {}
+    s_keys = []
+    users = array('l')
+    items = array('l')
+    wishlists = WishList.query().iter(batch_size=BATCH_SIZE)
+    for user, wishlist in enumerate(wishlists):
+        for s_key in wishlist.sessions[:MAX_WISHLIST_ITEMS]:
+            item = index.get(s_key)
+            if item is None:
+                item = index[s_key] = len(s_keys)
+                s_keys.append(s_key)
+            users.append(user)
+            items.append(item)
+
+    a, b, counts = topCooccurrences(users, items, RECOMMENDATIONS_PER_SESSION)
+
+    written = 0
+    recs = []
+    first = np.flatnonzero(np.r_[True, a[1:] != a[:-1]]) if len(a) else []
+    for start, end in zip(first, list(first[1:]) + [len(a)]):
+        recs.append(SessionRecommendation(
+            id=s_keys[a[start]].urlsafe(),
+            sessions=[s_keys[other] for other in b[start:end]],
+            counts=[int(count) for count in counts[start:end]],
+        ))
+        if len(recs) >= BATCH_SIZE:
+            ndb.put_multi(recs)
+            written += len(recs)
+            recs = []
+    ndb.put_multi(recs)
+    written += len(recs)
+
+    # drop recommendations for sessions nobody saves together any more
+    stale = SessionRecommendation.query(
+        SessionRecommendation.updated < started).fetch(keys_only=True)
+    ndb.delete_multi(stale)
+    return written
@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+
+"""
+rpc.py -- Udacity conference server-side Python App Engine
+    the ConferenceApi methods over plain ProtoRPC, for native clients:
+    POST the request message to /rpc/conference.<method> as a binary
+    protocol buffer (or JSON) and the response comes back the same way
+
+"""
+
+from protorpc import protobuf
+from protorpc import protojson
+from protorpc import remote
+from protorpc.wsgi import service
+
+from conference import ConferenceApi
+from instrumentation import instrument
+
+RPC_PATH = '/rpc/conference'
+# the request's Content-Type picks the protocol; the response uses it too
+PROTOBUF_CONTENT_TYPES = ('application/x-protobuf',
+                          'application/x-google-protobuf',
+                          'application/octet-stream')
+
+PROTOCOLS = remote.Protocols()
+PROTOCOLS.add_protocol(protobuf, 'protobuf',
+                       default_content_type=PROTOBUF_CONTENT_TYPES[0],
+                       alternative_content_types=PROTOBUF_CONTENT_TYPES[1:])
+PROTOCOLS.add_protocol(protojson.ProtoJson.get_default(), 'protojson')
+
+app = instrument(service.service_mapping(ConferenceApi, RPC_PATH,
+                                         protocols=PROTOCOLS))
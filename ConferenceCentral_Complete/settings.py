@@ -16,3 +16,21 @@ WEB_CLIENT_ID = 'replace with Web client ID'
 ANDROID_CLIENT_ID = 'replace with Android client ID'
 IOS_CLIENT_ID = 'replace with iOS client ID'
 ANDROID_AUDIENCE = WEB_CLIENT_ID
+
+# Send mail digests through a local SMTP server instead of the Mail API,
+# e.g. `python -m smtpd -n -c DebuggingServer localhost:1025`
+MAIL_SMTP_HOST = None
+MAIL_SMTP_PORT = 1025
+
+# Write analytics exports under this local directory instead of Cloud
+# Storage; EXPORT_BUCKET None means the app's default bucket
+EXPORT_LOCAL_DIR = None
+EXPORT_BUCKET = None
+
+# Admission control: (burst, tokens per second) overrides per endpoint
+# method name, or '*' for the bucket each user shares across endpoints,
+# e.g. {'queryConferences': (10, 0.5)}
+RATE_LIMITS = {}
+# Datastore latency (ms) above which expensive calls, then all but
+# critical calls, are shed
+SHED_LATENCY_MS = (250, 1000)
@@ -84,7 +84,7 @@ app.constant('HTTP_ERRORS', {
  * Service that holds the OAuth2 information shared across all the pages.
  *
  */
-app.factory('oauth2Provider', function ($modal) {
+app.factory('oauth2Provider', function ($modal, conferenceApi) {
     var oauth2Provider = {
         CLIENT_ID: 'web-client-id',
         SCOPES: 'email profile',
@@ -101,7 +101,11 @@ app.factory('oauth2Provider', function ($modal) {
             'accesstype': 'online',
             'approveprompt': 'auto',
             'scope': oauth2Provider.SCOPES,
-            'callback': callback
+            'callback': function (authResult) {
+                // Responses cached for the previous user are not for this one.
+                conferenceApi.clearUser();
+                callback(authResult);
+            }
         });
     };
 
@@ -113,6 +117,7 @@ app.factory('oauth2Provider', function ($modal) {
         // Explicitly set the invalid access token in order to make the API calls fail.
         gapi.auth.setToken({access_token: ''})
         oauth2Provider.signedIn = false;
+        conferenceApi.clearUser();
     };
 
     /**
@@ -130,3 +135,282 @@ app.factory('oauth2Provider', function ($modal) {
 
     return oauth2Provider;
 });
+
+
+/**
+ * @ngdoc service
+ * @name conferenceApi
+ *
+ * @description
+ * Wraps gapi.client.conference with a response cache. Reads answer from memory (or IndexedDB for the
+ * responses that are not the user's own) at once and are revalidated in the background; the callback
+ * runs again only if the response changed. Mutations invalidate the reads they affect.
+ * Methods take the same parameters and return an object with execute(callback), like gapi.client.
+ *
+ */
+app.factory('conferenceApi', function ($log) {
+    /**
+     * Responses younger than this are served without revalidating.
+     */
+    var FRESH_MS = 30 * 1000;
+
+    /**
+     * Responses older than this are not served at all.
+     */
+    var MAX_AGE_MS = 24 * 60 * 60 * 1000;
+
+    var DB_NAME = 'conferenceApiCache';
+    var STORE_NAME = 'responses';
+
+    /**
+     * Cached read methods; true for those whose responses belong to the signed in user, which are
+     * kept in memory only.
+     */
+    var READS = {
+        getConference: false,
+        getConferenceDetail: true,
+        queryConferences: false,
+        getProfile: true,
+        getConferencesCreated: true,
+        getConferencesToAttend: true
+    };
+
+    /**
+     * Read methods that revalidate with the etag of the cached response.
+     */
+    var CONDITIONAL = {
+        getConference: true,
+        getProfile: true
+    };
+
+    /**
+     * The reads each mutation invalidates.
+     */
+    var MUTATIONS = {
+        registerForConference: ['getConference', 'getConferenceDetail', 'queryConferences', 'getProfile',
+            'getConferencesToAttend'],
+        unregisterFromConference: ['getConference', 'getConferenceDetail', 'queryConferences', 'getProfile',
+            'getConferencesToAttend'],
+        saveProfile: ['getProfile', 'getConference', 'getConferenceDetail', 'queryConferences',
+            'getConferencesCreated', 'getConferencesToAttend'],
+        createConference: ['queryConferences', 'getConferencesCreated']
+    };
+
+    var memory = {};
+    var inFlight = {};
+    var whenOpen = null;
+
+    /**
+     * Opens the IndexedDB database once; calls back with null where IndexedDB is unavailable.
+     */
+    var withDb = function (callback) {
+        if (!window.indexedDB) {
+            callback(null);
+            return;
+        }
+        if (!whenOpen) {
+            var waiting = [];
+            var db = null;
+            var opened = false;
+            var open = window.indexedDB.open(DB_NAME, 1);
+            open.onupgradeneeded = function () {
+                open.result.createObjectStore(STORE_NAME, {keyPath: 'key'});
+            };
+            open.onsuccess = function () {
+                db = open.result;
+                opened = true;
+                angular.forEach(waiting, function (cb) { cb(db); });
+            };
+            open.onerror = function () {
+                $log.warn('Response cache unavailable: ' + open.error);
+                opened = true;
+                angular.forEach(waiting, function (cb) { cb(null); });
+            };
+            whenOpen = function (cb) {
+                if (opened) {
+                    cb(db);
+                } else {
+                    waiting.push(cb);
+                }
+            };
+        }
+        whenOpen(callback);
+    };
+
+    var persist = function (entry) {
+        withDb(function (db) {
+            if (db) {
+                db.transaction(STORE_NAME, 'readwrite').objectStore(STORE_NAME).put(entry);
+            }
+        });
+    };
+
+    var loadPersisted = function (key, callback) {
+        withDb(function (db) {
+            if (!db) {
+                callback(null);
+                return;
+            }
+            var get = db.transaction(STORE_NAME).objectStore(STORE_NAME).get(key);
+            get.onsuccess = function () { callback(get.result || null); };
+            get.onerror = function () { callback(null); };
+        });
+    };
+
+    /**
+     * Drops the cached responses of the given read methods from memory and IndexedDB.
+     */
+    var invalidate = function (methods) {
+        angular.forEach(memory, function (entry, key) {
+            if (methods.indexOf(entry.method) >= 0) {
+                delete memory[key];
+            }
+        });
+        withDb(function (db) {
+            if (!db) {
+                return;
+            }
+            var objectStore = db.transaction(STORE_NAME, 'readwrite').objectStore(STORE_NAME);
+            angular.forEach(methods, function (method) {
+                if (!READS[method]) {
+                    objectStore['delete'](IDBKeyRange.bound(method + ':', method + ':\uffff'));
+                }
+            });
+        });
+    };
+
+    /**
+     * Calls the API; concurrent identical calls share one request.
+     */
+    var fetch = function (method, params, key, callback) {
+        if (inFlight[key]) {
+            inFlight[key].push(callback);
+            return;
+        }
+        inFlight[key] = [callback];
+        gapi.client.conference[method](params).execute(function (resp) {
+            var callbacks = inFlight[key];
+            delete inFlight[key];
+            angular.forEach(callbacks, function (cb) { cb(resp); });
+        });
+    };
+
+    var remember = function (method, key, resp) {
+        var entry = {key: key, method: method, time: new Date().getTime(),
+            resp: JSON.parse(JSON.stringify(resp))};
+        memory[key] = entry;
+        if (!READS[method]) {
+            persist(entry);
+        }
+        return entry;
+    };
+
+    /**
+     * Fetches a fresh response for a cached entry and calls back only if it changed.
+     */
+    var revalidate = function (method, params, entry, callback) {
+        var revalidateParams = angular.extend({}, params);
+        var etag = entry.resp.result && entry.resp.result.etag;
+        if (CONDITIONAL[method] && etag) {
+            revalidateParams.ifNoneMatch = etag;
+        }
+        fetch(method, revalidateParams, entry.key + '#revalidate', function (resp) {
+            if (resp.error) {
+                $log.info('Keeping cached ' + method + ': ' + resp.error.message);
+            } else if (resp.result && resp.result.notModified) {
+                entry.time = new Date().getTime();
+                memory[entry.key] = entry;
+            } else if (JSON.stringify(resp) === JSON.stringify(entry.resp)) {
+                entry.time = new Date().getTime();
+            } else {
+                remember(method, entry.key, resp);
+                callback(resp);
+            }
+        });
+    };
+
+    /**
+     * Answers with a copy of entry, which pages may edit, at once (outside the current digest, like gapi
+     * responses) and revalidates it unless it is fresh.
+     */
+    var serve = function (method, params, entry, callback) {
+        setTimeout(function () { callback(angular.copy(entry.resp)); }, 0);
+        if (new Date().getTime() - entry.time > FRESH_MS) {
+            revalidate(method, params, entry, callback);
+        }
+    };
+
+    var read = function (method, params, callback) {
+        var key = method + ':' + JSON.stringify(params || {});
+        var missed = function () {
+            fetch(method, params, key, function (resp) {
+                if (!resp.error) {
+                    remember(method, key, resp);
+                }
+                callback(resp);
+            });
+        };
+        var usable = function (entry) {
+            return entry && new Date().getTime() - entry.time < MAX_AGE_MS;
+        };
+
+        if (usable(memory[key])) {
+            serve(method, params, memory[key], callback);
+        } else if (!READS[method]) {
+            loadPersisted(key, function (entry) {
+                if (usable(entry)) {
+                    memory[key] = entry;
+                    serve(method, params, entry, callback);
+                } else {
+                    missed();
+                }
+            });
+        } else {
+            missed();
+        }
+    };
+
+    var mutate = function (method, params, callback) {
+        gapi.client.conference[method](params).execute(function (resp) {
+            if (!resp.error) {
+                invalidate(MUTATIONS[method]);
+            }
+            callback(resp);
+        });
+    };
+
+    var conferenceApi = {
+        /**
+         * Drops the responses that belong to the signed in user.
+         */
+        clearUser: function () {
+            var userMethods = [];
+            angular.forEach(READS, function (isUser, method) {
+                if (isUser) {
+                    userMethods.push(method);
+                }
+            });
+            invalidate(userMethods);
+        }
+    };
+
+    angular.forEach(READS, function (isUser, method) {
+        conferenceApi[method] = function (params) {
+            return {
+                execute: function (callback) {
+                    read(method, params, callback);
+                }
+            };
+        };
+    });
+    angular.forEach(MUTATIONS, function (invalidated, method) {
+        conferenceApi[method] = function (params) {
+            return {
+                execute: function (callback) {
+                    mutate(method, params, callback);
+                }
+            };
+        };
+    });
+    return conferenceApi;
+});
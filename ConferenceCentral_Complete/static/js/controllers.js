@@ -25,7 +25,7 @@ conferenceApp.controllers = angular.module('conferenceControllers', ['ui.bootstr
  * A controller used for the My Profile page.
  */
 conferenceApp.controllers.controller('MyProfileCtrl',
-    function ($scope, $log, oauth2Provider, HTTP_ERRORS) {
+    function ($scope, $log, oauth2Provider, conferenceApi, HTTP_ERRORS) {
         $scope.submitted = false;
         $scope.loading = false;
 
@@ -63,7 +63,7 @@ conferenceApp.controllers.controller('MyProfileCtrl',
             var retrieveProfileCallback = function () {
                 $scope.profile = {};
                 $scope.loading = true;
-                gapi.client.conference.getProfile().
+                conferenceApi.getProfile().
                     execute(function (resp) {
                         $scope.$apply(function () {
                             $scope.loading = false;
@@ -94,7 +94,7 @@ conferenceApp.controllers.controller('MyProfileCtrl',
         $scope.saveProfile = function () {
             $scope.submitted = true;
             $scope.loading = true;
-            gapi.client.conference.saveProfile($scope.profile).
+            conferenceApi.saveProfile($scope.profile).
                 execute(function (resp) {
                     $scope.$apply(function () {
                         $scope.loading = false;
@@ -135,7 +135,7 @@ conferenceApp.controllers.controller('MyProfileCtrl',
  * A controller used for the Create conferences page.
  */
 conferenceApp.controllers.controller('CreateConferenceCtrl',
-    function ($scope, $log, oauth2Provider, HTTP_ERRORS) {
+    function ($scope, $log, oauth2Provider, conferenceApi, HTTP_ERRORS) {
 
         /**
          * The conference object being edited in the page.
@@ -214,7 +214,7 @@ conferenceApp.controllers.controller('CreateConferenceCtrl',
             }
 
             $scope.loading = true;
-            gapi.client.conference.createConference($scope.conference).
+            conferenceApi.createConference($scope.conference).
                 execute(function (resp) {
                     $scope.$apply(function () {
                         $scope.loading = false;
@@ -249,7 +249,7 @@ conferenceApp.controllers.controller('CreateConferenceCtrl',
  * @description
  * A controller used for the Show conferences page.
  */
-conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $log, oauth2Provider, HTTP_ERRORS) {
+conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $log, oauth2Provider, conferenceApi, HTTP_ERRORS) {
 
     /**
      * Holds the status if the query is being executed.
@@ -441,7 +441,7 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
             }
         }
         $scope.loading = true;
-        gapi.client.conference.queryConferences(sendFilters).
+        conferenceApi.queryConferences(sendFilters).
             execute(function (resp) {
                 $scope.$apply(function () {
                     $scope.loading = false;
@@ -473,7 +473,7 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
      */
     $scope.getConferencesCreated = function () {
         $scope.loading = true;
-        gapi.client.conference.getConferencesCreated().
+        conferenceApi.getConferencesCreated().
             execute(function (resp) {
                 $scope.$apply(function () {
                     $scope.loading = false;
@@ -511,7 +511,7 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
      */
     $scope.getConferencesAttend = function () {
         $scope.loading = true;
-        gapi.client.conference.getConferencesToAttend().
+        conferenceApi.getConferencesToAttend().
             execute(function (resp) {
                 $scope.$apply(function () {
                     if (resp.error) {
@@ -547,20 +547,34 @@ conferenceApp.controllers.controller('ShowConferenceCtrl', function ($scope, $lo
  * @description
  * A controller used for the conference detail page.
  */
-conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $log, $routeParams, HTTP_ERRORS) {
+conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $log, $routeParams, conferenceApi, HTTP_ERRORS) {
     $scope.conference = {};
 
+    /**
+     * The conference's sessions in schedule order.
+     * @type {Array}
+     */
+    $scope.sessions = [];
+
+    /**
+     * The websafe keys of the conference's sessions in the user's wishlist.
+     * @type {{}}
+     */
+    $scope.wishlist = {};
+
     $scope.isUserAttending = false;
 
     /**
      * Initializes the conference detail page.
-     * Invokes the conference.getConference method and sets the returned conference in the $scope.
+     * Invokes the conference.getConferenceDetail method and sets the returned conference, its session
+     * schedule and the user's registration and wishlist in the $scope.
      *
      */
     $scope.init = function () {
         $scope.loading = true;
-        gapi.client.conference.getConference({
-            websafeConferenceKey: $routeParams.websafeConferenceKey
+        conferenceApi.getConferenceDetail({
+            websafeConferenceKey: $routeParams.websafeConferenceKey,
+            summary: true
         }).execute(function (resp) {
             $scope.$apply(function () {
                 $scope.loading = false;
@@ -573,28 +587,20 @@ conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $
                     $log.error($scope.messages);
                 } else {
                     // The request has succeeded.
-                    $scope.alertStatus = 'success';
-                    $scope.conference = resp.result;
-                }
-            });
-        });
-
-        $scope.loading = true;
-        // If the user is attending the conference, updates the status message and available function.
-        gapi.client.conference.getProfile().execute(function (resp) {
-            $scope.$apply(function () {
-                $scope.loading = false;
-                if (resp.error) {
-                    // Failed to get a user profile.
-                } else {
-                    var profile = resp.result;
-                    for (var i = 0; i < profile.conferenceKeysToAttend.length; i++) {
-                        if ($routeParams.websafeConferenceKey == profile.conferenceKeysToAttend[i]) {
-                            // The user is attending the conference.
-                            $scope.alertStatus = 'info';
-                            $scope.messages = 'You are attending this conference';
-                            $scope.isUserAttending = true;
-                        }
+                    var detail = resp.result;
+                    $scope.conference = detail.conference;
+                    $scope.sessions = detail.sessions || [];
+                    $scope.wishlist = {};
+                    angular.forEach(detail.wishlistSessionKeys || [], function (websafeSessionKey) {
+                        $scope.wishlist[websafeSessionKey] = true;
+                    });
+                    $scope.isUserAttending = !!detail.registered;
+                    if ($scope.isUserAttending) {
+                        // The user is attending the conference.
+                        $scope.alertStatus = 'info';
+                        $scope.messages = 'You are attending this conference';
+                    } else {
+                        $scope.alertStatus = 'success';
                     }
                 }
             });
@@ -607,7 +613,7 @@ conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $
      */
     $scope.registerForConference = function () {
         $scope.loading = true;
-        gapi.client.conference.registerForConference({
+        conferenceApi.registerForConference({
             websafeConferenceKey: $routeParams.websafeConferenceKey
         }).execute(function (resp) {
             $scope.$apply(function () {
@@ -644,7 +650,7 @@ conferenceApp.controllers.controller('ConferenceDetailCtrl', function ($scope, $
      */
     $scope.unregisterFromConference = function () {
         $scope.loading = true;
-        gapi.client.conference.unregisterFromConference({
+        conferenceApi.unregisterFromConference({
             websafeConferenceKey: $routeParams.websafeConferenceKey
         }).execute(function (resp) {
             $scope.$apply(function () {
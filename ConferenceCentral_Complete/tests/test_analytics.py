@@ -0,0 +1,124 @@
+import shutil
+import tempfile
+import time
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+import analytics
+import export
+from conference import CONFERENCE_STATS_ID
+from conference import MEMCACHE_BURNDOWN_KEY
+from models import ConferenceStats
+
+from tests import ApiTestCase
+
+
+class IncrementalStatsTest(ApiTestCase):
+    """computeStats folds in only new export runs, and gets the same
+    tables as computing them from every run."""
+
+    FIXTURES = {'conferences': 5, 'sessions': 5, 'profiles': 10}
+
+    def setUp(self):
+        super(IncrementalStatsTest, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.saved = export.EXPORT_LOCAL_DIR
+        export.EXPORT_LOCAL_DIR = self.directory
+
+    def tearDown(self):
+        export.EXPORT_LOCAL_DIR = self.saved
+        shutil.rmtree(self.directory)
+        super(IncrementalStatsTest, self).tearDown()
+
+    def exportAll(self):
+        # run ids are start times to the second
+        time.sleep(1)
+        for table, run in export.startExport():
+            cursor, chunk = None, 0
+            while True:
+                cursor = export.exportBatch(table, run, cursor, chunk)
+                if not cursor:
+                    break
+                chunk += 1
+
+    def register(self, profile_key, conf_key):
+        prof, conf = ndb.get_multi([profile_key, conf_key])
+        prof.conferenceKeysToAttend.append(conf_key.urlsafe())
+        conf.seatsAvailable -= 1
+        ndb.put_multi([prof, conf])
+
+    def results(self):
+        stats = ConferenceStats.get_by_id(CONFERENCE_STATS_ID).stats
+        del stats['computed']
+        curves = memcache.get_multi(
+            [conf.urlsafe() for conf in self.fx['conferences']],
+            key_prefix=MEMCACHE_BURNDOWN_KEY)
+        return stats, curves
+
+    def testFoldsNewRuns(self):
+        self.exportAll()
+        self.assertEqual(analytics.computeStats(), 5)
+        first = ConferenceStats.get_by_id(CONFERENCE_STATS_ID)
+
+        for prof in self.fx['profiles'][:4]:
+            self.register(prof, self.fx['conferences'][0])
+        self.exportAll()
+
+        opened = []
+        openFile = analytics.openFile
+        analytics.openFile = lambda path, *args: (
+            opened.append(path) or openFile(path, *args))
+        try:
+            self.assertEqual(analytics.computeStats(), 5)
+        finally:
+            analytics.openFile = openFile
+        folded = ConferenceStats.get_by_id(CONFERENCE_STATS_ID)
+        self.assertNotEqual(folded.folded, first.folded)
+        old_runs = set('/%s/' % run for run in first.folded.values())
+        self.assertFalse([path for path in opened
+                          if any(run in path for run in old_runs)])
+        incremental = self.results()
+
+        # nothing new: the tables are recomputed from the state alone
+        analytics.computeStats()
+        self.assertEqual(self.results(), incremental)
+        self.assertEqual(
+            ConferenceStats.get_by_id(CONFERENCE_STATS_ID).state,
+            folded.state)
+
+        # from scratch over every run
+        ndb.Key(ConferenceStats, CONFERENCE_STATS_ID).delete()
+        memcache.flush_all()
+        analytics.computeStats()
+        self.assertEqual(self.results(), incremental)
+        registered = dict((row[0], row[3])
+                          for row in incremental[0]['byCity'])
+        self.assertTrue(sum(registered.values()) >= 4)
+
+
+class CloudStorageTest(ApiTestCase):
+    """Without EXPORT_LOCAL_DIR the export goes through the vendored
+    Cloud Storage client, as on an instance."""
+
+    FIXTURES = {'conferences': 2, 'sessions': 2, 'profiles': 2}
+
+    def setUp(self):
+        super(CloudStorageTest, self).setUp()
+        self.stubs.testbed.init_blobstore_stub()
+        self.saved = export.EXPORT_LOCAL_DIR, export.EXPORT_BUCKET
+        export.EXPORT_LOCAL_DIR, export.EXPORT_BUCKET = None, 'exports-test'
+
+    def tearDown(self):
+        export.EXPORT_LOCAL_DIR, export.EXPORT_BUCKET = self.saved
+        super(CloudStorageTest, self).tearDown()
+
+    def testRoundTrip(self):
+        path = 'exports/conferences/run/manifest.json'
+        with export.openFile(path, 'w') as f:
+            f.write('{}')
+        self.assertEqual(export.listFiles('exports/conferences/'), [path])
+        with export.openFile(path) as f:
+            self.assertEqual(f.read(), '{}')
+        export.deleteFile(path)
+        self.assertEqual(export.listFiles('exports/conferences/'), [])
@@ -0,0 +1,104 @@
+import time
+from datetime import date
+from datetime import timedelta
+
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+import archive
+import entitycache
+from models import Conference
+from models import ConferenceArchive
+from models import VersionedModel
+
+from tests import ApiTestCase
+
+
+class ArchiveTest(ApiTestCase):
+    """The archive job queries the conferences that have ended, retires
+    their cached versions, and queryArchived filters on indexed copies."""
+
+    def setUp(self):
+        super(ArchiveTest, self).setUp()
+        self.batchSize = archive.BATCH_SIZE
+        archive.BATCH_SIZE = 2
+        entitycache.clear()
+
+    def tearDown(self):
+        archive.BATCH_SIZE = self.batchSize
+        entitycache.clear()
+        super(ArchiveTest, self).tearDown()
+
+    def testArchiveFinished(self):
+        confs = ndb.get_multi(self.fx['conferences'])
+        # every fixture conference ends by 2018; move one into the future
+        live = confs[0]
+        live.endDate = date(2999, 1, 1)
+        live.put()
+        ended = confs[1:]
+        before = max(conf.endDate for conf in ended) + timedelta(days=1)
+        self.assertEqual(
+            Conference.query(Conference.endDate < before).count(), len(ended))
+
+        batches, cursor = 0, None
+        while True:
+            _, cursor = archive.archiveFinishedConferences(before, cursor)
+            batches += 1
+            if not cursor:
+                break
+        self.assertEqual(batches, 2)
+
+        self.assertTrue(live.key.get())
+        self.assertEqual(ndb.get_multi([conf.key for conf in ended]),
+                         [None] * len(ended))
+        version_keys = [VersionedModel.versionKey(conf.key)
+                        for conf in ended]
+        self.assertEqual(set(memcache.get_multi(version_keys).values()),
+                         set([archive.ARCHIVED_VERSION]))
+        # another instance's copies, due for revalidation, are dropped
+        stale = time.time() - entitycache.FRESH_SECONDS - 1
+        for conf in ended:
+            entitycache._store(conf.key, conf, stale)
+        self.assertEqual(entitycache.getMulti([conf.key for conf in ended]),
+                         [None] * len(ended))
+
+    def testQueryArchived(self):
+        confs = ndb.get_multi(self.fx['conferences'])
+        for conf in confs:
+            archive.archiveConference(conf.key)
+        archives = ConferenceArchive.query().fetch()
+        self.assertEqual(len(archives), len(confs))
+        self.assertEqual(
+            sorted((a.city, a.month) for a in archives),
+            sorted((c.city, c.month) for c in confs))
+
+        def names(filters):
+            return sorted(conf.name for conf in archive.queryArchived(filters))
+
+        conf = confs[0]
+        self.assertEqual(
+            names([{'field': 'city', 'operator': '=', 'value': conf.city},
+                   {'field': 'maxAttendees', 'operator': '>=',
+                    'value': conf.maxAttendees}]),
+            sorted(c.name for c in confs if c.city == conf.city and
+                   c.maxAttendees >= conf.maxAttendees))
+        self.assertEqual(
+            names([{'field': 'month', 'operator': '>', 'value': 6}]),
+            sorted(c.name for c in confs if c.month > 6))
+        self.assertEqual(
+            names([{'field': 'topics', 'operator': '=',
+                    'value': conf.topics[0]}]),
+            sorted(c.name for c in confs if conf.topics[0] in c.topics))
+
+    def testFillArchiveFields(self):
+        c_key = self.fx['conferences'][0]
+        archive.archiveConference(c_key)
+        old = archive.archiveKey(c_key).get()
+        for name in archive.ARCHIVE_FIELDS:
+            setattr(old, name, [] if name == 'topics' else None)
+        old.put()
+        filled = archive.fillArchiveFields(archive.archiveKey(c_key).get())
+        self.assertEqual(filled.city, filled.conference.city)
+        self.assertEqual(filled.topics, filled.conference.topics)
+        self.assertEqual(filled.startDate, filled.conference.startDate)
+        self.assertIsNone(archive.fillArchiveFields(filled))
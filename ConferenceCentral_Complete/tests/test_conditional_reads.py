@@ -0,0 +1,52 @@
+from conference import CONF_GET_COND_REQUEST
+from conference import SESS_GET_REQ
+
+from tests import ApiTestCase
+
+
+class MaskedETagTest(ApiTestCase):
+    """An ETag only revalidates a response built with the same fields mask."""
+
+    def getConference(self, fields, etag=None):
+        return self.api.getConference(
+            CONF_GET_COND_REQUEST.combined_message_class(
+                websafeConferenceKey=self.fx['conferences'][0].urlsafe(),
+                fields=fields, ifNoneMatch=etag))
+
+    def getSessions(self, fields, etag=None):
+        return self.api.getConferenceSessions(
+            SESS_GET_REQ.combined_message_class(
+                websafeConferenceKey=self.fx['conferences'][0].urlsafe(),
+                fields=fields, ifNoneMatch=etag))
+
+    def testConferenceMasks(self):
+        narrow = self.getConference(['name'])
+        self.assertIsNone(narrow.city)
+
+        other = self.getConference(['city'], narrow.etag)
+        self.assertFalse(other.notModified)
+        self.assertIsNotNone(other.city)
+        self.assertNotEqual(other.etag, narrow.etag)
+
+        full = self.getConference([], narrow.etag)
+        self.assertFalse(full.notModified)
+        self.assertIsNotNone(full.city)
+
+        # the same mask, normalized, still revalidates
+        again = self.getConference(['websafeKey, name'], narrow.etag)
+        self.assertTrue(again.notModified)
+        self.assertTrue(self.getConference([], full.etag).notModified)
+
+    def testSessionMasks(self):
+        narrow = self.getSessions(['name'])
+        self.assertTrue(narrow.items)
+
+        other = self.getSessions(['location'], narrow.etag)
+        self.assertFalse(other.notModified)
+        self.assertTrue(all(s.location for s in other.items))
+
+        full = self.getSessions([], narrow.etag)
+        self.assertFalse(full.notModified)
+
+        self.assertTrue(self.getSessions(['name'], narrow.etag).notModified)
+        self.assertTrue(self.getSessions([], full.etag).notModified)
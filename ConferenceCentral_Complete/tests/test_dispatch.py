@@ -0,0 +1,39 @@
+import json
+
+from google.appengine.ext import ndb
+
+from mailer import MAIL_QUEUE
+from models import ConferenceForm
+from models import ProfileMiniForm
+
+from tests import ApiTestCase
+
+
+class DispatchTest(ApiTestCase):
+    """Writes enqueue their follow-up tasks alongside the rest of the
+    request, and every task is added by the time they return."""
+
+    def tasks(self, queue_name):
+        taskqueue = self.stubs.testbed.get_stub('taskqueue')
+        return taskqueue.get_filtered_tasks(queue_names=[queue_name])
+
+    def testCreateConference(self):
+        self.api.createConference(ConferenceForm(
+            name='Dispatch', city='Paris', maxAttendees=10,
+            startDate='2030-05-01', endDate='2030-05-02'))
+        tasks = self.tasks(MAIL_QUEUE)
+        self.assertEqual(len(tasks), 1)
+        note = json.loads(tasks[0].payload)
+        self.assertEqual(note['type'], 'conference')
+        self.assertEqual(ndb.Key(urlsafe=note['key']).get().name, 'Dispatch')
+
+    def testRenameProfile(self):
+        form = self.api.saveProfile(ProfileMiniForm(displayName='Renamed'))
+        self.assertEqual(form.displayName, 'Renamed')
+        tasks = self.tasks('default')
+        self.assertEqual([task.url for task in tasks],
+                         ['/tasks/update_organizer_name'])
+
+        # an unchanged name has nothing to update
+        self.api.saveProfile(ProfileMiniForm(displayName='Renamed'))
+        self.assertEqual(len(self.tasks('default')), 1)
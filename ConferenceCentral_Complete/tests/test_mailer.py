@@ -0,0 +1,45 @@
+import logging
+
+from google.appengine.api import taskqueue
+
+import mailer
+from mailer import confirmationTask
+from mailer import MAIL_QUEUE
+
+from tests import ApiTestCase
+
+
+class SendDigestsTest(ApiTestCase):
+    """A confirmation that keeps failing to send is dropped after
+    MAX_LEASES attempts instead of being retried forever."""
+
+    def setUp(self):
+        super(SendDigestsTest, self).setUp()
+        self.sent = []
+        self.saved = mailer._send, mailer.LEASE_SECONDS
+        mailer._send = self.send
+        # expire leases at once, so one run retries a failed send
+        mailer.LEASE_SECONDS = 0
+        logging.disable(logging.ERROR)
+
+    def tearDown(self):
+        mailer._send, mailer.LEASE_SECONDS = self.saved
+        logging.disable(logging.NOTSET)
+        super(SendDigestsTest, self).tearDown()
+
+    def send(self, to, subject, body):
+        self.sent.append(to)
+        if to.startswith('bounce'):
+            raise IOError('SMTP error')
+
+    def testDropsAfterMaxLeases(self):
+        conf = self.fx['conferences'][0]
+        taskqueue.Queue(MAIL_QUEUE).add([
+            confirmationTask('bounce@example.com', 'conference', conf),
+            confirmationTask('ok@example.com', 'conference', conf),
+        ])
+        self.assertEqual(mailer.sendDigests(), 1)
+        self.assertEqual(self.sent.count('ok@example.com'), 1)
+        self.assertEqual(self.sent.count('bounce@example.com'),
+                         mailer.MAX_LEASES)
+        self.assertFalse(taskqueue.Queue(MAIL_QUEUE).lease_tasks(0, 10))
@@ -0,0 +1,68 @@
+import os
+import sys
+from cStringIO import StringIO
+
+from protorpc import protobuf
+
+from conference import CONF_GET_COND_REQUEST
+from conference import SESS_GET_REQ
+from models import ConferenceForm
+from models import SessionForms
+import rpc
+
+from tests import APP_DIR
+from tests import ApiTestCase
+
+sys.path.insert(0, os.path.join(APP_DIR, 'tools'))
+import gen_proto
+
+
+class ProtobufTest(ApiTestCase):
+    """Native clients get the messages clients/conference.proto declares."""
+
+    def post(self, method, request):
+        body = protobuf.encode_message(request)
+        environ = {
+            'REQUEST_METHOD': 'POST',
+            'PATH_INFO': '%s.%s' % (rpc.RPC_PATH, method),
+            'CONTENT_TYPE': rpc.PROTOBUF_CONTENT_TYPES[0],
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.input': StringIO(body),
+            'SERVER_NAME': 'localhost',
+            'SERVER_PORT': '80',
+            'wsgi.url_scheme': 'http',
+        }
+        status = []
+        response = ''.join(rpc.app(
+            environ, lambda s, headers, exc_info=None: status.append(
+                (s, dict(headers)))))
+        self.assertEqual(status[0][0], '200 OK')
+        self.assertEqual(status[0][1]['content-type'],
+                         rpc.PROTOBUF_CONTENT_TYPES[0])
+        return response
+
+    def testProtoUpToDate(self):
+        with open(gen_proto.PROTO_FILE, 'rb') as f:
+            self.assertEqual(f.read(), gen_proto.buildProto())
+
+    def testConferenceRoundTrip(self):
+        c_key = self.fx['conferences'][0]
+        response = self.post('getConference',
+                             CONF_GET_COND_REQUEST.combined_message_class(
+                                 websafeConferenceKey=c_key.urlsafe()))
+        form = protobuf.decode_message(ConferenceForm, response)
+        self.assertEqual(form.name, c_key.get().name)
+        self.assertEqual(form.websafeKey, c_key.urlsafe())
+
+    def testSessionsRoundTrip(self):
+        c_key = self.fx['conferences'][0]
+        response = self.post('getConferenceSessions',
+                             SESS_GET_REQ.combined_message_class(
+                                 websafeConferenceKey=c_key.urlsafe(),
+                                 fields=['name']))
+        forms = protobuf.decode_message(SessionForms, response)
+        expected = self.api.getConferenceSessions(
+            SESS_GET_REQ.combined_message_class(
+                websafeConferenceKey=c_key.urlsafe(), fields=['name']))
+        self.assertTrue(forms.items)
+        self.assertEqual(forms, expected)
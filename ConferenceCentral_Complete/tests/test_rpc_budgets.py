@@ -0,0 +1,36 @@
+import unittest
+
+import harness
+from benchmark import Drivers
+from check_budgets import BUDGETS
+from check_budgets import measure
+
+# fewer calls and a smaller second size than check_budgets.py, to keep the
+# suite quick; an N+1 pattern still shows as growth
+CALLS = 2
+SCALE = 2
+SEED = 0
+
+
+class RpcBudgetTest(unittest.TestCase):
+    """Every endpoint stays within its check_budgets.BUDGETS RPC budget,
+    at both fixture sizes, and makes no more RPCs on the larger one."""
+
+    @classmethod
+    def setUpClass(cls):
+        small = harness.FIXTURE_SIZES['small']
+        large = dict((k, v * SCALE) for k, v in small.items())
+        cls.small, cls.smallFailures = measure(small, CALLS, SEED)
+        cls.large, cls.largeFailures = measure(large, CALLS, SEED)
+
+    def testEveryEndpointHasABudget(self):
+        self.assertEqual(sorted(set(Drivers.WEIGHTS) - set(BUDGETS)), [])
+
+    def testWithinBudget(self):
+        self.assertEqual(self.smallFailures + self.largeFailures, [])
+
+    def testNoGrowthWithDataSize(self):
+        grown = ['%s: %d -> %d' % (name, self.small[name], self.large[name])
+                 for name in sorted(self.small)
+                 if self.large[name] > self.small[name]]
+        self.assertEqual(grown, [])
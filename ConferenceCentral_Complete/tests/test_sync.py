@@ -0,0 +1,60 @@
+import base64
+import json
+
+import endpoints
+
+from conference import SYNC_REQUEST
+from settings import RATE_LIMITS
+
+from tests import ApiTestCase
+
+
+class SyncTokenTest(ApiTestCase):
+    """sync rejects tokens it did not issue with a 400."""
+
+    def setUp(self):
+        super(SyncTokenTest, self).setUp()
+        # more syncs than a caller's bucket holds
+        RATE_LIMITS['sync'] = RATE_LIMITS['*'] = (100, 1.0)
+
+    def tearDown(self):
+        del RATE_LIMITS['sync'], RATE_LIMITS['*']
+        super(SyncTokenTest, self).tearDown()
+
+    def sync(self, since=None):
+        return self.api.sync(
+            SYNC_REQUEST.combined_message_class(since=since))
+
+    def token(self, state):
+        return base64.urlsafe_b64encode(json.dumps(state))
+
+    def testIssuedTokens(self):
+        form = self.sync()
+        self.assertTrue(form.conferences)
+        self.assertTrue(form.sessions)
+        while form.more:
+            form = self.sync(form.nextToken)
+        self.assertFalse(self.sync(form.nextToken).more)
+
+    def testBogusTokens(self):
+        good = {'since': 0, 'until': 10**15, 'phase': 0, 'cursor': None}
+        bogus = [
+            'not a token',
+            base64.urlsafe_b64encode('not json'),
+            self.token([1, 2, 3]),
+            self.token({}),
+            self.token(dict(good, extra=1)),
+            self.token(dict(good, since='0')),
+            self.token(dict(good, since=-1)),
+            self.token(dict(good, until=True)),
+            self.token(dict(good, until=10**30)),
+            self.token(dict(good, since=10**15, until=0)),
+            self.token(dict(good, phase=3)),
+            self.token(dict(good, phase=1.0)),
+            self.token(dict(good, cursor=7)),
+            self.token(dict(good, cursor='bogus')),
+            self.token(dict(good, until=None, phase=1)),
+        ]
+        self.sync(self.token(good))
+        for token in bogus:
+            self.assertRaises(endpoints.BadRequestException, self.sync, token)
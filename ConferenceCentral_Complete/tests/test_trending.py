@@ -0,0 +1,51 @@
+from google.appengine.ext import ndb
+
+from models import PopularityShard
+from models import Trending
+from popularity import incrementCounter
+from popularity import materializeTrending
+from popularity import TRENDING_CONFERENCES_ID
+from popularity import TRENDING_SESSIONS_ID
+
+from tests import ApiTestCase
+
+
+class TrendingTest(ApiTestCase):
+    """materializeTrending re-sums only the counters changed since its
+    last run, and rebuilds only the lists they belong to."""
+
+    def count(self, key, field, times):
+        delta = 1 if times > 0 else -1
+        ndb.Future.wait_all([incrementCounter(key, field, delta)
+                             for _ in range(abs(times))])
+
+    def trending(self, trending_id):
+        trending = ndb.Key(Trending, trending_id).get()
+        return zip(trending.items, trending.counts) if trending else []
+
+    def testIncremental(self):
+        # sessions of three different conferences
+        s1, s2, s3 = self.fx['sessions'][:3]
+        self.assertEqual(len(set(s.parent() for s in (s1, s2, s3))), 3)
+        self.count(s1, 'wishlists', 5)
+        self.count(s2, 'wishlists', 3)
+        self.count(s3, 'wishlists', 2)
+        c1 = self.fx['conferences'][0]
+        self.count(c1, 'registrations', 2)
+        self.assertEqual(materializeTrending(), 2 + 3)
+        self.assertEqual(self.trending(TRENDING_SESSIONS_ID),
+                         [(s1, 5), (s2, 3), (s3, 2)])
+        self.assertEqual(self.trending(TRENDING_CONFERENCES_ID), [(c1, 2)])
+        self.assertFalse(PopularityShard.query(
+            PopularityShard.dirty == True).fetch())
+
+        # nothing changed, nothing rebuilt
+        self.assertEqual(materializeTrending(), 0)
+
+        # only s1 is summed again; s2 and s3 come from their totals
+        self.count(s1, 'wishlists', -4)
+        materializeTrending()
+        self.assertEqual(self.trending(TRENDING_SESSIONS_ID),
+                         [(s2, 3), (s3, 2), (s1, 1)])
+        self.assertEqual(self.trending(TRENDING_CONFERENCES_ID), [(c1, 2)])
+        self.assertEqual(self.trending(s1.parent().urlsafe()), [(s1, 1)])
@@ -0,0 +1,53 @@
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+
+from models import VersionedModel
+
+from tests import ApiTestCase
+
+
+class VersionPublishTest(ApiTestCase):
+    """The versions put in one transaction are published with a single
+    memcache set once it commits, and not at all if it fails."""
+
+    def versions(self, keys):
+        cached = memcache.get_multi([VersionedModel.versionKey(key)
+                                     for key in keys])
+        return [cached.get(VersionedModel.versionKey(key)) for key in keys]
+
+    def testOneSetPerCommit(self):
+        keys = [self.fx['profiles'][0], self.fx['conferences'][0]]
+
+        @ndb.transactional(xg=True)
+        def txn():
+            entities = ndb.get_multi(keys)
+            for entity in entities:
+                entity.put()
+            return entities
+
+        # ndb's own cache locks go through the memcache client, not here
+        published = []
+        set_multi = memcache.set_multi
+        def recording(mapping, **kwargs):
+            published.append(len(mapping))
+            return set_multi(mapping, **kwargs)
+        memcache.set_multi = recording
+        try:
+            entities = txn()
+        finally:
+            memcache.set_multi = set_multi
+        self.assertEqual(published, [2])
+        self.assertEqual(self.versions(keys),
+                         [entity.version for entity in entities])
+
+    def testNothingOnRollback(self):
+        c_key = self.fx['conferences'][0]
+
+        @ndb.transactional()
+        def txn():
+            c_key.get().put()
+            raise ndb.Rollback()
+
+        memcache.flush_all()
+        txn()
+        self.assertEqual(self.versions([c_key]), [None])
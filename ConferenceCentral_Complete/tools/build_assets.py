@@ -0,0 +1,356 @@
+#!/usr/bin/env python
+
+"""
+build_assets.py -- bundles and minifies the local CSS and JS that
+    templates/index.html loads, inlines the angular partials into the JS
+    bundle, fingerprints the bundles and the fonts and images they use
+    into static/dist, and writes the rewritten page to
+    templates/dist/index.html; rerun it after changing any of them
+
+usage: python tools/build_assets.py [--check]
+
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import os
+import posixpath
+import re
+import shutil
+import sys
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SOURCE_PAGE = os.path.join(APP_DIR, 'templates', 'index.html')
+BUILT_PAGE = os.path.join(APP_DIR, 'templates', 'dist', 'index.html')
+DIST_DIR = os.path.join(APP_DIR, 'static', 'dist')
+DIST_URL = '/dist'
+PARTIALS_URL = '/partials'
+ANGULAR_MODULE = 'conferenceApp'
+HASH_LENGTH = 10
+
+# URL prefix -> directory, as the static_dir handlers in app.yaml map them
+URL_ROOTS = {
+    '/js': 'static/js',
+    '/css': 'static/bootstrap/css',
+    '/img': 'static/img',
+    '/fonts': 'static/fonts',
+    '/partials': 'static/partials',
+}
+
+BUILD_BLOCK = re.compile(
+    r'([ \t]*)<!-- build:(css|js) (\S+) -->(.*?)<!-- endbuild -->',
+    re.DOTALL)
+LINK_HREF = re.compile(r'<link[^>]*\bhref="([^"]+)"')
+SCRIPT_SRC = re.compile(r'<script[^>]*\bsrc="([^"]+)"')
+CSS_URL = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)')
+CSS_IMPORT = re.compile(r'@import\s+(url\([^)]*\)|"[^"]*"|\'[^\']*\')\s*;')
+CSS_TOKENS = re.compile(
+    r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')|(/\*.*?\*/)', re.DOTALL)
+HTML_ASSET = re.compile(r'\b(src|href)="(/[^"?#]+)"')
+
+
+def readText(path):
+    with io.open(path, encoding='utf-8') as f:
+        return f.read()
+
+
+def writeFile(path, data):
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def localPath(url):
+    """Return the file a local URL is served from, or None."""
+    for prefix, directory in URL_ROOTS.items():
+        if url.startswith(prefix + '/'):
+            path = os.path.join(APP_DIR, directory, url[len(prefix) + 1:])
+            return path if os.path.isfile(path) else None
+    return None
+
+
+def isRemote(url):
+    return url.startswith(('//', 'http:', 'https:', 'data:'))
+
+
+def fingerprint(name, data):
+    """Name data 'base.<hash>.ext' after its content."""
+    base, ext = os.path.splitext(name)
+    digest = hashlib.sha1(data).hexdigest()[:HASH_LENGTH]
+    return '%s.%s%s' % (base, digest, ext)
+
+
+class Build(object):
+    """Build -- the fingerprinted files of one run, by name"""
+
+    def __init__(self):
+        self.files = {}
+        self.assets = {}
+
+    def add(self, name, data):
+        """Add a fingerprinted file.
+        Returns: its URL"""
+        name = fingerprint(name, data)
+        self.files[name] = data
+        return '%s/%s' % (DIST_URL, name)
+
+    def asset(self, url):
+        """Fingerprint the local file behind url, once.
+        Returns: its dist URL, or None if url is not a local file"""
+        if url not in self.assets:
+            path = localPath(url)
+            if path is None:
+                return None
+            with open(path, 'rb') as f:
+                self.assets[url] = self.add(os.path.basename(path), f.read())
+        return self.assets[url]
+
+
+def minifyCss(css):
+    """Drop comments and the whitespace CSS does not need; strings are
+    kept as they are."""
+    out = []
+    pos = 0
+    for match in CSS_TOKENS.finditer(css):
+        out.append(_squeezeCss(css[pos:match.start()]))
+        if match.group(1):
+            out.append(match.group(1))
+        pos = match.end()
+    out.append(_squeezeCss(css[pos:]))
+    return ''.join(out).replace(';}', '}').strip()
+
+
+def _squeezeCss(text):
+    text = re.sub(r'\s+', ' ', text)
+    # a space before ':' can be a descendant selector, so only after it
+    return re.sub(r' ?([{};,>]) ?', r'\1', text).replace(': ', ':')
+
+
+def cssBundle(build, urls):
+    """Concatenate the stylesheets at urls with their url()s pointing at
+    fingerprinted copies.  Remote @imports must come first in a
+    stylesheet, so they are returned to be linked from the page instead,
+    where they load in parallel with the bundle.
+    Returns: (minified CSS, list of remote stylesheet URLs)"""
+    parts = []
+    imports = []
+
+    for url in urls:
+        base = posixpath.dirname(url)
+
+        def rewrite(match):
+            ref = match.group(2).strip()
+            if isRemote(ref):
+                return match.group(0)
+            path, suffix = re.match(r'([^?#]*)(.*)', ref).groups()
+            resolved = posixpath.normpath(posixpath.join(base, path))
+            dist_url = build.asset(resolved)
+            if dist_url is None:
+                sys.stderr.write('%s: no file for %s\n' % (url, ref))
+                dist_url = resolved
+            return 'url("%s%s")' % (dist_url, suffix)
+
+        def hoist(match):
+            target = CSS_URL.match(match.group(1))
+            imports.append(target.group(2) if target
+                           else match.group(1)[1:-1])
+            return ''
+
+        css = CSS_IMPORT.sub(hoist, readText(localPath(url)))
+        parts.append(CSS_URL.sub(rewrite, css))
+    return minifyCss('\n'.join(parts)), imports
+
+
+def _jsTokens(js):
+    """Split JS into (kind, text) tokens: 'code', 'string', 'regex',
+    'comment' and 'newline'.  A '/' starts a regex literal after an
+    operator or at the start of a statement, as in the ES5 grammar."""
+    tokens = []
+    i, n = 0, len(js)
+    code_start = 0
+    last = ''
+
+    def flush(end):
+        if end > code_start:
+            tokens.append(('code', js[code_start:end]))
+
+    while i < n:
+        c = js[i]
+        if c in '\'"':
+            j = i + 1
+            while j < n and js[j] != c:
+                j += 2 if js[j] == '\\' else 1
+            flush(i)
+            tokens.append(('string', js[i:j + 1]))
+            i = code_start = j + 1
+            last = c
+        elif js.startswith('//', i):
+            j = js.find('\n', i)
+            j = n if j < 0 else j
+            flush(i)
+            tokens.append(('comment', js[i:j]))
+            i = code_start = j
+        elif js.startswith('/*', i):
+            j = js.find('*/', i + 2) + 2
+            flush(i)
+            comment = js[i:j]
+            tokens.append(('newline' if '\n' in comment else 'comment',
+                           comment))
+            i = code_start = j
+        elif c == '/' and (not last or last in '(,=:[!&|?{};+-*%<>~^'):
+            j = i + 1
+            in_class = False
+            while j < n and (in_class or js[j] != '/'):
+                if js[j] == '\\':
+                    j += 1
+                elif js[j] == '[':
+                    in_class = True
+                elif js[j] == ']':
+                    in_class = False
+                j += 1
+            j += 1
+            while j < n and (js[j].isalnum() or js[j] in '_$'):
+                j += 1
+            flush(i)
+            tokens.append(('regex', js[i:j]))
+            i = code_start = j
+            last = 'a'
+        else:
+            if not c.isspace():
+                last = c
+            i += 1
+    flush(n)
+    return tokens
+
+
+def _isWord(c):
+    return c.isalnum() or c in '_$\\'
+
+
+def minifyJs(js):
+    """Drop comments, indentation and blank lines, and the spaces between
+    tokens that don't need them.  Line breaks are kept, since the sources
+    lean on automatic semicolon insertion, and no names are changed, since
+    the angular code is injected by parameter name."""
+    out = []
+
+    def emit(piece):
+        # a space survives only between two word characters or two signs
+        # that would otherwise merge, e.g. 'a + +b'
+        if piece == ' ':
+            if out and out[-1] not in (' ', '\n'):
+                out.append(' ')
+            return
+        if out and out[-1] == ' ':
+            before = out[-2]
+            if not ((_isWord(before[-1]) and _isWord(piece[0])) or
+                    (before[-1] in '+-' and piece[0] in '+-')):
+                out.pop()
+        out.append(piece)
+
+    for kind, text in _jsTokens(js):
+        if kind == 'comment':
+            emit(' ')
+        elif kind == 'newline':
+            emit('\n')
+        elif kind == 'code':
+            for piece in re.split(r'(\n|[ \t\r]+)', text):
+                if piece:
+                    emit(piece if piece == '\n' or piece.strip() else ' ')
+        else:
+            # strings and regular expressions are kept whole
+            emit(text)
+
+    lines = [line.strip() for line in ''.join(out).split('\n')]
+    return '\n'.join(line for line in lines if line) + '\n'
+
+
+def templatesJs(build):
+    """A run block putting every partial into angular's $templateCache,
+    so routes and modals need no request for their templates."""
+    directory = os.path.join(APP_DIR, URL_ROOTS[PARTIALS_URL])
+    puts = []
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith('.html'):
+            continue
+        html = readText(os.path.join(directory, name))
+        html = HTML_ASSET.sub(
+            lambda m: '%s="%s"' % (m.group(1),
+                                   build.asset(m.group(2)) or m.group(2)),
+            html)
+        puts.append('$templateCache.put(%s, %s);' % (
+            json.dumps('%s/%s' % (PARTIALS_URL, name)), json.dumps(html)))
+    return ("angular.module(%s).run(['$templateCache', "
+            "function ($templateCache) {\n%s\n}]);\n" % (
+                json.dumps(ANGULAR_MODULE), '\n'.join(puts)))
+
+
+def jsBundle(build, urls):
+    """Concatenate and minify the scripts at urls plus the partials."""
+    sources = [readText(localPath(url)) for url in urls]
+    sources.append(templatesJs(build))
+    return ';\n'.join(minifyJs(js) for js in sources)
+
+
+def build():
+    """Run the build.
+    Returns: (Build, rewritten page)"""
+    result = Build()
+    page = readText(SOURCE_PAGE)
+
+    def replace(match):
+        indent, kind, name, block = match.groups()
+        if kind == 'css':
+            urls = LINK_HREF.findall(block)
+            css, imports = cssBundle(result, urls)
+            tags = ['<link rel="stylesheet" href="%s">' % url
+                    for url in imports]
+            tags.append('<link rel="stylesheet" href="%s">' %
+                        result.add(posixpath.basename(name),
+                                   css.encode('utf-8')))
+        else:
+            urls = SCRIPT_SRC.findall(block)
+            js = jsBundle(result, urls)
+            tags = ['<script src="%s"></script>' %
+                    result.add(posixpath.basename(name), js.encode('utf-8'))]
+        return '\n'.join(indent + tag for tag in tags)
+
+    # after the doctype, which must come first
+    doctype, rest = BUILD_BLOCK.sub(replace, page).split('\n', 1)
+    page = '\n'.join([doctype, '<!-- Built by tools/build_assets.py from '
+                       'templates/index.html; do not edit. -->', rest])
+    return result, page
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--check', action='store_true',
+                        help='fail if the built files are out of date')
+    args = parser.parse_args()
+
+    result, page = build()
+    page = page.encode('utf-8')
+    current = set(os.listdir(DIST_DIR)) if os.path.isdir(DIST_DIR) else set()
+    if args.check:
+        stale = (current != set(result.files) or
+                 not os.path.isfile(BUILT_PAGE) or
+                 open(BUILT_PAGE, 'rb').read() != page)
+        if stale:
+            sys.exit('static/dist is out of date; run tools/build_assets.py')
+        return
+
+    if os.path.isdir(DIST_DIR):
+        shutil.rmtree(DIST_DIR)
+    for name, data in sorted(result.files.items()):
+        writeFile(os.path.join(DIST_DIR, name), data)
+        print '%-48s %8d bytes' % (name, len(data))
+    writeFile(BUILT_PAGE, page)
+    print '%-48s %8d bytes' % (os.path.relpath(BUILT_PAGE, APP_DIR), len(page))
+
+
+if __name__ == '__main__':
+    main()
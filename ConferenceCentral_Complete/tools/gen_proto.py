@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+
+"""
+gen_proto.py -- writes clients/conference.proto, the protocol buffer
+    definitions of every ConferenceApi method and message, which native
+    clients compile with protoc to call /rpc/conference in binary; rerun
+    it after changing any endpoint or message
+
+usage: APPENGINE_SDK=/path/to/google_appengine \\
+    python tools/gen_proto.py [--check]
+
+"""
+
+import argparse
+import os
+import sys
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROTO_FILE = os.path.join(APP_DIR, 'clients', 'conference.proto')
+PACKAGE = 'conference'
+
+HEADER = '''\
+// Built by tools/gen_proto.py from the ConferenceApi messages; do not edit.
+//
+// POST a request message to /rpc/conference.<method> with Content-Type
+// application/x-protobuf; the response message comes back the same way.
+// Signed in calls carry the same OAuth2 bearer token as the JSON API.
+// Errors come back as HTTP errors with a protojson RpcStatus body.
+
+syntax = "proto2";
+
+package %s;
+''' % PACKAGE
+
+
+def protoName(name):
+    """CONF_GET_REQUEST -> ConfGetRequest"""
+    return ''.join(part.capitalize() for part in name.lower().split('_'))
+
+
+class Schema(object):
+    """Schema -- the messages and enums reachable from the API methods,
+    in the order they are first reached, with the proto name of each"""
+
+    def __init__(self, names):
+        # message class -> proto name; containers are named up front
+        self.names = dict(names)
+        self.messages = []
+        self.enums = []
+
+    def name(self, cls):
+        if cls not in self.names:
+            self.names[cls] = cls.__name__
+        return self.names[cls]
+
+    def add(self, cls):
+        from protorpc import messages
+        if cls in self.messages:
+            return
+        self.messages.append(cls)
+        for field in cls.all_fields():
+            if isinstance(field, messages.MessageField):
+                self.add(field.message_type)
+            elif (isinstance(field, messages.EnumField) and
+                    field.type not in self.enums):
+                self.enums.append(field.type)
+
+    def fieldType(self, field):
+        from protorpc import messages
+        if isinstance(field, messages.MessageField):
+            return self.name(field.message_type)
+        if isinstance(field, messages.EnumField):
+            return field.type.__name__
+        return field.variant.name.lower()
+
+
+def formatEnum(enum):
+    lines = ['enum %s {' % enum.__name__]
+    for value in sorted(enum, key=lambda v: v.number):
+        lines.append('  %s = %d;' % (value.name, value.number))
+    lines.append('}')
+    return lines
+
+
+def formatMessage(schema, cls):
+    lines = ['message %s {' % schema.name(cls)]
+    for field in sorted(cls.all_fields(), key=lambda f: f.number):
+        if field.repeated:
+            label = 'repeated'
+        elif field.required:
+            label = 'required'
+        else:
+            label = 'optional'
+        lines.append('  %s %s %s = %d;' % (
+            label, schema.fieldType(field), field.name, field.number))
+    lines.append('}')
+    return lines
+
+
+def buildProto():
+    """Return the text of conference.proto."""
+    import endpoints
+    import conference
+    from conference import ConferenceApi
+
+    # request containers are all classes named CombinedContainer, so they
+    # take the name of the module constant they are defined by
+    names = dict((value.combined_message_class, protoName(name))
+                 for name, value in vars(conference).items()
+                 if isinstance(value, endpoints.ResourceContainer))
+    schema = Schema(names)
+    methods = sorted(ConferenceApi.all_remote_methods().items())
+    for _, method in methods:
+        schema.add(method.remote.request_type)
+        schema.add(method.remote.response_type)
+
+    lines = [HEADER]
+    for enum in schema.enums:
+        lines.extend(formatEnum(enum) + [''])
+    for cls in schema.messages:
+        lines.extend(formatMessage(schema, cls) + [''])
+    lines.append('service %s {' % ConferenceApi.__name__)
+    for name, method in methods:
+        lines.append('  rpc %s (%s) returns (%s);' % (
+            name, schema.name(method.remote.request_type),
+            schema.name(method.remote.response_type)))
+    lines.append('}')
+    return '\n'.join(lines) + '\n'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--check', action='store_true',
+                        help='fail if clients/conference.proto is out of date')
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.join(APP_DIR, 'benchmarks'))
+    import harness
+    harness.fixSysPath()
+
+    proto = buildProto()
+    if args.check:
+        if (not os.path.isfile(PROTO_FILE) or
+                open(PROTO_FILE, 'rb').read() != proto):
+            sys.exit('clients/conference.proto is out of date; '
+                     'run tools/gen_proto.py')
+        return
+
+    directory = os.path.dirname(PROTO_FILE)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(PROTO_FILE, 'wb') as f:
+        f.write(proto)
+    print '%s: %d bytes' % (os.path.relpath(PROTO_FILE, APP_DIR), len(proto))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+
+"""
+index_report.py -- lists the datastore query shapes ConferenceApi can
+    generate, computes the composite indexes they need (with and without
+    zig-zag merge join), flags indexed properties no query uses, and
+    reports the per-entity write cost of index.yaml against the proposal
+
+usage: APPENGINE_SDK=/path/to/google_appengine \\
+    python tools/index_report.py [--index-yaml index.yaml] [--exact] \\
+    [--write-index-yaml proposed.yaml]
+
+"""
+
+import argparse
+import itertools
+import os
+import sys
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# queries outside _getQuery, by hand from the code: (kind, ancestor,
+# equality props, inequality prop, sort order, where)
+OTHER_QUERIES = [
+    ('Conference', False, (), 'seatsAvailable', ('seatsAvailable', 'name'),
+     'ConferenceApi._cacheAnnouncement (projection on name)'),
+    ('Conference', False, ('city', 'month', 'topics'), None, (),
+     'filterPlayground'),
+    ('Conference', True, (), None, (), 'getConferencesCreated, '
+     '_updateOrganizerName'),
+    ('Session', True, (), None, (), 'getConferenceSessions'),
+    ('Session', True, ('typeofSession',), None, (),
+     'getConferenceSessionsByType'),
+    ('Session', False, ('speakers',), None, (),
+     'getSessionsBySpeaker, _cacheFeaturedSpeakers'),
+    ('Session', True, (), 'startTime', ('startTime',),
+     'getSessionsBeforeTime, getSessionsAfterTime'),
+    ('Session', False, (), 'startTime', ('startTime',), 'task3Solution'),
+    ('Profile', False, (), None, (), '_migrateWishlists'),
+    ('WishList', False, (), None, (), 'buildRecommendations'),
+    ('SessionRecommendation', False, (), 'updated', ('updated',),
+     'buildRecommendations'),
+    ('PopularityShard', False, ('dirty',), None, (), 'sumDirtyCounters'),
+    ('PopularityTotal', False, (), 'wishlists', ('wishlists',),
+     'materializeTrending'),
+    ('PopularityTotal', False, (), 'registrations', ('registrations',),
+     'materializeTrending'),
+    ('PopularityTotal', False, ('conference',), None, (),
+     'materializeTrending'),
+    ('EndpointStats', False, (), 'flushed', ('flushed',), 'recentStats'),
+    ('MapperJob', False, (), None, ('started',), 'mapper.recentJobs'),
+    ('Conference', False, (), 'endDate', ('endDate',),
+     'archive.archiveFinishedConferences'),
+    ('Session', True, (), None, (), 'archive.archiveConference'),
+    ('ConferenceArchive', False, ('city', 'month', 'topics',
+                                  'maxAttendees'), None, (),
+     'archive.queryArchived (equality filters)'),
+    ('Conference', False, (), 'updated', ('updated',), 'export.exportBatch'),
+    ('Session', False, (), 'updated', ('updated',), 'export.exportBatch'),
+    ('Profile', False, (), 'updated', ('updated',), 'export.exportBatch'),
+    ('Conference', False, (), 'updated', ('updated',), 'sync'),
+    ('Session', False, (), 'updated', ('updated',), 'sync'),
+    ('ConferenceArchive', False, (), 'archived', ('archived',), 'sync'),
+] + [
+    ('ConferenceArchive', False, (), prop, (prop,),
+     'archive.queryArchived (inequality filters)')
+    for prop in ('city', 'topics', 'month', 'maxAttendees')
+]
+
+INDEX_YAML_HEADER = '''\
+# Not autogenerated by the dev_appserver: the Conference indexes rely on
+# zig-zag merge join, so queryConferences needs one (equality property,
+# sort order) index per filter instead of one index per filter combination.
+# Regenerate with: python tools/index_report.py --write-index-yaml index.yaml
+'''
+
+# sample value counts for repeated properties when costing a write
+SAMPLE_VALUES = {'topics': 2, 'typeofSession': 1, 'speakers': 1,
+                 'conferenceKeysToAttend': 3, 'sessionWishlistKeys': 0}
+
+
+def conferenceQueryShapes(fields):
+    """Every (kind, ancestor, equality, inequality, order, where) shape
+    ConferenceApi._getQuery can build from the filterable fields."""
+    shapes = []
+    fields = sorted(fields)
+    for size in range(len(fields) + 1):
+        for equality in itertools.combinations(fields, size):
+            shapes.append(('Conference', False, equality, None, ('name',),
+                           'queryConferences'))
+            for inequality in fields:
+                if inequality not in equality:
+                    shapes.append(('Conference', False, equality, inequality,
+                                   (inequality, 'name'), 'queryConferences'))
+    return shapes
+
+
+def neededIndexes(shape, merge_join):
+    """Return the composite indexes (kind, ancestor, props) a query shape
+    needs; an empty list means the built-in indexes serve it."""
+    kind, ancestor, equality, inequality, order, _ = shape
+    if not order or (order == (inequality,) and not equality and
+                     not ancestor):
+        # kind, ancestor, equality-only or single property inequality
+        # queries use the built-in indexes (merging them if needed)
+        return []
+    if not equality:
+        if len(order) == 1 and not ancestor:
+            return []
+        return [(kind, ancestor, tuple(order))]
+    if merge_join:
+        # zig-zag merge join: one index per equality property, all sharing
+        # the sort order as their suffix
+        return [(kind, ancestor, (prop,) + tuple(order)) for prop in equality]
+    return [(kind, ancestor, tuple(equality) + tuple(order))]
+
+
+def modelProps(model):
+    """Return {name: (indexed, value count)} for an ndb model class."""
+    props = {}
+    for name, prop in model._properties.items():
+        values = SAMPLE_VALUES.get(name, 2 if prop._repeated else 1)
+        props[name] = (bool(prop._indexed), values)
+    return props
+
+
+def writeCost(props, composites):
+    """Datastore writes for putting one new entity: 2 for the entity and
+    kind index, 2 per indexed property value (ascending and descending
+    built-in rows) and one per composite index row; repeated properties
+    multiply the rows of every composite index they are part of."""
+    cost = 2
+    for indexed, values in props.values():
+        if indexed:
+            cost += 2 * values
+    for _, _, index_props in composites:
+        rows = 1
+        for prop in index_props:
+            rows *= props.get(prop, (True, 1))[1]
+        cost += rows
+    return cost
+
+
+def loadIndexYaml(path):
+    """Return the composite indexes declared in an index.yaml."""
+    import yaml
+    with open(path) as f:
+        config = yaml.safe_load(f) or {}
+    return [(index['kind'], bool(index.get('ancestor')),
+             tuple(p['name'] for p in index.get('properties', [])))
+            for index in config.get('indexes') or []]
+
+
+def indexYaml(indexes):
+    """Render composite indexes as index.yaml entries."""
+    lines = [INDEX_YAML_HEADER, 'indexes:', '']
+    for kind, ancestor, props in indexes:
+        lines.append('- kind: %s' % kind)
+        if ancestor:
+            lines.append('  ancestor: yes')
+        lines.append('  properties:')
+        lines.extend('  - name: %s' % prop for prop in props)
+        lines.append('')
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--index-yaml',
+                        default=os.path.join(APP_DIR, 'index.yaml'))
+    parser.add_argument('--exact', action='store_true',
+                        help='one exact index per shape, no merge join')
+    parser.add_argument('--write-index-yaml',
+                        help='write the proposed index set here')
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.join(APP_DIR, 'benchmarks'))
+    import harness
+    harness.fixSysPath()
+    import models
+    from conference import FIELDS
+
+    shapes = conferenceQueryShapes(FIELDS.values()) + OTHER_QUERIES
+    proposed = []
+    queried = set()
+    print '%d query shapes' % len(shapes)
+    for shape in shapes:
+        kind, ancestor, equality, inequality, order, where = shape
+        filtered = equality + tuple(order)
+        if inequality:
+            filtered += (inequality,)
+        queried.update((kind, prop) for prop in filtered)
+        for index in neededIndexes(shape, not args.exact):
+            if index not in proposed:
+                proposed.append(index)
+
+    current = loadIndexYaml(args.index_yaml)
+    unused = [index for index in current if index not in proposed]
+    print '%d composite indexes in %s, %d proposed, %d unused' % (
+        len(current), os.path.basename(args.index_yaml), len(proposed),
+        len(unused))
+    for kind, ancestor, props in unused:
+        print '  unused: %s%s %s' % (kind, ' (ancestor)' if ancestor else '',
+                                     ', '.join(props))
+
+    print
+    print '%-22s %-34s %8s %8s' % ('kind', 'indexed, never queried',
+                                   'current', 'proposed')
+    for kind in ('Conference', 'Session', 'Profile', 'WishList'):
+        props = modelProps(getattr(models, kind))
+        idle = sorted(name for name, (indexed, _) in props.items()
+                      if indexed and (kind, name) not in queried)
+        trimmed = dict((name, (indexed and name not in idle, values))
+                       for name, (indexed, values) in props.items())
+        before = writeCost(props, [i for i in current if i[0] == kind])
+        after = writeCost(trimmed, [i for i in proposed if i[0] == kind])
+        print '%-22s %-34s %8d %8d' % (kind, ', '.join(idle) or '-',
+                                       before, after)
+
+    if args.write_index_yaml:
+        with open(args.write_index_yaml, 'w') as f:
+            f.write(indexYaml(proposed))
+
+
+if __name__ == '__main__':
+    main()